@@ -0,0 +1,163 @@
+import time
+import math
+import threading
+
+
+class BroadcastScheduler:
+    """
+    Diffusion Socket.IO regroupee: les handlers HTTP ne font que publish() (on garde la derniere valeur
+    par topic, O(1)), et une tache de fond emet a frequence fixe par topic et par classe de clients.
+    Une valeur remplacee avant d'avoir ete emise est abandonnee.
+
+    rates: {topic: {classe de clients: frequence en Hz}}, ex: {'sensor_update': {'dashboard': 10}}
+    namespaces: {classe de clients: namespace Socket.IO} (None = namespace par defaut)
+    rooms: {classe de clients: room Socket.IO dans ce namespace} (None = tous les clients du namespace)
+    encoders: {classe de clients: fonction (topic, data) -> payload} (par defaut data tel quel, en JSON),
+              appelee une fois par emission et par classe, pas par client
+    Les evenements critiques (commande moteur, crash) ne passent pas par ici et sont emis directement.
+    """
+
+    def __init__(self, socketio, rates, namespaces=None, rooms=None, encoders=None):
+        self.socketio = socketio
+        self.namespaces = namespaces or {}
+        self.rooms = rooms or {}
+        self.encoders = encoders or {}
+        self._lock = threading.Lock()
+        self._latest = {}  # topic -> (version, data)
+
+        # Un canal par (topic, classe de clients), avec sa propre periode et la derniere version emise
+        self._channels = []
+        for topic, class_rates in rates.items():
+            for client_class, rate in class_rates.items():
+                self._channels.append({
+                    'topic': topic,
+                    'client_class': client_class,
+                    'period': 1.0 / rate,
+                    'next_flush': 0.0,
+                    'sent_version': 0,
+                })
+        self._tick = common_tick([rate for class_rates in rates.values() for rate in class_rates.values()])
+        self._started = False  # tache de fond lancee
+
+        self.nb_published = 0
+        self.nb_emitted = 0
+
+    def publish(self, topic, data):
+        with self._lock:
+            version = self._latest[topic][0] + 1 if topic in self._latest else 1
+            self._latest[topic] = (version, data)
+            self.nb_published += 1
+            start = not self._started
+            self._started = True
+        # La tache de fond demarre a la premiere publication, une fois le serveur lance
+        if start:
+            self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        # Reveils sur une grille fixe de ticks, et flush() a l'heure nominale du tick: les echeances tombent
+        # exactement sur un tick, le retard de reveil ne decale pas les suivantes
+        start = time.monotonic()
+        index = 0
+        while True:
+            self.flush(start + index * self._tick)
+            index += 1
+            now = time.monotonic()
+            # En retard de plusieurs ticks: on saute ceux qui sont passes
+            index = max(index, int((now - start) / self._tick))
+            self.socketio.sleep(max(start + index * self._tick - now, 0.0))
+
+    def flush(self, now=None):
+        now = time.monotonic() if now is None else now
+        to_emit = []
+        with self._lock:
+            for channel in self._channels:
+                # (marge pour les arrondis: l'echeance est un multiple exact du tick)
+                if now < channel['next_flush'] - 1e-9 or channel['topic'] not in self._latest:
+                    continue
+                version, data = self._latest[channel['topic']]
+                if version == channel['sent_version']:
+                    continue
+                channel['sent_version'] = version
+                # Jamais deux emissions a moins d'une periode, y compris au reveil d'un canal inactif. Le tick
+                # divise la periode (common_tick): un canal alimente en continu emet exactement a sa frequence
+                channel['next_flush'] = now + channel['period']
+                to_emit.append((channel, data))
+
+        # Emission hors du verrou, pour que publish() ne soit jamais bloque par un client lent
+        for channel, data in to_emit:
+            client_class = channel['client_class']
+            if client_class in self.encoders:
+                data = self.encoders[client_class](channel['topic'], data)
+            self.socketio.emit(channel['topic'], data,
+                               to=self.rooms.get(client_class),
+                               namespace=self.namespaces.get(client_class))
+            self.nb_emitted += 1
+
+    def stats(self):
+        return {
+            'published': self.nb_published,
+            'emitted': self.nb_emitted,
+        }
+
+
+def common_tick(rates, max_tick_rate=240):
+    """
+    Periode du tick de diffusion: 1 / ppcm des frequences (entieres) pour que chaque periode soit un nombre entier
+    de ticks (ex: 10, 20 et 30 Hz -> tick a 60 Hz). A defaut (frequences non entieres, ppcm trop grand), la plus
+    petite periode: les autres canaux emettent alors au plus a leur frequence, arrondie au tick superieur.
+    """
+    if not rates:
+        return 0.05
+    if all(float(rate).is_integer() for rate in rates):
+        tick_rate = math.lcm(*(int(rate) for rate in rates))
+        if tick_rate <= max_tick_rate:
+            return 1.0 / tick_rate
+    return 1.0 / max(rates)
+
+
+def check_rate_cap(duration=3.0):
+    """
+    Verifie sur une horloge simulee (un flush() par tick) que chaque canal respecte sa frequence: publications
+    continues, silence, rafale apres le silence, publications entre deux ticks. Leve AssertionError sinon.
+    """
+    class Recorder:
+        def __init__(self):
+            self.emitted = []  # (topic, heure simulee)
+            self.now = 0.0
+
+        def emit(self, topic, data, to=None, namespace=None):
+            self.emitted.append((topic, self.now))
+
+    recorder = Recorder()
+    rates = {'fast': {'dashboard': 20}, 'slow': {'dashboard': 10}, 'odd': {'dashboard': 7}}
+    scheduler = BroadcastScheduler(recorder, rates)
+    scheduler._started = True  # pas de tache de fond: les flush() sont appeles ici
+
+    nb_ticks = int(duration / scheduler._tick)
+    for i in range(nb_ticks):
+        recorder.now = i * scheduler._tick
+        t = recorder.now / duration
+        # Actif, puis silence de 0.37 duree, puis rafale; 'odd' publie aussi entre deux ticks
+        if t < 0.3 or t >= 0.67:
+            for topic in rates:
+                scheduler.publish(topic, i)
+        if i % 3 == 1:
+            scheduler.publish('odd', -i)
+        scheduler.flush(recorder.now)
+
+    for topic, class_rates in rates.items():
+        times = [now for emitted_topic, now in recorder.emitted if emitted_topic == topic]
+        period = 1.0 / class_rates['dashboard']
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        assert min(gaps) >= period - 1e-9, f"{topic}: emissions a {1000 * min(gaps):.1f} ms d'intervalle " \
+                                           f"(periode {1000 * period:.1f} ms)"
+        # Pendant la phase active la frequence configuree est atteinte (pas arrondie au tick superieur)
+        active = [now for now in times if now < 0.3 * duration]
+        assert len(active) >= math.floor(0.3 * duration / period), \
+            f"{topic}: {len(active)} emissions en phase active"
+        print(f"[Broadcast] {topic:5s} {class_rates['dashboard']:3d} Hz: {len(times)} emissions, "
+              f"intervalle min {1000 * min(gaps):.1f} ms (periode {1000 * period:.1f} ms)")
+
+
+if __name__ == "__main__":
+    check_rate_cap()
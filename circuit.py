@@ -1,6 +1,9 @@
 import pyray as raylib
 import math
+import os
 import collections
+import hashlib
+import numpy as np
 from enum import Enum
 
 LONG_SECTION_LENGTH = 34.2
@@ -9,6 +12,10 @@ CIRCUIT_WIDTH = SHORT_SECTION_LENGTH
 TURN_RADIUS = 17.1 # (3*SHORT_SECTION_LENGTH)/2, millieu entre le inside radius qui est de 1*SHORT_SECTION_LENGTH et outside radius qui est de 2*SHORT_SECTION_LENGTH
 TURN_LENGTH = math.pi * TURN_RADIUS / 2  # 90 degrees = π/2 radians
 
+# Format des tables position -> distance en cache (a incrementer a chaque changement de forme ou de dtype des
+# grilles): un fichier d'un autre format n'est pas relu
+POSITION_LOOKUP_VERSION = 2
+
 class SectionType(Enum):
     LONG = 1
     SHORT = 2
@@ -21,13 +28,21 @@ class Circuit:
     # Ce n'est pas equivalent a la distance vraiment parcourue par les voitures qui sont légerement excentrées
     # Le rail interieur est un peu plus court que le rail exterieur
 
-    def __init__(self, sections):
+    def __init__(self, sections, cache_dir=None):
+        """
+        cache_dir: si donne, la table position -> distance sur le rail (quelques secondes de calcul) y est
+                   sauvegardee au premier lancement puis relue, cle = get_section_hash()
+        """
         self.sections = sections # Liste de sections
         self._section_data = self._precompute_sections()
         self._length = self._get_circuit_length()
         self._inside_rail_length = self._get_rail_length(True)
         self._outside_rail_length = self._get_rail_length(False)
-        self._position_lookup = self._precompute_position_lookup()
+        self._position_lookup = self._load_position_lookup(cache_dir)
+
+    def get_section_hash(self):
+        # Identifiant stable du circuit, ne depend que de la suite de sections
+        return hashlib.sha1(','.join(section.name for section in self.sections).encode()).hexdigest()[:16]
 
     def draw(self):
         self._draw_circuit_outlines()
@@ -104,9 +119,9 @@ class Circuit:
         grid_y = int((y - min_y) / resolution)
 
         grid = self._position_lookup[rail_name]
-        if 0 <= grid_x < len(grid[0]) and 0 <= grid_y < len(grid):
-            distance = grid[grid_y][grid_x]
-            return distance if distance != float('inf') else None
+        if 0 <= grid_x < grid.shape[1] and 0 <= grid_y < grid.shape[0]:
+            distance = grid[grid_y, grid_x]
+            return int(distance) if distance >= 0 else None
 
         return None
     
@@ -289,6 +304,21 @@ class Circuit:
             return tangent
 
         
+    def _load_position_lookup(self, cache_dir):
+        if cache_dir is None:
+            return self._precompute_position_lookup()
+
+        path = os.path.join(cache_dir, f"position_lookup_v{POSITION_LOOKUP_VERSION}_{self.get_section_hash()}.npz")
+        if os.path.exists(path):
+            with np.load(path) as cached:
+                return {'inside': cached['inside'], 'outside': cached['outside'],
+                        'bounds': tuple(cached['bounds'])}
+
+        lookup = self._precompute_position_lookup()
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez_compressed(path, inside=lookup['inside'], outside=lookup['outside'], bounds=lookup['bounds'])
+        return lookup
+
     def _precompute_position_lookup(self, sample_width=1000, sample_height=1000, resolution=1):
         inside_grid = [[None for _ in range(sample_width)] for _ in range(sample_height)]
         outside_grid = [[None for _ in range(sample_width)] for _ in range(sample_height)]
@@ -325,9 +355,14 @@ class Circuit:
                     if current_grid[ny][nx] is None:  # First one to reach wins
                         current_grid[ny][nx] = rail_param
                         queue.append((nx, ny, source_rail, rail_param)) 
+
+        # Grilles en int32, -1 pour une case non atteinte
+        def to_array(grid):
+            return np.array([[-1 if d is None else d for d in row] for row in grid], dtype=np.int32)
+
         return {
-            'inside': inside_grid,
-            'outside': outside_grid,
+            'inside': to_array(inside_grid),
+            'outside': to_array(outside_grid),
             'bounds': (0, 0, 1)
         }
 
@@ -0,0 +1,260 @@
+import time
+import socket
+import struct
+import argparse
+import threading
+import collections
+
+# Canal de commande moteur en UDP, relaye par le serveur: agent -> relais -> controleur(s).
+# Evite le POST HTTP /control + le handler Flask + l'emit Socket.IO pour chaque action.
+#
+# Chaque datagramme fait 20 octets: magic (4s), numero de sequence (u32), heure d'envoi de l'agent (f64), duty cycle (f32)
+#   CMD_MAGIC   agent -> relais -> controleurs
+#   ACK_MAGIC   controleur -> relais -> agent, reprend la sequence et l'heure d'envoi (mesure de latence aller-retour)
+#   HELLO_MAGIC controleur -> relais, enregistrement (renvoye periodiquement)
+# Le dernier numero de sequence gagne: relais et controleurs ignorent une commande plus vieille que la derniere appliquee.
+
+PACKET = struct.Struct('<4sIdf')
+CMD_MAGIC = b'RCMD'
+ACK_MAGIC = b'RACK'
+HELLO_MAGIC = b'RHEL'
+
+DEFAULT_PORT = 5005
+
+
+class CommandRelay:
+    """Relais (cote serveur): transmet les commandes aux controleurs enregistres et les acquittements a l'agent"""
+
+    def __init__(self, host='0.0.0.0', port=DEFAULT_PORT, controller_timeout=5.0, on_command=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.address = self.sock.getsockname()
+        self.controller_timeout = controller_timeout
+        self.on_command = on_command  # appele avec (seq, duty_cycle) apres chaque commande relayee
+
+        self._controllers = {}  # adresse -> heure du dernier hello
+        self._agent = None
+        self._last_seq = -1
+        self._stop = threading.Event()
+
+        self.nb_commands = 0
+        self.nb_stale = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="CommandRelay", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.sock.close()
+
+    def serve_forever(self):
+        while not self._stop.is_set():
+            try:
+                packet, address = self.sock.recvfrom(PACKET.size)
+            except OSError:
+                return
+            if len(packet) != PACKET.size:
+                continue
+            magic, seq, sent_at, duty_cycle = PACKET.unpack(packet)
+            now = time.monotonic()
+
+            if magic == CMD_MAGIC:
+                self._agent = address
+                # Un agent qui redemarre repart de 0
+                if seq <= self._last_seq and seq != 0:
+                    self.nb_stale += 1
+                    continue
+                self._last_seq = seq
+                self.nb_commands += 1
+                for controller, last_seen in list(self._controllers.items()):
+                    if now - last_seen > self.controller_timeout:
+                        del self._controllers[controller]
+                    else:
+                        self.sock.sendto(packet, controller)
+                if self.on_command is not None:
+                    self.on_command(seq, duty_cycle)
+
+            elif magic == ACK_MAGIC:
+                self._controllers[address] = now
+                if self._agent is not None:
+                    self.sock.sendto(packet, self._agent)
+
+            elif magic == HELLO_MAGIC:
+                if address not in self._controllers:
+                    print(f"[CommandRelay] Controller registered: {address}")
+                self._controllers[address] = now
+
+
+class CommandSender:
+    """
+    Cote agent: send() part immediatement (pas d'attente de reponse). Un thread recoit les acquittements
+    pour mesurer la latence aller-retour, et renvoie la derniere commande si elle n'est pas acquittee
+    au bout de retransmit_timeout (le dernier ordre, ex: l'arret, ne doit pas se perdre).
+    """
+
+    def __init__(self, relay_address, retransmit_timeout=0.05, history_size=1000):
+        self.relay_address = relay_address
+        self.retransmit_timeout = retransmit_timeout
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(retransmit_timeout)
+
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._last_packet = None
+        self._last_sent = 0.0
+        self._acked_seq = -1
+        self._rtts = collections.deque(maxlen=history_size)
+        self.last_rtt = None
+        self.nb_sent = 0
+        self.nb_retransmits = 0
+
+        self._stop = threading.Event()
+        threading.Thread(target=self._receive_loop, name="CommandSender", daemon=True).start()
+
+    def send(self, duty_cycle):
+        with self._lock:
+            seq = self._seq
+            self._seq += 1
+            packet = PACKET.pack(CMD_MAGIC, seq, time.perf_counter(), duty_cycle)
+            self._last_packet = packet
+            self._last_sent = time.monotonic()
+            self.nb_sent += 1
+        self.sock.sendto(packet, self.relay_address)
+        return seq
+
+    def _receive_loop(self):
+        while not self._stop.is_set():
+            try:
+                packet, _ = self.sock.recvfrom(PACKET.size)
+                magic, seq, sent_at, _ = PACKET.unpack(packet)
+                if magic == ACK_MAGIC:
+                    rtt = time.perf_counter() - sent_at
+                    with self._lock:
+                        self._rtts.append(rtt)
+                        self.last_rtt = rtt
+                        self._acked_seq = max(self._acked_seq, seq)
+            except socket.timeout:
+                pass
+            except OSError:
+                return
+
+            with self._lock:
+                packet = self._last_packet
+                unacked = packet is not None and self._acked_seq < self._seq - 1
+                late = time.monotonic() - self._last_sent > self.retransmit_timeout
+                if unacked and late:
+                    self._last_sent = time.monotonic()
+                    self.nb_retransmits += 1
+            if packet is not None and unacked and late:
+                self.sock.sendto(packet, self.relay_address)
+
+    def stats(self):
+        with self._lock:
+            rtts = sorted(self._rtts)
+            stats = {'sent': self.nb_sent, 'acked': len(self._rtts), 'retransmits': self.nb_retransmits}
+
+        def percentile(p):
+            if not rtts:
+                return None
+            return rtts[min(int(p / 100 * len(rtts)), len(rtts) - 1)] * 1000.0
+
+        stats.update({'rtt_p50_ms': percentile(50), 'rtt_p95_ms': percentile(95), 'rtt_p99_ms': percentile(99)})
+        return stats
+
+    def close(self):
+        self._stop.set()
+        self.sock.close()
+
+
+class CommandReceiver:
+    """Cote controleur: s'enregistre aupres du relais, applique les commandes (la plus recente gagne) et les acquitte"""
+
+    def __init__(self, relay_address, on_command, hello_interval=1.0):
+        self.relay_address = relay_address
+        self.on_command = on_command  # appele avec le duty cycle
+        self.hello_interval = hello_interval
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(hello_interval)
+        self._last_seq = -1
+        self._stop = threading.Event()
+        self.nb_applied = 0
+        self.nb_stale = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="CommandReceiver", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.sock.close()
+
+    def _hello(self):
+        self.sock.sendto(PACKET.pack(HELLO_MAGIC, 0, 0.0, 0.0), self.relay_address)
+
+    def serve_forever(self):
+        self._hello()
+        last_hello = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                packet, _ = self.sock.recvfrom(PACKET.size)
+                magic, seq, sent_at, duty_cycle = PACKET.unpack(packet)
+                if magic == CMD_MAGIC:
+                    # L'acquittement part meme pour une commande ignoree, pour que l'agent arrete de la renvoyer
+                    self.sock.sendto(PACKET.pack(ACK_MAGIC, seq, sent_at, duty_cycle), self.relay_address)
+                    if seq > self._last_seq or seq == 0:
+                        self._last_seq = seq
+                        self.on_command(duty_cycle)
+                        self.nb_applied += 1
+                    else:
+                        self.nb_stale += 1
+            except socket.timeout:
+                pass
+            except OSError:
+                return
+
+            if time.monotonic() - last_hello > self.hello_interval:
+                self._hello()
+                last_hello = time.monotonic()
+
+
+def benchmark(nb_commands=2000, rate=200):
+    """Relais + controleur factice + agent en local, sans materiel: mesure la latence aller-retour"""
+    relay = CommandRelay(host='127.0.0.1', port=0).start()
+    applied = []
+    receiver = CommandReceiver(relay.address, applied.append).start()
+    time.sleep(0.1)  # enregistrement du controleur
+
+    sender = CommandSender(relay.address)
+    period = 1.0 / rate
+    for i in range(nb_commands):
+        sender.send((i % 100) * 0.95)
+        time.sleep(period)
+    time.sleep(0.2)
+
+    stats = sender.stats()
+    print(f"[CommandChannel] {stats['sent']} commandes, {stats['acked']} acquittees, {len(applied)} appliquees, "
+          f"{stats['retransmits']} renvois")
+    print(f"[CommandChannel] RTT p50 {stats['rtt_p50_ms']:.3f} ms / p95 {stats['rtt_p95_ms']:.3f} ms / "
+          f"p99 {stats['rtt_p99_ms']:.3f} ms")
+    sender.close()
+    receiver.stop()
+    relay.stop()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Canal de commande moteur UDP")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    bench = subparsers.add_parser('bench', help="Benchmark local (relais + controleur factice)")
+    bench.add_argument('--commands', type=int, default=2000)
+    bench.add_argument('--rate', type=float, default=200)
+    fake = subparsers.add_parser('fake-controller', help="Controleur factice qui affiche les commandes recues")
+    fake.add_argument('--relay', type=str, default=f"127.0.0.1:{DEFAULT_PORT}")
+    args = parser.parse_args()
+
+    if args.mode == 'bench':
+        benchmark(args.commands, args.rate)
+    else:
+        host, port = args.relay.split(':')
+        CommandReceiver((host, int(port)), lambda duty_cycle: print(f"[FakeController] PWM set to {duty_cycle}%")).serve_forever()
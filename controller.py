@@ -1,12 +1,21 @@
 import socketio
 import RPi.GPIO as GPIO
+from command_channel import CommandReceiver
 
 
 MOTOR_PIN = 18       # Broche GPIO utilisée pour le PWM
 PWM_FREQUENCY = 800  # Fréquence du PWM en Hz
 
+# Namespaces Socket.IO du serveur (voir server.py)
+CONTROL_NAMESPACE = '/control'
+TELEMETRY_NAMESPACE = '/telemetry'
+
 class RailCarController:
-    def __init__(self, server_url):
+    def __init__(self, server_url, track_voltage=False, command_relay=None):
+        """
+        command_relay: adresse (hote, port) du relais UDP du serveur (voir command_channel.py). Les commandes
+                       y arrivent sans passer par Flask ni Socket.IO; motor_control reste ecoute en parallele.
+        """
         # Socket.IO client setup
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(MOTOR_PIN, GPIO.OUT)
@@ -17,18 +26,29 @@ class RailCarController:
 
         self.sio = socketio.Client()
         self.server_url = server_url
-        self.sio.on('update_plot', self._on_sensor_update)
-        self.sio.on('motor_control', self._on_motor_control)
+        # Par defaut on ne s'abonne qu'aux commandes moteur, la telemetrie n'est recue que si on la demande
+        self.namespaces = [CONTROL_NAMESPACE]
+        self.sio.on('motor_control', self._on_motor_control, namespace=CONTROL_NAMESPACE)
+        if track_voltage:
+            self.namespaces.append(TELEMETRY_NAMESPACE)
+            self.sio.on('update_plot', self._on_sensor_update, namespace=TELEMETRY_NAMESPACE)
 
         self.last_voltage = 0.0
         self.current_duty_cycle = 0.0
 
+        self.command_receiver = None
+        if command_relay is not None:
+            self.command_receiver = CommandReceiver(command_relay, self._set_duty_cycle)
+
         
     def connect(self):
         # Connect to Socket.IO server
         # Register callback for 'update_plot' event
-        self.sio.connect(self.server_url)
+        self.sio.connect(self.server_url, namespaces=self.namespaces)
         print(f"[Controller] Connected to {self.server_url}")
+        if self.command_receiver is not None:
+            self.command_receiver.start()
+            print(f"[Controller] Listening for commands from relay {self.command_receiver.relay_address}")
         
     def _on_sensor_update(self, data):
         # Callback pour Socket.IO
@@ -39,13 +59,17 @@ class RailCarController:
             print(f"[Controller] Error parsing voltage: {e}")
 
     def _on_motor_control(self, data):
-        duty_cycle = data.get('duty_cycle', 0.0)
+        self._set_duty_cycle(data.get('duty_cycle', 0.0))
+
+    def _set_duty_cycle(self, duty_cycle):
         self.current_duty_cycle = duty_cycle
         self.pwm.ChangeDutyCycle(duty_cycle)
         
     def cleanup(self):
         # Stop PWM, cleanup GPIO
         # Disconnect Socket.IO
+        if self.command_receiver is not None:
+            self.command_receiver.stop()
         self.pwm.stop()
         GPIO.cleanup()
         self.sio.disconnect()
@@ -1,6 +1,9 @@
 import socketio
 import RPi.GPIO as GPIO
 import time
+from command_channel import CommandReceiver, DEFAULT_PORT as COMMAND_PORT
+
+SERVER_HOST = "10.98.93.56"
 
 def run_controller():
     # GPIO setup
@@ -12,14 +15,19 @@ def run_controller():
     # Socket.IO client
     sio = socketio.Client()
 
-    @sio.on('motor_control')
+    # Seul le namespace /control est ecoute: pas de telemetrie sur le Wi-Fi du Pi
+    @sio.on('motor_control', namespace='/control')
     def on_motor_control(data):
         duty_cycle = data.get('duty_cycle', 0.0)
         pwm.ChangeDutyCycle(duty_cycle)
         print(f"[Controller] PWM set to {duty_cycle}%")
 
+    # Canal UDP direct (command_channel.py): pas de print par commande, elles arrivent a la cadence de l'agent
+    receiver = CommandReceiver((SERVER_HOST, COMMAND_PORT), pwm.ChangeDutyCycle)
+
     try:
-        sio.connect("http://10.98.93.56:5000")
+        sio.connect(f"http://{SERVER_HOST}:5000", namespaces=['/control'])
+        receiver.start()
         print("[Controller] Connected, listening for commands...")
 
         # Keep alive loop
@@ -29,6 +37,7 @@ def run_controller():
     except KeyboardInterrupt:
         print("[Controller] Shutting down...")
     finally:
+        receiver.stop()
         pwm.stop()
         GPIO.cleanup()
         sio.disconnect()
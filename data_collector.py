@@ -1,7 +1,11 @@
 from gymenv import *
 import time
-import json
 import math
+import itertools
+from contextlib import nullcontext
+from datalog import CarDataLogWriter, open_log
+from experiment_store import ExperimentStore
+from scheduler import FixedRateScheduler
 from circuit import SectionType as ST
 from circuit import *
 
@@ -13,44 +17,62 @@ round_circuit = Circuit([
 
 class CarDataCollector:
 
-    def __init__(self, circuit, is_inside_rail, endpoint):
+    def __init__(self, circuit, is_inside_rail, endpoint, store=None):
 
+        self.circuit = circuit
+        self.is_inside_rail = is_inside_rail
+        self.store = store # ExperimentStore optionnel ou les runs sont indexes a la fin de chaque collecte
         self.env = RailCarRealEnv(circuit, is_inside_rail=is_inside_rail, endpoint=endpoint)
         self.env.reset()
 
 
 
 
-    def collect_data(self, pattern):
+    def collect_data(self, pattern, frequency=None, overrun_policy='skip'):
         """
         pattern is a function that takes in a timestamp and returns a value between 0 and 1
+        Les echantillons sont ecrits au fil de l'eau dans output/<date>.bin (voir datalog.py)
+        frequency: si donnee, les pas sont cadences a frequence fixe (voir FixedRateScheduler),
+        sinon on enchaine les pas aussi vite que le reseau le permet
         """
 
         start_time =  time.time()
-        collected_data = {}
+        date_str = time.strftime('%Y_%m_%d_%H%M%S', time.localtime(start_time))
+        log_path = 'output/' + date_str + '.bin'
 
-        crashed = False
-        try:
-            while not crashed:
-                curr_time =  time.time() - start_time
-                input = pattern(curr_time)
-                obs, reward, crashed, _, info = self.env.step([input])
-
-                info = info['state']
+        scheduler = FixedRateScheduler(frequency, overrun_policy) if frequency else None
+        ticks = scheduler.ticks() if scheduler else itertools.count()
+        phase = scheduler.phase if scheduler else (lambda name: nullcontext())
 
+        crashed = False
+        with CarDataLogWriter(log_path, start_time=start_time) as log:
+            try:
+                for _ in ticks:
+                    curr_time =  time.time() - start_time
+                    input = pattern(curr_time)
+                    with phase('env_step'):
+                        obs, reward, crashed, _, info = self.env.step([input])
 
-                collected_data[curr_time] = {'input': input, 'rail_distance': info['rail_distance'], 'nb_turns': info['nb_turns'], 'crashed': crashed}
-            
+                    info = info['state']
 
+                    with phase('log'):
+                        log.append(curr_time, input, info['rail_distance'], info['nb_turns'], info['voltage'], crashed)
+                    if crashed:
+                        break
+            except Exception as e:
+                # Les echantillons deja recus sont sur le disque, on les garde
+                print(f"[CarDataCollector] Collecte interrompue: {e}")
 
+        if scheduler:
+            scheduler.print_stats("[CarDataCollector]")
 
+        print(f"[CarDataCollector] {log.nb_records} echantillons enregistres dans {log_path}")
 
-            date_str = time.strftime('%Y_%m_%d_%H%M%S', time.localtime(start_time))
-        except:
-            date_str = time.strftime('%Y_%m_%d_%H%M%S', time.localtime(start_time))
+        if self.store is not None and log.nb_records > 0:
+            _, records = open_log(log_path)
+            self.store.add_run(records, pattern.__name__, self.circuit, self.is_inside_rail, start_time, source=log_path)
 
-        with open('output/' + date_str + '.json', 'w') as file:
-            json.dump(collected_data, file)
+        return log_path
 
 
 
@@ -97,7 +119,7 @@ if __name__ == "__main__":
         return 1
 
     
-    data_collector = CarDataCollector(round_circuit, True, "http://10.135.180.56:5000")
+    data_collector = CarDataCollector(round_circuit, True, "http://10.135.180.56:5000", store=ExperimentStore())
 
     """
     for i in range(3):
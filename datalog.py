@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+
+# Format de log binaire des experiences: un en-tete fixe suivi d'enregistrements de taille fixe, ajoutes au fil de l'eau.
+# Un arret brutal ne fait perdre que les enregistrements pas encore flushés (et au pire un enregistrement tronqué,
+# ignoré a la lecture).
+
+LOG_MAGIC = b'RAILCLOG'
+LOG_VERSION = 1
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('record_size', '<u4'),
+    ('start_time', '<f8'),  # timestamp unix du debut de l'experience
+])
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),  # secondes depuis start_time
+    ('input', '<f4'),
+    ('rail_distance', '<f4'),
+    ('nb_turns', '<i4'),
+    ('voltage', '<f4'),  # NaN si inconnue (anciens fichiers JSON)
+    ('crashed', 'u1'),
+])
+
+
+class CarDataLogWriter:
+    """
+    Ecrit les enregistrements dans un buffer numpy et l'ajoute au fichier quand il est plein
+    ou toutes les flush_interval secondes.
+    """
+
+    def __init__(self, path, start_time=None, buffer_size=256, flush_interval=1.0, fsync=False):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.start_time = time.time() if start_time is None else start_time
+
+        self._buffer = np.zeros(buffer_size, dtype=RECORD_DTYPE)
+        self._count = 0
+        self._last_flush = time.monotonic()
+        self.nb_records = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'wb')
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = LOG_MAGIC
+        header['version'] = LOG_VERSION
+        header['record_size'] = RECORD_DTYPE.itemsize
+        header['start_time'] = self.start_time
+        self._file.write(header.tobytes())
+        self._file.flush()
+
+    def append(self, timestamp, input, rail_distance, nb_turns, voltage=float('nan'), crashed=False):
+        self._buffer[self._count] = (timestamp, input, rail_distance, nb_turns, voltage, crashed)
+        self._count += 1
+        self.nb_records += 1
+
+        if self._count == len(self._buffer) or time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._count > 0:
+            self._file.write(self._buffer[:self._count].tobytes())
+            self._count = 0
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_header(path):
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header['magic'][0] != LOG_MAGIC:
+        raise ValueError(f"{path} n'est pas un log d'experience")
+    if header['version'][0] != LOG_VERSION or header['record_size'][0] != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path}: version {header['version'][0]} non supportee")
+    return {'version': int(header['version'][0]), 'start_time': float(header['start_time'][0])}
+
+
+def open_log(path):
+    """
+    Ouvre un log en lecture seule via np.memmap, sans charger les donnees.
+    Retourne (en-tete, enregistrements). Un enregistrement final tronque (crash pendant l'ecriture) est ignore.
+    """
+    header = read_header(path)
+    nb_records = (os.path.getsize(path) - HEADER_DTYPE.itemsize) // RECORD_DTYPE.itemsize
+    if nb_records == 0:
+        return header, np.zeros(0, dtype=RECORD_DTYPE)
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize, shape=(nb_records,))
+    return header, records
+
+
+def log_to_experiment(records):
+    """Convertit des enregistrements au format dict {str(timestamp): {...}} utilise par sim_optimizer"""
+    return {
+        str(float(r['timestamp'])): {
+            'input': float(r['input']),
+            'rail_distance': float(r['rail_distance']),
+            'nb_turns': int(r['nb_turns']),
+            'voltage': float(r['voltage']),
+            'crashed': bool(r['crashed']),
+        }
+        for r in records
+    }
+
+
+def json_to_log(json_path, log_path=None):
+    """Convertit un ancien fichier JSON de CarDataCollector (output/<date>.json) en log binaire"""
+    if log_path is None:
+        log_path = os.path.splitext(json_path)[0] + '.bin'
+
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+
+    # Le nom de fichier est la date de debut de l'experience
+    try:
+        date_str = os.path.splitext(os.path.basename(json_path))[0]
+        start_time = time.mktime(time.strptime(date_str, '%Y_%m_%d_%H%M%S'))
+    except ValueError:
+        start_time = 0.0
+
+    timestamps = sorted(data.keys(), key=float)
+    with CarDataLogWriter(log_path, start_time=start_time, buffer_size=max(len(timestamps), 1)) as log:
+        for t in timestamps:
+            sample = data[t]
+            log.append(float(t), sample['input'], sample['rail_distance'], sample['nb_turns'],
+                       sample.get('voltage', float('nan')), sample['crashed'])
+    return log_path
+
+
+if __name__ == "__main__":
+    # python datalog.py output/*.json
+    for json_path in sys.argv[1:]:
+        print(f"{json_path} -> {json_to_log(json_path)}")
@@ -0,0 +1,191 @@
+import time
+import threading
+import collections
+
+# Statistiques d'entrainement par episode, calculees cote serveur a chaque pas recu (O(1) par pas):
+# le dashboard recoit des resumes au lieu de chaque transition.
+
+
+class EpisodeAggregator:
+    """
+    Un episode se termine sur un pas crashed=True, ou quand le numero d'episode des pas change.
+    Moyennes glissantes sur les `window` derniers episodes termines (sommes tenues a jour, pas de parcours).
+    action_bins / action_range: histogramme des actions (valeurs continues entre action_range[0] et [1])
+    max_rail_distance et crash_position sont des distances deroulees depuis le depart (rail_distance repart de 0
+    a chaque tour): 'distance' du pas si le client la donne, sinon nb_turns * rail_length + rail_distance.
+    rail_length: longueur du rail du circuit d'entrainement (None: seul 'distance' est fiable)
+    """
+
+    def __init__(self, window=20, action_bins=10, action_range=(0.0, 1.0), history_size=10000, rail_length=None):
+        self.window = window
+        self.rail_length = rail_length
+        self.action_bins = action_bins
+        self.action_range = action_range
+        self._history = collections.deque(maxlen=history_size)
+        self._recent = collections.deque()
+        self._sums = {'return': 0.0, 'length': 0, 'crashed': 0, 'max_rail_distance': 0.0}
+        self._current = None
+        self._lock = threading.Lock()  # les requetes HTTP arrivent sur plusieurs threads
+        self.nb_episodes = 0
+        self.nb_steps = 0
+
+    def _new_episode(self, episode, timestamp):
+        return {
+            'index': self.nb_episodes,  # numero d'ordre cote serveur, pour /episodes?since=
+            'episode': episode,
+            'start_time': timestamp,
+            'end_time': timestamp,
+            'return': 0.0,
+            'length': 0,
+            'max_rail_distance': 0.0,
+            'max_turns': 0,
+            'crashed': False,
+            'crash_position': None,
+            'action_histogram': [0] * self.action_bins,
+            'last_action': None,
+            'last_reward': None,
+        }
+
+    def _action_bin(self, action):
+        low, high = self.action_range
+        index = int((action - low) / (high - low) * self.action_bins)
+        return min(max(index, 0), self.action_bins - 1)
+
+    def _distance(self, step):
+        """Distance deroulee depuis le depart de l'episode, ou None"""
+        if step.get('distance') is not None:
+            return step['distance']
+        rail_distance = step.get('rail_distance')
+        if rail_distance is None or self.rail_length is None:
+            return rail_distance
+        return (step.get('nb_turns') or 0) * self.rail_length + rail_distance
+
+    def update(self, step):
+        """
+        Ajoute un pas {'episode', 'reward', 'action', 'crashed', 'distance', 'rail_distance', 'nb_turns', 'timestamp'}
+        (champs optionnels sauf episode). Retourne le resume de l'episode s'il vient de se terminer, sinon None.
+        """
+        with self._lock:
+            return self._update(step)
+
+    def _update(self, step):
+        timestamp = step.get('timestamp', time.time())
+        episode = step.get('episode', 0)
+
+        closed = None
+        if self._current is not None and self._current['episode'] != episode:
+            closed = self._close()
+        if self._current is None:
+            self._current = self._new_episode(episode, timestamp)
+
+        current = self._current
+        self.nb_steps += 1
+        current['length'] += 1
+        current['end_time'] = timestamp
+        reward = step.get('reward')
+        if reward is not None:
+            current['return'] += reward
+            current['last_reward'] = reward
+        action = step.get('action')
+        if action is not None:
+            current['action_histogram'][self._action_bin(action)] += 1
+            current['last_action'] = action
+        distance = self._distance(step)
+        if distance is not None:
+            current['max_rail_distance'] = max(current['max_rail_distance'], distance)
+        current['max_turns'] = max(current['max_turns'], step.get('nb_turns') or 0)
+
+        if step.get('crashed'):
+            current['crashed'] = True
+            current['crash_position'] = distance
+            closed = self._close()
+        return closed
+
+    def _close(self):
+        summary = self._current
+        self._current = None
+        self.nb_episodes += 1
+        self._history.append(summary)
+
+        # Fenetre glissante: on ajoute l'episode termine et on retire celui qui sort de la fenetre
+        self._recent.append(summary)
+        self._add_to_sums(summary, 1)
+        if len(self._recent) > self.window:
+            self._add_to_sums(self._recent.popleft(), -1)
+        return summary
+
+    def _add_to_sums(self, summary, sign):
+        self._sums['return'] += sign * summary['return']
+        self._sums['length'] += sign * summary['length']
+        self._sums['crashed'] += sign * int(summary['crashed'])
+        self._sums['max_rail_distance'] += sign * summary['max_rail_distance']
+
+    def rolling(self):
+        """Moyennes sur les derniers episodes termines"""
+        with self._lock:
+            return self._rolling()
+
+    def _rolling(self):
+        n = len(self._recent)
+        if n == 0:
+            return {'episodes': 0}
+        return {
+            'episodes': n,
+            'mean_return': self._sums['return'] / n,
+            'mean_length': self._sums['length'] / n,
+            'crash_rate': self._sums['crashed'] / n,
+            'mean_max_rail_distance': self._sums['max_rail_distance'] / n,
+        }
+
+    def progress(self):
+        """Resume compact de l'episode en cours + moyennes glissantes (diffuse a frequence fixe)"""
+        with self._lock:
+            return self._progress()
+
+    def _progress(self):
+        current = self._current
+        progress = {'nb_episodes': self.nb_episodes, 'nb_steps': self.nb_steps, 'rolling': self._rolling()}
+        if current is not None:
+            progress.update({key: current[key] for key in
+                             ('episode', 'return', 'length', 'max_rail_distance', 'last_action', 'last_reward')})
+            progress['crashed'] = current['crashed']
+        return progress
+
+    def episodes(self, since=None, limit=None):
+        """Episodes termines d'index > since (les plus recents si limit est donne)"""
+        with self._lock:
+            episodes = list(self._history)
+        if since is not None:
+            # Les index sont consecutifs: position directe dans l'historique
+            first_index = episodes[0]['index'] if episodes else 0
+            episodes = episodes[max(since + 1 - first_index, 0):]
+        if limit is not None:
+            episodes = episodes[-limit:] if limit > 0 else []
+        return episodes
+
+
+def check_lap_boundary(rail_length=200.0):
+    """
+    Episode de 3 tours qui crashe a 10 cm dans le 4e: la distance max et la position du crash sont deroulees,
+    que le client donne 'distance' ou seulement rail_distance + nb_turns. Leve AssertionError sinon.
+    """
+    expected = 3 * rail_length + 10.0
+    for with_distance in (False, True):
+        aggregator = EpisodeAggregator(rail_length=rail_length)
+        distances = [d * 5.0 for d in range(int(expected / 5.0) + 1)]
+        for i, distance in enumerate(distances):
+            step = {'episode': 0, 'reward': 1.0, 'action': 0.5, 'crashed': i == len(distances) - 1,
+                    'rail_distance': distance % rail_length, 'nb_turns': int(distance // rail_length)}
+            if with_distance:
+                step['distance'] = distance
+            summary = aggregator.update(step)
+        assert summary is not None and summary['crashed']
+        assert summary['max_rail_distance'] == expected, summary['max_rail_distance']
+        assert summary['crash_position'] == expected, summary['crash_position']
+        assert aggregator.rolling()['mean_max_rail_distance'] == expected
+        print(f"[EpisodeStats] {'distance' if with_distance else 'rail_distance + nb_turns'}: "
+              f"max {summary['max_rail_distance']:.1f}, crash a {summary['crash_position']:.1f} ({summary['max_turns']} tours)")
+
+
+if __name__ == "__main__":
+    check_lap_boundary()
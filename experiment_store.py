@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import sqlite3
+import numpy as np
+import datalog
+
+# Stockage des experiences: une colonne .npy par champ et par run (chargee en memmap a la demande)
+# et un index SQLite des metadonnees pour choisir les runs sans ouvrir leurs donnees.
+#
+#   <root>/index.sqlite
+#   <root>/runs/<run_id>/<colonne>.npy
+
+COLUMNS = datalog.RECORD_DTYPE.names
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    pattern TEXT,
+    circuit_hash TEXT,
+    is_inside_rail INTEGER,
+    start_time REAL,
+    duration REAL,
+    crashed INTEGER,
+    nb_samples INTEGER,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_selection ON runs (circuit_hash, pattern, is_inside_rail);
+"""
+
+
+class ExperimentStore:
+
+    def __init__(self, root="output/store"):
+        self.root = root
+        os.makedirs(os.path.join(root, "runs"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"))
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(INDEX_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def _run_dir(self, run_id):
+        return os.path.join(self.root, "runs", run_id)
+
+    def add_run(self, records, pattern, circuit, is_inside_rail, start_time, source=None):
+        """
+        Ajoute un run a partir d'enregistrements au format datalog.RECORD_DTYPE.
+        pattern est le nom du motif d'entree (ex: 'constant_slow_pattern').
+        """
+        run_id = time.strftime('%Y_%m_%d_%H%M%S', time.localtime(start_time))
+        if pattern:
+            run_id += "_" + pattern
+        run_dir = self._run_dir(run_id)
+        os.makedirs(run_dir, exist_ok=True)
+
+        for column in COLUMNS:
+            np.save(os.path.join(run_dir, column + ".npy"), np.ascontiguousarray(records[column]))
+
+        nb_samples = len(records)
+        duration = float(records['timestamp'][-1] - records['timestamp'][0]) if nb_samples > 0 else 0.0
+        crashed = bool(records['crashed'].any()) if nb_samples > 0 else False
+
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, pattern, circuit.get_section_hash(), int(is_inside_rail),
+                 start_time, duration, int(crashed), nb_samples, source)
+            )
+        return run_id
+
+    def import_log(self, path, pattern, circuit, is_inside_rail=True):
+        """Importe un log binaire (datalog) ou un ancien fichier JSON de CarDataCollector"""
+        if path.endswith(".json"):
+            path = datalog.json_to_log(path)
+        header, records = datalog.open_log(path)
+        return self.add_run(records, pattern, circuit, is_inside_rail, header['start_time'], source=path)
+
+    def query(self, pattern=None, circuit=None, is_inside_rail=None, crashed=None, min_samples=None):
+        """
+        Retourne les metadonnees (dicts) des runs correspondant aux filtres, sans ouvrir leurs donnees.
+        pattern accepte les jokers SQL LIKE, ex: query(pattern='constant_%', circuit=round_circuit)
+        """
+        conditions = []
+        values = []
+        if pattern is not None:
+            conditions.append("pattern LIKE ?")
+            values.append(pattern)
+        if circuit is not None:
+            conditions.append("circuit_hash = ?")
+            values.append(circuit.get_section_hash())
+        if is_inside_rail is not None:
+            conditions.append("is_inside_rail = ?")
+            values.append(int(is_inside_rail))
+        if crashed is not None:
+            conditions.append("crashed = ?")
+            values.append(int(crashed))
+        if min_samples is not None:
+            conditions.append("nb_samples >= ?")
+            values.append(min_samples)
+
+        sql = "SELECT * FROM runs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY start_time"
+        return [dict(row) for row in self._db.execute(sql, values)]
+
+    def load_run(self, run_id, columns=None):
+        """Charge les colonnes d'un run en memmap (lecture seule): rien n'est lu avant d'etre utilise"""
+        columns = columns or COLUMNS
+        run_dir = self._run_dir(run_id)
+        return {column: np.load(os.path.join(run_dir, column + ".npy"), mmap_mode='r') for column in columns}
+
+    def select(self, columns=None, **filters):
+        """Itere sur (metadonnees, colonnes) des runs correspondant aux filtres de query()"""
+        for meta in self.query(**filters):
+            yield meta, self.load_run(meta['run_id'], columns)
+
+
+def run_to_experiment(run):
+    """Convertit les colonnes d'un run au format dict {str(timestamp): {...}} utilise par sim_optimizer"""
+    records = np.zeros(len(run['timestamp']), dtype=datalog.RECORD_DTYPE)
+    for column in COLUMNS:
+        if column in run:
+            records[column] = run[column]
+    return datalog.log_to_experiment(records)
+
+
+if __name__ == "__main__":
+    # python experiment_store.py <pattern> output/*.bin
+    # Les runs importes ici sont supposes faits sur round_circuit, rail interieur (comme sim_optimizer)
+    from sim_optimizer import round_circuit
+
+    store = ExperimentStore()
+    pattern = sys.argv[1]
+    for path in sys.argv[2:]:
+        print(f"{path} -> {store.import_log(path, pattern, round_circuit)}")
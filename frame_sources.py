@@ -0,0 +1,231 @@
+import os
+import time
+import threading
+import numpy as np
+import cv2
+
+# Sources d'images du detecteur (vision.CarDetector), interchangeables: toutes exposent
+#   start() / stop()
+#   read(newer_than=None, timeout=0.5) -> (image, heure de capture, numero d'image)
+# - CameraSource: camera en direct, lue dans un thread (FrameGrabber), avec enregistrement optionnel
+# - RecordingSource: relecture d'un enregistrement, au plus vite (profilage, tests) ou au rythme d'origine
+#
+# Enregistrements (FrameRecorder), selon l'extension:
+#   .npz  images sans perte + timestamps, gardees en memoire jusqu'a close() (sequences courtes)
+#   autre (.avi...)  video MJPG ecrite au fil de l'eau + <video>.timestamps.txt (une heure de capture par ligne)
+
+
+class FrameGrabber:
+    """
+    Lit la camera en continu dans un thread et ne garde que la derniere image, avec son heure de capture.
+    Une image non consommee est remplacee par la suivante: le detecteur travaille toujours sur l'image
+    la plus recente, sans payer l'exposition/decodage dans la requete ni lire une image restee en buffer.
+    recorder: FrameRecorder qui recoit toutes les images capturees, consommees ou non
+    """
+
+    def __init__(self, cap, recorder=None):
+        self.cap = cap
+        self.recorder = recorder
+        self._condition = threading.Condition()
+        self._frame = None
+        self._timestamp = None
+        self._frame_id = 0  # nombre d'images capturees
+        self._stop = threading.Event()
+        self._thread = None
+        self.nb_failed = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="FrameGrabber", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            # grab() rend la main quand l'image est disponible: c'est notre meilleure estimation de l'heure de capture
+            if not self.cap.grab():
+                self.nb_failed += 1
+                time.sleep(0.01)
+                continue
+            timestamp = time.time()
+            ret, frame = self.cap.retrieve()
+            if not ret:
+                self.nb_failed += 1
+                continue
+            with self._condition:
+                self._frame = frame
+                self._timestamp = timestamp
+                self._frame_id += 1
+                self._condition.notify_all()
+            if self.recorder is not None:
+                self.recorder.write(frame, timestamp)
+
+    def read(self, newer_than=None, timeout=0.5):
+        """
+        Retourne (image, heure de capture, numero d'image). Si newer_than est donne, attend (au plus timeout)
+        une image plus recente que ce numero; sinon retourne la derniere disponible.
+        Retourne (None, None, 0) si aucune image n'a encore ete capturee.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._frame_id > (newer_than or 0), timeout=timeout)
+            return self._frame, self._timestamp, self._frame_id
+
+
+class CameraSource(FrameGrabber):
+
+    def __init__(self, camera_id, width=640, height=480, recorder=None):
+        cap = cv2.VideoCapture(camera_id)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        super().__init__(cap, recorder)
+
+    def stop(self):
+        super().stop()
+        self.cap.release()
+
+
+class FrameRecorder:
+
+    def __init__(self, path, fps=30.0):
+        self.path = path
+        self.fps = fps
+        self.nb_frames = 0
+        self._lock = threading.Lock()
+        self._frames = []
+        self._timestamps = []
+        self._writer = None
+        self._timestamps_file = None
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def _is_npz(self):
+        return self.path.endswith('.npz')
+
+    def write(self, frame, timestamp):
+        with self._lock:
+            if self._is_npz():
+                self._frames.append(frame.copy())
+                self._timestamps.append(timestamp)
+            else:
+                if self._writer is None:
+                    height, width = frame.shape[:2]
+                    self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'MJPG'), self.fps, (width, height))
+                    self._timestamps_file = open(self.path + '.timestamps.txt', 'w')
+                self._writer.write(frame)
+                self._timestamps_file.write(f"{timestamp:.6f}\n")
+            self.nb_frames += 1
+
+    def close(self):
+        with self._lock:
+            if self._is_npz():
+                if self._frames:
+                    np.savez(self.path, frames=np.stack(self._frames), timestamps=np.array(self._timestamps))
+                self._frames, self._timestamps = [], []
+            elif self._writer is not None:
+                self._writer.release()
+                self._timestamps_file.close()
+                self._writer = None
+        print(f"[FrameRecorder] {self.nb_frames} images enregistrees dans {self.path}")
+
+
+class RecordingSource:
+    """
+    realtime=False: chaque read() rend l'image suivante sans attendre (traitement au plus vite).
+    realtime=True: au rythme de l'enregistrement, read() rend la derniere image deja 'capturee' (les images non lues
+                   sont sautees, comme avec la camera) ou attend la suivante.
+    Les heures de capture rendues sont celles de l'enregistrement, sauf en realtime ou elles sont recalees sur
+    l'horloge courante (start() = premiere image), comme celles d'une camera: les consommateurs qui les comparent
+    a time.time() (latence, filtre de Kalman) restent coherents. L'heure enregistree de la derniere image rendue
+    reste dans recorded_timestamp. En fin d'enregistrement, read() rend (None, None, numero de la derniere image)
+    et finished passe a True.
+    """
+
+    def __init__(self, path, realtime=False):
+        self.path = path
+        self.realtime = realtime
+        self.finished = False
+        self._frame_id = 0
+        self._started_at = None
+        self._clock_offset = 0.0  # heure rendue - heure enregistree
+        self.recorded_timestamp = None
+        self._frames = None
+        self._video = None
+        if path.endswith('.npz'):
+            with np.load(path) as recording:
+                self._frames = recording['frames']
+                self.timestamps = recording['timestamps']
+        else:
+            self._video = cv2.VideoCapture(path)
+            if os.path.exists(path + '.timestamps.txt'):
+                self.timestamps = np.loadtxt(path + '.timestamps.txt', ndmin=1)
+            else:
+                # Video sans horodatage: cadence nominale du fichier
+                fps = self._video.get(cv2.CAP_PROP_FPS) or 30.0
+                nb_frames = int(self._video.get(cv2.CAP_PROP_FRAME_COUNT))
+                self.timestamps = np.arange(nb_frames) / fps
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def start(self):
+        self._started_at = time.monotonic()
+        if self.realtime and len(self.timestamps) > 0:
+            self._clock_offset = time.time() - float(self.timestamps[0])
+        return self
+
+    def stop(self):
+        if self._video is not None:
+            self._video.release()
+
+    def _skip(self, nb_frames):
+        if self._video is not None:
+            for _ in range(nb_frames):
+                self._video.grab()
+        self._frame_id += nb_frames
+
+    def _next_frame(self):
+        if self._frames is not None:
+            return self._frames[self._frame_id] if self._frame_id < len(self._frames) else None
+        ret, frame = self._video.read()
+        return frame if ret else None
+
+    def read(self, newer_than=None, timeout=0.5):
+        if self.finished or self._frame_id >= len(self.timestamps):
+            self.finished = True
+            return None, None, self._frame_id
+        if self.realtime:
+            if self._started_at is None:
+                self.start()
+            elapsed = time.monotonic() - self._started_at
+            relative = self.timestamps - self.timestamps[0]
+            latest = int(np.searchsorted(relative, elapsed, side='right')) - 1
+            if latest < self._frame_id:
+                delay = relative[self._frame_id] - elapsed
+                if delay > timeout:
+                    time.sleep(timeout)
+                    return None, None, self._frame_id
+                time.sleep(delay)
+            else:
+                self._skip(latest - self._frame_id)
+
+        frame = self._next_frame()
+        if frame is None:
+            self.finished = True
+            return None, None, self._frame_id
+        self.recorded_timestamp = float(self.timestamps[self._frame_id])
+        self._frame_id += 1
+        return frame, self.recorded_timestamp + self._clock_offset, self._frame_id
+
+    def __iter__(self):
+        """(image, heure de capture) pour chaque image restante"""
+        while True:
+            frame, timestamp, _ = self.read()
+            if frame is None:
+                return
+            yield frame, timestamp
@@ -5,6 +5,13 @@ from gymnasium import spaces
 import sim
 import requests
 import time
+import threading
+import socketio
+from concurrent.futures import ThreadPoolExecutor
+from http_client import get_client
+from command_channel import CommandSender
+import wire_format
+from rail_filter import RailKalmanFilter
 
 
 class RailCarSimEnv(gym.Env):
@@ -71,20 +78,97 @@ class RailCarSimEnv(gym.Env):
 
 
 
+class StateSubscription:
+    """
+    Abonnement Socket.IO aux evenements pousses par server.py sur le namespace /telemetry
+    (sensor_update, car_position_update, crash_event).
+    Garde la derniere valeur recue par topic avec son heure de reception, pour lire l'etat sans requete
+    et detecter un etat perime par son age.
+    encoding: wire_format.BINARY_ENCODING (defaut) pour recevoir les evenements frequents en binaire compact,
+              wire_format.JSON_ENCODING pour du JSON
+    """
+
+    NAMESPACE = '/telemetry'
+
+    TOPICS = {
+        'sensor_update': 'sensor',
+        'car_position_update': 'car_position',
+        'crash_event': 'crash',
+    }
+
+    def __init__(self, endpoint, callbacks=None, encoding=wire_format.BINARY_ENCODING):
+        self.endpoint = endpoint
+        self.encoding = encoding
+        self.callbacks = callbacks or {}  # topic -> fonction appelee a chaque mise a jour (depuis le thread Socket.IO)
+        self._lock = threading.Lock()
+        self._latest = {}  # topic -> (data, heure de reception)
+
+        self.sio = socketio.Client(reconnection=True)
+        for event, topic in self.TOPICS.items():
+            self.sio.on(event, self._make_handler(topic), namespace=self.NAMESPACE)
+
+    def _make_handler(self, topic):
+        def handler(data):
+            received_at = time.monotonic()
+            if isinstance(data, bytes):
+                _, data = wire_format.decode(data)
+            with self._lock:
+                self._latest[topic] = (data, received_at)
+                if topic in self.callbacks:
+                    self.callbacks[topic](data)
+        return handler
+
+    def connect(self):
+        self.sio.connect(self.endpoint, namespaces=[self.NAMESPACE], auth={'encoding': self.encoding})
+        print(f"[StateSubscription] Connected to {self.endpoint}")
+
+    def get(self, topic):
+        """Retourne (derniere valeur, age en secondes), ou (None, inf) si rien n'a encore ete recu"""
+        with self._lock:
+            if topic not in self._latest:
+                return None, float('inf')
+            data, received_at = self._latest[topic]
+        return data, time.monotonic() - received_at
+
+    def discard(self, topic):
+        """Oublie la derniere valeur du topic (get rend (None, inf) jusqu'a la prochaine reception)"""
+        with self._lock:
+            self._latest.pop(topic, None)
+
+    def disconnect(self):
+        self.sio.disconnect()
+
+
 class RailCarRealEnv(gym.Env):
-    def __init__(self, circuit, is_inside_rail, endpoint, reward_function=None, reward_kwargs=None):
+    def __init__(self, circuit, is_inside_rail, endpoint, reward_function=None, reward_kwargs=None,
+                 vision_endpoint="http://localhost:5001", mode='poll', max_state_age=0.5, command_relay=None,
+                 actuation_delay=None):
+        """
+        mode='poll': chaque pas interroge /car_position (vision) et /sensors
+        mode='push': l'etat vient des evenements Socket.IO du serveur (voir StateSubscription),
+                     le pas n'envoie que la commande. Un etat plus vieux que max_state_age secondes
+                     est signale par info['stale'].
+        command_relay: adresse (hote, port) du relais UDP du serveur. Si donnee, les commandes moteur
+                       partent par ce canal (command_channel.py) au lieu de POST /control, sans attendre de reponse.
+        actuation_delay: delai (s) entre l'envoi d'une commande et son effet sur le moteur. La position et la vitesse
+                         de l'observation sont predites a cet instant par le filtre (rail_filter.py). Par defaut,
+                         la moitie de l'aller-retour mesure sur le canal UDP, sinon 0.
+        """
         super().__init__()
         
         self.endpoint = endpoint
+        self.vision_endpoint = vision_endpoint
+        self.mode = mode
+        self.max_state_age = max_state_age
         self.circuit = circuit
         self.is_inside_rail = is_inside_rail
         
         # ✅ Tension au lieu de vitesse
         self.action_space = spaces.Box(low=0.0, high=1.0, shape=(1,), dtype=np.float32)
         self.observation_space = spaces.Box(
-            # [tension (V), angle 10cm, angle 30cm, angle 50cm]
+            # [vitesse (cm/s), angle 10cm, angle 30cm, angle 50cm], comme RailCarSimEnv
             low=np.array([0, -1, -1, -1], dtype=np.float32),
-            high=np.array([17.4, 1, 1, 1], dtype=np.float32)  # 17.4V = tension max batterie
+            high=np.array([200, 1, 1, 1], dtype=np.float32)
         )
         
         self.reward_function = reward_function or self._default_reward
@@ -92,55 +176,120 @@ class RailCarRealEnv(gym.Env):
         
         self.rail_distance = 0
         self.nb_turns = 0
+        self.speed = 0.0
         self.current_step = 0
-        self.last_rail_distance = 0
+        self.actuation_delay = actuation_delay
+
+        # Position deroulee et vitesse estimees a partir des detections horodatees et des commandes envoyees
+        self.track = RailKalmanFilter(circuit._get_rail_length(is_inside_rail),
+                                      curvature_at=sim.RailCarSimBatch(circuit, is_inside_rail).curvature_at)
+        self.track.reset(start_distance=0.0)
+
+        # Clients HTTP partages (connexions keep-alive, voir http_client.py), assez de connexions
+        # par serveur pour que les appels d'un meme pas partent en parallele
+        self._server = get_client(endpoint, timeout=1)
+        self._vision = get_client(vision_endpoint, timeout=1)
+        self._executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="RailCarRealEnv")
+
+        self._commands = CommandSender(command_relay) if command_relay is not None else None
+
+        self._subscription = None
+        if mode == 'push':
+            # Chaque position recue met a jour le filtre, pas seulement celle lue au moment du pas
+            self._subscription = StateSubscription(endpoint, callbacks={
+                'car_position': lambda data: self.track.update(data['rail_distance'], data.get('timestamp'))
+            })
+            self._subscription.connect()
+        elif mode != 'poll':
+            raise ValueError(f"[RailCarRealEnv] mode inconnu: {mode}")
+
+    def _timed_request(self, request, *args, **kwargs):
+        start = time.perf_counter()
+        response = request(*args, **kwargs)
+        return response, (time.perf_counter() - start) * 1000.0
+
+    def _send_command(self, duty_cycle):
+        if self._commands is not None:
+            start = time.perf_counter()
+            self._commands.send(duty_cycle)
+            return None, (time.perf_counter() - start) * 1000.0
+        return self._timed_request(self._server.post, "/control", json={"duty_cycle": duty_cycle})
+
+    def _actuation_time(self):
+        delay = self.actuation_delay
+        if delay is None:
+            rtt = self._commands.last_rtt if self._commands is not None else None
+            delay = rtt / 2 if rtt is not None else 0.0
+        return time.time() + delay
+
+    def _update_track(self, action):
+        """La commande envoyee s'applique a partir de l'instant d'actuation, ou l'etat est predit"""
+        actuation_time = self._actuation_time()
+        self.track.set_command(float(action[0]), actuation_time)
+        distance, self.speed = self.track.predict(actuation_time)
+        self.rail_distance, self.nb_turns = self.track.split(distance)
+
+    def _observe_push(self, duty_cycle):
+        # Seule la commande passe par le reseau, l'observation est lue dans le cache
+        _, control_ms = self._send_command(duty_cycle)
+
+        sensor, sensor_age = self._subscription.get('sensor')
+        _, position_age = self._subscription.get('car_position')
+        crash, _ = self._subscription.get('crash')
+        voltage = sensor['voltage'] if sensor is not None else 0.0
+
+        # Le dernier evenement de crash (pousse des sa detection) prime sur l'etat porte par sensor_update
+        crashed = None
+        if crash is not None:
+            crashed = crash['crashed']
+        elif sensor is not None:
+            crashed = sensor.get('crashed')
+
+        state_age = {'sensor': sensor_age, 'car_position': position_age}
+        stale = max(state_age.values()) > self.max_state_age
+        return voltage, crashed, {'control_ms': control_ms}, state_age, stale
 
     def step(self, action):
         try:
-            # Envoyer action moteur
+            step_start = time.perf_counter()
             duty_cycle = action[0] * 95.0
-            requests.post(f"{self.endpoint}/control", json={"duty_cycle": duty_cycle}, timeout=1)
 
-            # Vision pour position
-            vision_response = requests.get("http://localhost:5001/car_position", timeout=1)
-            if vision_response.status_code == 200:
-                self.last_rail_distance = self.rail_distance
-                self.rail_distance = vision_response.json()['rail_distance']
-                if self.rail_distance < self.last_rail_distance - 10.0:
-                    self.nb_turns += 1
+            if self.mode == 'push':
+                voltage, crashed, timings, state_age, stale = self._observe_push(duty_cycle)
+                timings['step_ms'] = (time.perf_counter() - step_start) * 1000.0
+                return self._make_step(action, duty_cycle, voltage, crashed,
+                                       {'timings': timings, 'state_age': state_age, 'stale': stale})
 
+            # Les trois appels partent en meme temps: la latence du pas est celle de l'appel le plus lent
+            # Envoyer action moteur
+            control_future = self._executor.submit(self._send_command, duty_cycle)
+            # Vision pour position
+            vision_future = self._executor.submit(self._timed_request, self._vision.get, "/car_position")
             # Capteurs pour tension
-            sensor_response = requests.get(f"{self.endpoint}/sensors", timeout=1)
-            voltage = sensor_response.json()["voltage"]
-
-            def get_angle_at_distance(distance_ahead):
-                tan_current = self.circuit.get_tangent_at_rail(self.rail_distance, self.is_inside_rail)
-                tan_ahead = self.circuit.get_tangent_at_rail(self.rail_distance + distance_ahead, self.is_inside_rail)
-                return raylib.vector2_angle(tan_ahead, tan_current)
-
-            state = {
-                'voltage': voltage,
-                'angle_10cm': get_angle_at_distance(10),
-                'angle_30cm': get_angle_at_distance(30),
-                'angle_50cm': get_angle_at_distance(50),
-                'rail_distance': self.rail_distance,
-                'nb_turns': self.nb_turns,
-                'duty_cycle': duty_cycle
-            }
+            sensor_future = self._executor.submit(self._timed_request, self._server.get, "/sensors")
 
-            observation = self._state_to_obs(state)
-            reward = self.reward_function(state, action[0], **self.reward_kwargs)
+            vision_response, vision_ms = vision_future.result()
+            if vision_response.status_code == 200:
+                position = vision_response.json()
+                # Heure de capture de l'image (vision_server), a defaut l'heure de reception
+                self.track.update(position['rail_distance'], position.get('timestamp') or time.time())
 
-            terminated = False
-            truncated = False
+            sensor_response, sensors_ms = sensor_future.result()
+            sensors = sensor_response.json()
+            voltage = sensors["voltage"]
+            # Present seulement si le capteur fait la detection de crash
+            crashed = sensors.get("crashed")
 
-            # Detection de crash
-            terminated = state['voltage'] > 14.0 and state['voltage'] > (duty_cycle/100.0) * 14.5
+            # On attend aussi la commande pour que deux commandes successives ne se doublent pas
+            _, control_ms = control_future.result()
 
-            
-            info = {'state': state}
-            
-            return observation, reward, terminated, truncated, info
+            timings = {
+                'control_ms': control_ms,
+                'vision_ms': vision_ms,
+                'sensors_ms': sensors_ms,
+                'step_ms': (time.perf_counter() - step_start) * 1000.0,
+            }
+            return self._make_step(action, duty_cycle, voltage, crashed, {'timings': timings})
 
         except requests.exceptions.RequestException as e:
             print(f"[RailCarRealEnv] Network error: {e}")
@@ -148,6 +297,7 @@ class RailCarRealEnv(gym.Env):
             dummy_state = {
                 'rail_distance': 0,
                 'nb_turns': 0,
+                'speed': 0,
                 'voltage': 0,
                 'angle_10cm': 0,
                 'angle_30cm': 0,
@@ -157,9 +307,49 @@ class RailCarRealEnv(gym.Env):
             observation = self._state_to_obs(dummy_state)
             return observation, 0, True, False, {'state': dummy_state}
 
+    def _make_step(self, action, duty_cycle, voltage, crashed, extra_info):
+        if self._commands is not None and self._commands.last_rtt is not None:
+            # Aller-retour agent -> relais -> controleur de la derniere commande acquittee
+            extra_info['timings']['command_rtt_ms'] = self._commands.last_rtt * 1000.0
+        self._update_track(action)
+
+        def get_angle_at_distance(distance_ahead):
+            tan_current = self.circuit.get_tangent_at_rail(self.rail_distance, self.is_inside_rail)
+            tan_ahead = self.circuit.get_tangent_at_rail(self.rail_distance + distance_ahead, self.is_inside_rail)
+            return raylib.vector2_angle(tan_ahead, tan_current)
+
+        state = {
+            'speed': self.speed,
+            'voltage': voltage,
+            'angle_10cm': get_angle_at_distance(10),
+            'angle_30cm': get_angle_at_distance(30),
+            'angle_50cm': get_angle_at_distance(50),
+            'rail_distance': self.rail_distance,
+            'nb_turns': self.nb_turns,
+            'duty_cycle': duty_cycle
+        }
+
+        observation = self._state_to_obs(state)
+        reward = self.reward_function(state, action[0], **self.reward_kwargs)
+
+        terminated = False
+        truncated = False
+
+        # Detection de crash: faite par le capteur sur la tension filtree quand il la fournit,
+        # sinon sur la derniere tension recue
+        if crashed is not None:
+            terminated = crashed
+        else:
+            terminated = state['voltage'] > 14.0 and state['voltage'] > (duty_cycle/100.0) * 14.5
+
+        
+        info = {'state': state, **extra_info}
+        
+        return observation, reward, terminated, truncated, info
+
     def _state_to_obs(self, state):
         return np.array([
-            state['voltage'], # TODO: faire la conversion en force et en vitesse
+            state['speed'],
             state['angle_10cm'],
             state['angle_30cm'],
             state['angle_50cm']
@@ -168,23 +358,36 @@ class RailCarRealEnv(gym.Env):
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
         
-        requests.post(f"{self.endpoint}/control", json={"duty_cycle": 0.0})
+        # Arret moteur: on insiste en cas d'erreur reseau
+        if self._commands is not None:
+            # Par le meme canal que les commandes, sinon une commande UDP en retard pourrait passer apres l'arret
+            self._commands.send(0.0)
+        self._server.post("/control", json={"duty_cycle": 0.0}, retries=3)
         print("Reset de l'environnement! Mettez la voiture sur la ligne de depart et appuyez sur ENTRER")
         input()
         
         self.rail_distance = 0
         self.current_step = 0
         self.nb_turns = 0
+        self.speed = 0.0
+        # Voiture sur la ligne de depart: une premiere detection juste avant la ligne compte comme le tour -1
+        self.track.reset(start_distance=0.0)
+        # Le crash de l'episode precedent (leve par le serveur a l'arret moteur) ne doit pas terminer le premier pas
+        if self._subscription is not None:
+            self._subscription.discard('crash')
         
-        # Observation initiale avec tension de repos
-        try:
-            response = requests.get(f"{self.endpoint}/sensors", timeout=1)
-            voltage = response.json()["voltage"]
-            observation = np.array([voltage, 0, 0, 0], dtype=np.float32)
-        except:
-            observation = np.array([14.7, 0, 0, 0], dtype=np.float32)  # Tension par défaut
+        # Observation initiale: voiture a l'arret
+        observation = np.array([0, 0, 0, 0], dtype=np.float32)
         
         return observation, {}
 
     def _default_reward(self, state, action):
         return 1.0
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if self._commands is not None:
+            self._commands.close()
+        if self._subscription is not None:
+            self._subscription.disconnect()
+        super().close()
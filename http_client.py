@@ -0,0 +1,133 @@
+import time
+import threading
+import collections
+import requests
+from requests.adapters import HTTPAdapter
+
+# Couche HTTP partagee par tous les clients du projet (env, Q-learning, vision, capteur).
+# Un HttpClient par serveur: connexions gardees ouvertes (keep-alive) et reutilisees, timeouts et
+# politique de retry coherents, compteurs de requetes/erreurs/latence.
+
+DEFAULT_TIMEOUT = 1.0
+
+
+class HttpClient:
+
+    def __init__(self, base_url, timeout=DEFAULT_TIMEOUT, retries=0, backoff=0.05, pool_size=8, history_size=1000):
+        """
+        retries: nombre de nouvelles tentatives sur erreur de connexion ou timeout (0 = aucune)
+        backoff: attente avant la n-ieme nouvelle tentative = backoff * 2**(n-1)
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.history_size = history_size
+
+        self.session = requests.Session()
+        # pool_size connexions par hote, pour que les appels paralleles ne se bloquent pas entre eux
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self.nb_requests = 0
+        self.nb_errors = 0
+        self.nb_retries = 0
+        self._latencies = collections.deque(maxlen=history_size)
+
+    def request(self, method, path, timeout=None, retries=None, **kwargs):
+        """Comme requests.request, avec l'URL relative a base_url. Leve requests.RequestException en cas d'echec"""
+        url = self.base_url + path
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+                self._record(time.perf_counter() - start, error=False)
+                return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._record(time.perf_counter() - start, error=True)
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.nb_retries += 1
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def _record(self, latency, error):
+        with self._lock:
+            self.nb_requests += 1
+            if error:
+                self.nb_errors += 1
+            self._latencies.append(latency)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'base_url': self.base_url,
+                'requests': self.nb_requests,
+                'errors': self.nb_errors,
+                'retries': self.nb_retries,
+            }
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(int(p / 100 * len(latencies)), len(latencies) - 1)] * 1000.0
+
+        stats.update({'p50_ms': percentile(50), 'p95_ms': percentile(95), 'p99_ms': percentile(99)})
+        return stats
+
+    def print_stats(self):
+        s = self.stats()
+        line = f"[HttpClient] {s['base_url']}: {s['requests']} requetes, {s['errors']} erreurs, {s['retries']} retries"
+        if s['p50_ms'] is not None:
+            line += f", latence p50 {s['p50_ms']:.1f} ms / p95 {s['p95_ms']:.1f} ms / p99 {s['p99_ms']:.1f} ms"
+        print(line)
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url, **policy):
+    """
+    Retourne le client partage pour ce serveur, en le creant au premier appel avec la politique donnee
+    (timeout, retries, backoff, pool_size). Les appels suivants reutilisent le meme pool de connexions:
+    sans politique ils prennent celle du client existant, avec une politique differente ils levent ValueError
+    (passer timeout=/retries= a la requete pour un appel particulier).
+    """
+    key = base_url.rstrip('/')
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = HttpClient(key, **policy)
+            return _clients[key]
+        client = _clients[key]
+    conflicts = {name: (getattr(client, name), value) for name, value in policy.items()
+                 if getattr(client, name) != value}
+    if conflicts:
+        details = ", ".join(f"{name}={current} (demande {value})" for name, (current, value) in conflicts.items())
+        raise ValueError(f"Client {key} deja cree avec une autre politique: {details}")
+    return client
+
+
+def print_all_stats():
+    with _clients_lock:
+        clients = list(_clients.values())
+    for client in clients:
+        client.print_stats()
@@ -0,0 +1,165 @@
+import time
+import math
+import random
+import argparse
+import threading
+import collections
+import socketio
+from http_client import HttpClient
+from scheduler import FixedRateScheduler
+import wire_format
+
+# Test de charge du serveur (server.py ou serve.py) en local: simule le capteur, la vision, l'entraineur
+# et N dashboards, puis affiche le debit des requetes et la latence des emissions Socket.IO.
+#   python serve.py --no-circuit-image &
+#   python loadtest.py --dashboards 20 --duration 30
+#
+# Latence d'emission = reception par le dashboard - horodatage du message (capteur: heure de l'echantillon,
+# vision/entrainement: heure de reception par le serveur). Elle inclut l'attente de la diffusion regroupee
+# (BROADCAST_RATES), donc jusqu'a une periode d'emission. Les horloges sont les memes puisque tout tourne en local.
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(p / 100 * len(values)), len(values) - 1)]
+
+
+class Producer:
+    """Un client HTTP qui poste a frequence fixe (capteur, vision ou entraineur)"""
+
+    def __init__(self, name, url, path, rate, make_payload):
+        self.name = name
+        self.path = path
+        self.rate = rate
+        self.make_payload = make_payload
+        self.client = HttpClient(url, timeout=1.0)
+        self.nb_failed = 0
+
+    def run(self, duration):
+        scheduler = FixedRateScheduler(self.rate, spin_margin=0.0)
+        for tick in scheduler.ticks(max_ticks=int(duration * self.rate)):
+            try:
+                response = self.client.post(self.path, json=self.make_payload(tick))
+                if response.status_code != 200:
+                    self.nb_failed += 1
+            except Exception:
+                self.nb_failed += 1
+
+
+class Dashboard:
+    """Un client Socket.IO abonne comme dashboard.html (/telemetry et /training)"""
+
+    EVENTS = {
+        '/telemetry': ['sensor_update', 'car_position_update', 'update_plot', 'crash_event', 'car_crashed'],
+        '/training': ['training_progress', 'episode_summary'],
+    }
+
+    def __init__(self, url, latencies, lock, encoding=wire_format.JSON_ENCODING):
+        self.url = url
+        self.encoding = encoding
+        self.sio = socketio.Client()
+        for namespace, events in self.EVENTS.items():
+            for event in events:
+                self.sio.on(event, self._make_handler(event, latencies, lock), namespace=namespace)
+
+    @staticmethod
+    def _make_handler(event, latencies, lock):
+        def handler(data):
+            received_at = time.time()
+            if isinstance(data, bytes):
+                _, data = wire_format.decode(data)
+            timestamp = data.get('timestamp') if isinstance(data, dict) else None
+            with lock:
+                latencies[event].append(received_at - timestamp if timestamp else None)
+        return handler
+
+    def connect(self):
+        self.sio.connect(self.url, namespaces=list(self.EVENTS), transports=['websocket'],
+                         auth={'encoding': self.encoding})
+
+    def disconnect(self):
+        self.sio.disconnect()
+
+
+def run_load_test(url, nb_dashboards=10, duration=20.0, sensor_rate=20, samples_per_batch=43,
+                  vision_rate=30, training_rate=10, encoding=wire_format.JSON_ENCODING, action_range=(0.0, 1.0)):
+    # action_range: actions continues de l'environnement (RailCarRealEnv.action_space), comme les recoit
+    # l'histogramme d'actions de server.episode_stats
+    rng = random.Random(0)
+
+    def sensor_payload(tick):
+        now = time.time()
+        samples = [[now - (samples_per_batch - i) / 860.0, 12.0 + math.sin(now + i / 860.0)]
+                   for i in range(samples_per_batch)]
+        return {'samples': samples, 'crash_detection': True}
+
+    def vision_payload(tick):
+        return {'rail_distance': (tick * 2.0) % 800.0}
+
+    def training_payload(tick):
+        return {'state': [12.0, 0.1, 0.2, 0.3], 'action': rng.uniform(*action_range), 'reward': 1.0,
+                'crashed': False, 'episode': tick // 200}
+
+    producers = [
+        Producer('sensor', url, '/sensor_data', sensor_rate, sensor_payload),
+        Producer('vision', url, '/car_position', vision_rate, vision_payload),
+        Producer('trainer', url, '/training_data', training_rate, training_payload),
+    ]
+
+    lock = threading.Lock()
+    latencies = collections.defaultdict(list)
+    dashboards = [Dashboard(url, latencies, lock, encoding) for _ in range(nb_dashboards)]
+    for dashboard in dashboards:
+        dashboard.connect()
+    print(f"[LoadTest] {nb_dashboards} dashboards connectes ({encoding}), charge pendant {duration:.0f} s...")
+
+    threads = [threading.Thread(target=producer.run, args=(duration,), daemon=True) for producer in producers]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    time.sleep(0.5)  # dernieres emissions regroupees
+
+    for dashboard in dashboards:
+        dashboard.disconnect()
+
+    print(f"[LoadTest] Requetes ({elapsed:.1f} s):")
+    total = 0
+    for producer in producers:
+        stats = producer.client.stats()
+        total += stats['requests']
+        print(f"  {producer.name:8s} {producer.path:15s} {stats['requests'] / elapsed:7.1f} req/s "
+              f"(cible {producer.rate}), {stats['errors'] + producer.nb_failed} echecs, "
+              f"latence p50 {stats['p50_ms']:.1f} ms / p95 {stats['p95_ms']:.1f} ms / p99 {stats['p99_ms']:.1f} ms")
+    print(f"  total    {total / elapsed:.1f} req/s")
+
+    print(f"[LoadTest] Emissions recues par les {nb_dashboards} dashboards:")
+    with lock:
+        for event, values in sorted(latencies.items()):
+            timed = [v * 1000.0 for v in values if v is not None]
+            line = f"  {event:20s} {len(values) / elapsed:8.1f} msg/s"
+            if timed:
+                line += (f", latence p50 {percentile(timed, 50):.1f} ms / p95 {percentile(timed, 95):.1f} ms"
+                         f" / p99 {percentile(timed, 99):.1f} ms")
+            print(line)
+    return producers, latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test de charge du serveur de telemetrie")
+    parser.add_argument('--url', type=str, default="http://127.0.0.1:5000")
+    parser.add_argument('--dashboards', type=int, default=10, help="Nombre de dashboards simules")
+    parser.add_argument('--duration', type=float, default=20.0, help="Duree du test (s)")
+    parser.add_argument('--sensor-rate', type=float, default=20, help="Lots du capteur par seconde")
+    parser.add_argument('--vision-rate', type=float, default=30, help="Positions postees par seconde")
+    parser.add_argument('--training-rate', type=float, default=10, help="Pas d'entrainement postes par seconde")
+    parser.add_argument('--encoding', choices=[wire_format.JSON_ENCODING, wire_format.BINARY_ENCODING],
+                        default=wire_format.JSON_ENCODING, help="Encodage negocie par les dashboards")
+    args = parser.parse_args()
+
+    run_load_test(args.url, args.dashboards, args.duration, sensor_rate=args.sensor_rate,
+                  vision_rate=args.vision_rate, training_rate=args.training_rate, encoding=args.encoding)
@@ -4,8 +4,9 @@ import argparse
 import numpy as np
 from circuit import SectionType as ST
 from gymenv import *
+from scheduler import FixedRateScheduler
+from http_client import get_client, print_all_stats
 from circuit import *
-import requests
 
 last_toggle_press = 0.0
 show_q_table_toggle = False
@@ -50,6 +51,7 @@ round_circuit = Circuit([
     ST.LONG, ST.TURN_LEFT, ST.LONG, 
     ST.TURN_LEFT, ST.LONG, ST.TURN_LEFT, ST.SHORT,
 ])
+RAIL_LENGTH = round_circuit._get_rail_length(True)  # rail interieur, comme RailCarRealEnv
 
 actions = np.linspace(0.0, 0.6, 3) # [0.0, 0.2, .., 1.0]
 
@@ -175,15 +177,21 @@ def print_q_table(q_table):
         print(f"{state:<8} {q_table[state,0]:<12.2f} {q_table[state,1]:<12.2f} {q_table[state,2]:<12.2f}")
     print("-" * 70)
 
-def send_training_data(state, action, reward, crashed, episode):
-    """Send training data to dashboard"""
+SERVER_URL = "http://10.135.180.56:5000"
+
+def send_training_data(state, action, reward, crashed, episode, rail_distance=None, nb_turns=None):
+    """Send training data to dashboard (agrege par episode cote serveur)"""
     try:
-        requests.post("http://10.135.180.56:5000/training_data", json={
-            'state': state,
-            'action': action,
-            'reward': reward,
-            'crashed': crashed,
-            'episode': episode
+        get_client(SERVER_URL).post("/training_data", json={
+            'state': int(state),
+            'action': float(action),
+            'reward': float(reward),
+            'crashed': bool(crashed),
+            'episode': episode,
+            'rail_distance': rail_distance,
+            'nb_turns': nb_turns,
+            # Distance deroulee (rail_distance repart de 0 a chaque tour) pour les statistiques d'episode
+            'distance': None if rail_distance is None else (nb_turns or 0) * RAIL_LENGTH + rail_distance,
         }, timeout=0.1)
     except:
         pass
@@ -194,33 +202,38 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Q-learning avec enregistrement de la q-table")
     parser.add_argument('--qtable', type=str, default=None, help="Chemin vers Q-table")
     parser.add_argument('--noraylib', type=str, default=None, help="Chemin vers Q-table")
+    parser.add_argument('--rate', type=float, default=10, help="Frequence de la boucle de controle (Hz)")
+    parser.add_argument('--overrun', choices=['skip', 'catch_up'], default='skip',
+                        help="Politique en cas de debordement d'une iteration (voir FixedRateScheduler)")
     args = parser.parse_args()
 
     if args.qtable:
         load_q_table(args.qtable)
     
-    env = RailCarRealEnv(round_circuit, is_inside_rail=True, endpoint="http://10.135.180.56:5000")
+    env = RailCarRealEnv(round_circuit, is_inside_rail=True, endpoint=SERVER_URL)
     obs, _ = env.reset()
     state = obs_to_state(obs)
 
     #while step_count < learning_steps:
 
     raylib.init_window(800, 600, "hii")
-    raylib.set_target_fps(10)
+    # La cadence est geree par le scheduler et non par raylib.set_target_fps, pour que la periode
+    # de controle ne derive pas avec la latence reseau/camera
+    scheduler = FixedRateScheduler(args.rate, args.overrun)
 
-    while not raylib.window_should_close():
+    for tick in scheduler.ticks():
+        if raylib.window_should_close():
+            break
         raylib.begin_drawing()
         raylib.clear_background(raylib.WHITE)
 
         action_idx = choose_action(state)
         action = [actions[action_idx]]
         
-        obs, _, crashed, _, info = env.step(action)
+        with scheduler.phase('env_step'):
+            obs, _, crashed, _, info = env.step(action)
         next_state = obs_to_state(obs)
 
-        if crashed:
-            episode_count += 1
-
         info_state = info['state']
         """if raylib.is_key_down(raylib.KeyboardKey.KEY_SPACE):
             circuit.draw()
@@ -231,14 +244,18 @@ if __name__ == "__main__":
         reward = compute_reward(info_state['rail_distance'], info_state['nb_turns'], obs[0], crashed)  # -100 si crashed, sinon +speed
         
         if prev_state is not None and prev_action is not None:
-            update_q_table(prev_state, prev_action, reward, next_state)
-            send_training_data(
-                state=state,
-                action=action[0], 
-                reward=reward,
-                crashed=crashed,
-                episode=episode_count
-            )
+            with scheduler.phase('q_update'):
+                update_q_table(prev_state, prev_action, reward, next_state)
+            with scheduler.phase('send_training_data'):
+                send_training_data(
+                    state=state,
+                    action=action[0], 
+                    reward=reward,
+                    crashed=crashed,
+                    episode=episode_count,
+                    rail_distance=info_state['rail_distance'],
+                    nb_turns=info_state['nb_turns']
+                )
             if raylib.is_key_down(raylib.KeyboardKey.KEY_SPACE):
                 presstime = time.time()
                 if presstime - last_toggle_press > 0.5:
@@ -249,9 +266,15 @@ if __name__ == "__main__":
 
         
         if crashed:
+            # Incremente apres l'envoi: le pas du crash appartient a l'episode qu'il termine
+            episode_count += 1
             print(f"crash at distance:{info_state['rail_distance']}")
             save_q_table()
+            scheduler.print_stats("[Q-Learning]")
             obs, _ = env.reset()
+            # reset() attend l'operateur: statistiques par episode et echeances recalees apres l'attente
+            scheduler.reset_stats()
+            scheduler.resync()
             next_state = obs_to_state(obs)
             prev_state = None  # Pas de continuité après crash
             prev_action = None
@@ -261,4 +284,6 @@ if __name__ == "__main__":
         
         state = next_state
         raylib.end_drawing()
+    scheduler.print_stats("[Q-Learning]")
+    print_all_stats()
     save_q_table()
@@ -0,0 +1,267 @@
+import math
+import time
+import argparse
+import threading
+import collections
+import numpy as np
+
+# Estimation de la position et de la vitesse de la voiture le long du rail, a partir des detections horodatees
+# de la vision (rail_distance brute, dans [0, longueur du rail[) et des commandes moteur envoyees.
+#
+# Filtre de Kalman 1-D sur l'etat [distance deroulee (tours compris), vitesse]:
+#   - prediction avec le modele de sim.RailCarSim (acceleration = acceleration_factor * commande - rolling_resistance
+#     - turn_friction_coef * courbure), l'ecart au modele (batterie, parametres...) est couvert par le bruit d'acceleration
+#   - la mesure brute est deroulee vers le tour le plus proche de la prediction: plus de comptage des tours a la main
+#   - une mesure trop loin de la prediction (innovation > gate ecarts-types^2) est rejetee; apres max_rejected
+#     rejets consecutifs, c'est la prediction qui est fausse (ou la voiture a ete deplacee): le filtre repart de
+#     la mesure, deroulee en avant depuis la derniere mesure acceptee (la voiture ne recule pas)
+#   - predict(t) extrapole a n'importe quel instant, par exemple celui ou la prochaine commande agira
+
+
+class RailKalmanFilter:
+
+    def __init__(self, rail_length, acceleration_factor=8200.0, rolling_resistance=245.52, turn_friction_coef=3783.64,
+                 curvature_at=None, acceleration_noise=600.0, measurement_noise=1.5, gate=9.0, max_rejected=5,
+                 max_step=0.02):
+        """
+        rail_length: longueur du rail suivi (unites du circuit)
+        acceleration_factor, rolling_resistance, turn_friction_coef: modele de sim.RailCarSim (valeurs par defaut du
+            simulateur)
+        curvature_at: fonction distance -> courbure (ex: sim.RailCarSimBatch.curvature_at), sans elle le
+            frottement en virage n'est pas modelise
+        acceleration_noise: ecart-type de l'acceleration non modelisee (unites/s^2)
+        measurement_noise: ecart-type d'une detection (unites)
+        """
+        self.rail_length = rail_length
+        self.acceleration_factor = acceleration_factor
+        self.rolling_resistance = rolling_resistance
+        self.turn_friction_coef = turn_friction_coef
+        self.curvature_at = curvature_at
+        self.acceleration_noise = acceleration_noise
+        self.measurement_noise = measurement_noise
+        self.gate = gate
+        self.max_rejected = max_rejected
+        self.max_step = max_step  # pas d'integration maximal (s), la vitesse ne peut pas passer sous 0
+
+        self._lock = threading.Lock()  # mises a jour depuis le thread Socket.IO, lectures depuis l'agent
+        self._commands = collections.deque(maxlen=64)  # (heure d'effet, commande)
+        self.reset()
+
+    def reset(self, start_distance=None):
+        """
+        Oublie l'etat: la prochaine detection reinitialise le filtre (vitesse nulle).
+        start_distance: position deroulee connue (ex: 0 sur la ligne de depart); la premiere detection est alors
+                        deroulee vers le tour le plus proche, une mesure a 225 sur un rail de 226 donne -1
+        """
+        with self._lock:
+            self.start_distance = start_distance
+            self.x = np.zeros(2)
+            self.P = np.diag([self.measurement_noise ** 2, 1.0])
+            self.time = None
+            self._last_measured = None  # derniere mesure acceptee (distance deroulee, heure)
+            self.nb_updates = 0
+            self.nb_rejected = 0
+            self._consecutive_rejected = 0
+            self._commands.clear()
+
+    def set_command(self, command, timestamp=None):
+        """Commande moteur (entre 0 et 1, comme l'action de l'environnement) en vigueur a partir de timestamp"""
+        with self._lock:
+            self._commands.append((time.time() if timestamp is None else timestamp, command))
+
+    def _command_at(self, timestamp):
+        command = 0.0
+        for command_time, value in self._commands:
+            if command_time > timestamp:
+                break
+            command = value
+        return command
+
+    def _propagate(self, x, P, start, end):
+        """Integre l'etat de start a end, en coupant aux changements de commande et a max_step"""
+        boundaries = [t for t, _ in self._commands if start < t < end] + [end]
+        t = start
+        for boundary in boundaries:
+            command = self._command_at(t)
+            while t < boundary:
+                dt = min(self.max_step, boundary - t)
+                friction = self.rolling_resistance
+                if self.curvature_at is not None:
+                    friction += self.turn_friction_coef * float(self.curvature_at(x[0]))
+                speed = max(x[1] + (self.acceleration_factor * command - friction) * dt, 0.0)
+                x = np.array([x[0] + (x[1] + speed) / 2 * dt, speed])
+
+                F = np.array([[1.0, dt], [0.0, 1.0]])
+                Q = self.acceleration_noise ** 2 * np.array([[dt ** 4 / 4, dt ** 3 / 2], [dt ** 3 / 2, dt ** 2]])
+                P = F @ P @ F.T + Q
+                t += dt
+        return x, P
+
+    def update(self, rail_distance, timestamp):
+        """
+        Detection brute (rail_distance dans [0, rail_length[) a l'heure de capture timestamp.
+        Retourne True si elle a ete prise en compte (False: pas de position, mesure en retard ou rejetee)
+        """
+        if rail_distance is None or timestamp is None:
+            return False
+        with self._lock:
+            if self.time is None:
+                if self.start_distance is not None:
+                    rail_distance += self.rail_length * round((self.start_distance - rail_distance) / self.rail_length)
+                self._restart(rail_distance, timestamp)
+                return True
+            if timestamp <= self.time:
+                return False  # image deja vue ou arrivee dans le desordre
+
+            x, P = self._propagate(self.x, self.P, self.time, timestamp)
+            # Mesure deroulee vers le tour le plus proche de la prediction
+            measured = rail_distance + self.rail_length * round((x[0] - rail_distance) / self.rail_length)
+            innovation = measured - x[0]
+            innovation_variance = P[0, 0] + self.measurement_noise ** 2
+
+            if innovation ** 2 / innovation_variance > self.gate:
+                self.nb_rejected += 1
+                self._consecutive_rejected += 1
+                if self._consecutive_rejected >= self.max_rejected:
+                    last_distance, last_time = self._last_measured
+                    measured = last_distance + (rail_distance - last_distance) % self.rail_length
+                    speed = (measured - last_distance) / (timestamp - last_time)
+                    self._restart(measured, timestamp, speed)
+                    return True
+                return False
+
+            gain = P[:, 0] / innovation_variance
+            x = x + gain * innovation
+            x[1] = max(x[1], 0.0)
+            self.x = x
+            self.P = P - np.outer(gain, P[0, :])
+            self.time = timestamp
+            self._last_measured = (measured, timestamp)
+            self.nb_updates += 1
+            self._consecutive_rejected = 0
+            return True
+
+    def _restart(self, distance, timestamp, speed=0.0):
+        self.x = np.array([float(distance), float(speed)])
+        self.P = np.diag([self.measurement_noise ** 2, 100.0 ** 2])
+        self.time = timestamp
+        self._last_measured = (float(distance), timestamp)
+        self.nb_updates += 1
+        self._consecutive_rejected = 0
+
+    def predict(self, timestamp=None):
+        """(distance deroulee, vitesse) estimees a timestamp (defaut: maintenant), sans modifier le filtre"""
+        with self._lock:
+            if self.time is None:
+                return 0.0, 0.0
+            timestamp = time.time() if timestamp is None else timestamp
+            if timestamp <= self.time:
+                return float(self.x[0]), float(self.x[1])
+            x, _ = self._propagate(self.x, self.P, self.time, timestamp)
+            return float(x[0]), float(x[1])
+
+    def split(self, distance):
+        """Distance deroulee -> (rail_distance dans le tour, nombre de tours)"""
+        nb_turns = math.floor(distance / self.rail_length)
+        return distance - nb_turns * self.rail_length, nb_turns
+
+
+def benchmark(duration=30.0, camera_rates=(30, 15, 10, 5), latency=0.06, noise=1.0, outlier_rate=0.02,
+              control_rate=20.0, actuation_delay=0.02):
+    """
+    Voiture simulee (sim.RailCarSim) pilotee a control_rate Hz, detections bruitees avec outlier_rate de positions
+    aberrantes, arrivant latency s apres la capture. A chaque pas de commande, erreur de position a l'instant
+    d'actuation et de vitesse: derniere detection recue (comptage des tours 'rail_distance < last - 10', vitesse
+    par difference finie) contre le filtre.
+    """
+    import sim
+    from circuit import Circuit, SectionType as ST
+
+    circuit = Circuit([ST.SHORT, ST.SHORT, ST.TURN_LEFT, ST.LONG, ST.TURN_LEFT, ST.LONG,
+                       ST.TURN_LEFT, ST.LONG, ST.TURN_LEFT, ST.SHORT], cache_dir="cache")
+    rail_length = circuit._get_rail_length(True)
+    curvature_at = sim.RailCarSimBatch(circuit, is_inside_rail=True).curvature_at
+
+    # Trajectoire de reference: la commande vise une vitesse qui change toutes les 2 s
+    rng = np.random.default_rng(0)
+    car = sim.RailCarSim(circuit, is_inside_rail=True)
+    dt = 1 / 1000
+    times = np.arange(0.0, duration, dt)
+    distances, speeds, commands = np.empty(len(times)), np.empty(len(times)), np.empty(len(times))
+    command, target_speed = 0.0, 100.0
+    for i, t in enumerate(times):
+        if i % int(2.0 / dt) == 0:
+            target_speed = rng.uniform(60.0, 160.0)
+        if i % int(1 / control_rate / dt) == 0:
+            command = 0.12 if car.speed < target_speed else 0.0
+        commands[i] = command
+        distances[i], speeds[i] = car.rail_distance, car.speed
+        car.step(command, dt=dt)
+
+    def true_state(t):
+        i = min(int(round(t / dt)), len(times) - 1)
+        return distances[i], speeds[i]
+
+    control_times = np.arange(0.0, duration - 1.0, 1 / control_rate)
+    print(f"[RailFilter] {duration:.0f} s simules, vitesse moyenne {speeds.mean():.0f} unites/s, latence vision "
+          f"{latency * 1000:.0f} ms, bruit {noise} unites, {100 * outlier_rate:.0f} % de detections aberrantes")
+
+    for camera_rate in camera_rates:
+        capture_times = np.arange(0.0, duration, 1 / camera_rate)
+        measurements = []
+        for t in capture_times:
+            d, _ = true_state(t)
+            raw = rng.uniform(0, rail_length) if rng.random() < outlier_rate else (d + rng.normal(0, noise)) % rail_length
+            measurements.append((t + latency, t, raw))
+
+        kalman = RailKalmanFilter(rail_length, curvature_at=curvature_at)
+        kalman.reset(start_distance=0.0)
+        naive = {'rail_distance': 0.0, 'nb_turns': 0, 'time': None, 'speed': 0.0, 'distance': None}
+        errors = {'naive': ([], []), 'filtre': ([], [])}
+        next_measurement = 0
+        for t in control_times:
+            # Detections arrivees avant ce pas
+            while next_measurement < len(measurements) and measurements[next_measurement][0] <= t:
+                _, capture_time, raw = measurements[next_measurement]
+                next_measurement += 1
+                kalman.update(raw, capture_time)
+                if raw < naive['rail_distance'] - 10.0:
+                    naive['nb_turns'] += 1
+                naive['rail_distance'] = raw
+                distance = naive['nb_turns'] * rail_length + raw
+                if naive['time'] is not None:
+                    naive['speed'] = (distance - naive['distance']) / (capture_time - naive['time'])
+                naive['time'], naive['distance'] = capture_time, distance
+
+            kalman.set_command(commands[int(round(t / dt))], t)
+            actuation_time = t + actuation_delay
+            if t < 1.0:
+                continue  # demarrage: pas encore de vitesse mesurable
+            true_distance, true_speed = true_state(actuation_time)
+            estimates = {'naive': (naive['distance'] or 0.0, naive['speed']), 'filtre': kalman.predict(actuation_time)}
+            for name, (distance, speed) in estimates.items():
+                errors[name][0].append(distance - true_distance)
+                errors[name][1].append(speed - true_speed)
+
+        line = f"[RailFilter] camera {camera_rate:3d} Hz:"
+        for name, (position_errors, speed_errors) in errors.items():
+            # Erreur dans le tour d'un cote, tours mal comptes de l'autre
+            position_errors = np.asarray(position_errors)
+            wrong_lap = np.abs(position_errors) > rail_length / 2
+            position_errors = np.abs((position_errors + rail_length / 2) % rail_length - rail_length / 2)
+            speed_errors = np.abs(speed_errors)
+            line += (f" | {name} position med {np.median(position_errors):5.2f} / p95 {np.percentile(position_errors, 95):6.2f},"
+                     f" tour faux {100 * wrong_lap.mean():3.0f} %,"
+                     f" vitesse med {np.median(speed_errors):5.1f} / p95 {np.percentile(speed_errors, 95):6.1f}")
+        print(line + f" | rejetees {kalman.nb_rejected}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark du filtre de position sur le rail (donnees simulees)")
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--latency', type=float, default=0.06, help="Latence vision (s)")
+    parser.add_argument('--noise', type=float, default=1.0, help="Bruit de detection (unites)")
+    parser.add_argument('--outliers', type=float, default=0.02, help="Proportion de detections aberrantes")
+    args = parser.parse_args()
+
+    benchmark(args.duration, latency=args.latency, noise=args.noise, outlier_rate=args.outliers)
@@ -0,0 +1,145 @@
+import time
+import collections
+from contextlib import contextmanager
+import numpy as np
+
+
+class FixedRateScheduler:
+    """
+    Cadence une boucle de controle a frequence fixe (ex: RailCarRealEnv.step) avec suivi des echeances.
+
+    Utilisation:
+        scheduler = FixedRateScheduler(20)
+        for tick in scheduler.ticks():
+            with scheduler.phase('env_step'):
+                obs, reward, crashed, _, info = env.step(action)
+            if crashed:
+                break
+        scheduler.print_stats()
+
+    overrun_policy:
+        'skip': si une iteration deborde, les echeances manquees sont sautees et on se recale sur la grille
+        'catch_up': les echeances manquees sont executees a la suite jusqu'a rattraper le retard
+    """
+
+    def __init__(self, frequency, overrun_policy='skip', spin_margin=0.001, history_size=10000):
+        if overrun_policy not in ('skip', 'catch_up'):
+            raise ValueError(f"overrun_policy inconnue: {overrun_policy}")
+        self.frequency = frequency
+        self.period = 1.0 / frequency
+        self.overrun_policy = overrun_policy
+        # On dort jusqu'a spin_margin avant l'echeance puis on attend activement (time.sleep est trop imprecis)
+        self.spin_margin = spin_margin
+        self.history_size = history_size
+        self._resync = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.nb_ticks = 0
+        self.nb_overruns = 0
+        self.nb_skipped = 0
+        self._periods = collections.deque(maxlen=self.history_size)
+        self._lateness = collections.deque(maxlen=self.history_size)
+        self._phases = collections.defaultdict(lambda: collections.deque(maxlen=self.history_size))
+
+    def _wait_until(self, deadline):
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin_margin:
+            time.sleep(remaining - self.spin_margin)
+        while time.perf_counter() < deadline:
+            pass
+
+    def resync(self):
+        """
+        Recale la grille d'echeances sur la fin de l'iteration en cours: a appeler apres une pause hors cadence
+        (ex: env.reset() qui attend l'operateur), qui ne compte alors ni comme debordement ni dans les periodes
+        """
+        self._resync = True
+
+    def ticks(self, max_ticks=None):
+        """Generateur qui rend la main a chaque echeance et renvoie le numero de tick"""
+        start = time.perf_counter()
+        deadline = start
+        last_tick_start = None
+        index = 0
+
+        while max_ticks is None or index < max_ticks:
+            self._wait_until(deadline)
+            tick_start = time.perf_counter()
+            self._lateness.append(tick_start - deadline)
+            if last_tick_start is not None:
+                self._periods.append(tick_start - last_tick_start)
+            last_tick_start = tick_start
+            self.nb_ticks += 1
+
+            yield index
+
+            index += 1
+            if self._resync:
+                self._resync = False
+                deadline = time.perf_counter()
+                last_tick_start = None
+                continue
+            deadline += self.period
+
+            now = time.perf_counter()
+            if now > deadline:
+                # L'iteration a depasse son creneau
+                self.nb_overruns += 1
+                if self.overrun_policy == 'skip':
+                    missed = int((now - deadline) / self.period) + 1
+                    self.nb_skipped += missed
+                    deadline += missed * self.period
+
+    def run(self, step_callback, max_ticks=None):
+        """Appelle step_callback(tick) a chaque echeance jusqu'a ce qu'il renvoie False"""
+        for tick in self.ticks(max_ticks):
+            with self.phase('step'):
+                keep_going = step_callback(tick)
+            if keep_going is False:
+                break
+
+    @contextmanager
+    def phase(self, name):
+        """Mesure la duree d'une phase de l'iteration (ex: 'env_step', 'q_update')"""
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases[name].append(time.perf_counter() - phase_start)
+
+    def stats(self):
+        def summary(samples):
+            if len(samples) == 0:
+                return None
+            samples = np.array(samples) * 1000.0  # ms
+            return {
+                'mean_ms': float(np.mean(samples)),
+                'p50_ms': float(np.percentile(samples, 50)),
+                'p95_ms': float(np.percentile(samples, 95)),
+                'max_ms': float(np.max(samples)),
+            }
+
+        periods = np.array(self._periods)
+        period_error = (periods - self.period) * 1000.0
+        return {
+            'target_period_ms': self.period * 1000.0,
+            'ticks': self.nb_ticks,
+            'overruns': self.nb_overruns,
+            'skipped': self.nb_skipped,
+            'period': summary(self._periods),
+            'jitter_ms': float(np.std(period_error)) if len(periods) > 0 else None,
+            'max_period_error_ms': float(np.max(np.abs(period_error))) if len(periods) > 0 else None,
+            'lateness': summary(self._lateness),
+            'phases': {name: summary(samples) for name, samples in self._phases.items()},
+        }
+
+    def print_stats(self, prefix="[Scheduler]"):
+        s = self.stats()
+        print(f"{prefix} {s['ticks']} ticks a {self.frequency} Hz, {s['overruns']} debordements, {s['skipped']} echeances sautees")
+        if s['period'] is not None:
+            print(f"{prefix} periode: moy {s['period']['mean_ms']:.2f} ms (cible {s['target_period_ms']:.2f} ms), "
+                  f"jitter {s['jitter_ms']:.2f} ms, ecart max {s['max_period_error_ms']:.2f} ms")
+        for name, phase in s['phases'].items():
+            if phase is not None:
+                print(f"{prefix} {name}: moy {phase['mean_ms']:.2f} ms, p95 {phase['p95_ms']:.2f} ms, max {phase['max_ms']:.2f} ms")
@@ -1,35 +1,258 @@
-import requests
-import random
 import time
-import board
-import busio
-import adafruit_ads1x15.ads1115 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
+import math
+import random
+import argparse
+import threading
+import statistics
+import collections
+import queue
+import socketio
+from http_client import get_client
+
+server_ip = "http://127.0.0.1:5000"
+
+# Le pont diviseur divise la tension batterie par 5
+VOLTAGE_SCALE = 5
+
+
+def make_ads_channel(data_rate=860):
+    """Configure l'ADS1115 en conversion continue et retourne une fonction de lecture de tension"""
+    import board
+    import busio
+    import adafruit_ads1x15.ads1115 as ADS
+    from adafruit_ads1x15.ads1x15 import Mode
+    from adafruit_ads1x15.analog_in import AnalogIn
+
+    #Config du ADS1115
+    i2c = busio.I2C(board.SCL, board.SDA)
+    ads = ADS.ADS1115(i2c)
+    # En mode continu l'ADC convertit en permanence, une lecture ne fait que recuperer le dernier resultat
+    ads.mode = Mode.CONTINUOUS
+    ads.data_rate = data_rate
+    channel = AnalogIn(ads, ADS.P0)
+    return lambda: channel.voltage
+
+
+class FakeAdc:
+    """ADC simule (tension qui oscille + bruit) pour tester sans le materiel"""
+
+    def __init__(self, base_voltage=2.5, amplitude=0.3, period=2.0, noise=0.01):
+        self.base_voltage = base_voltage
+        self.amplitude = amplitude
+        self.period = period
+        self.noise = noise
+
+    def __call__(self):
+        phase = 2 * math.pi * time.time() / self.period
+        return self.base_voltage + self.amplitude * math.sin(phase) + random.gauss(0, self.noise)
+
+
+class CrashDetector:
+    """
+    Detection de crash sur le flux complet d'echantillons: mediane glissante (elimine les pics isoles)
+    puis seuil a hysteresis. Meme critere que l'ancien test de RailCarRealEnv.step
+    (tension > 14V et tension > duty_cycle * 14.5V), mais applique a la tension filtree.
+    Moteur arrete, la tension au repos de la batterie (~14.7V) depasse le seuil: la detection n'est armee
+    que settle_time secondes apres le passage a un rapport cyclique non nul, et un crash en cours est leve
+    a l'arret du moteur.
+    """
+
+    def __init__(self, window=15, on_threshold=14.0, duty_factor=14.5, hysteresis=0.3, settle_time=0.3):
+        self.window = collections.deque(maxlen=window)
+        self.on_threshold = on_threshold
+        self.duty_factor = duty_factor
+        self.hysteresis = hysteresis
+        self.settle_time = settle_time
+        self.duty_cycle = 0.0
+        self.armed_at = None  # heure (time.monotonic) a partir de laquelle la detection est armee
+        self.crashed = False
+
+    def set_duty_cycle(self, duty_cycle):
+        if duty_cycle <= 0:
+            self.armed_at = None
+        elif self.armed_at is None:
+            self.armed_at = time.monotonic() + self.settle_time
+        self.duty_cycle = duty_cycle
+
+    def update(self, voltage):
+        """Retourne (tension filtree, evenement) avec evenement 'crash', 'recovered' ou None"""
+        self.window.append(voltage)
+        filtered = statistics.median(self.window)
+
+        armed_at = self.armed_at
+        if armed_at is None or time.monotonic() < armed_at:
+            if self.crashed:
+                self.crashed = False
+                return filtered, 'recovered'
+            return filtered, None
+
+        threshold = max(self.on_threshold, (self.duty_cycle / 100.0) * self.duty_factor)
+
+        if not self.crashed and filtered > threshold:
+            self.crashed = True
+            return filtered, 'crash'
+        if self.crashed and filtered < threshold - self.hysteresis:
+            self.crashed = False
+            return filtered, 'recovered'
+        return filtered, None
+
+
+class AdcSampler:
+    """
+    Un thread lit l'ADC a sa cadence de conversion et empile (timestamp, tension) dans un buffer circulaire.
+    Un second thread envoie les echantillons au serveur par lots, send_rate fois par seconde.
+    Si le serveur ne repond pas, les echantillons restent en attente (au plus max_pending, les plus vieux
+    sont abandonnes au-dela) et partent au prochain envoi reussi.
+
+    Avec un detector (CrashDetector), chaque echantillon passe dans le filtre: les evenements de crash
+    partent immediatement sur /crash_event, et seule une valeur filtree sur `decimation` est envoyee
+    dans les lots, pour limiter le trafic.
+    """
+
+    def __init__(self, read_voltage, client, sample_rate=860, send_rate=20,
+                 buffer_size=4096, max_pending=60000, max_batch=2000, detector=None, decimation=1):
+        self.read_voltage = read_voltage
+        self.client = client
+        self.sample_period = 1.0 / sample_rate
+        self.send_period = 1.0 / send_rate
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.detector = detector
+        self.decimation = decimation
+
+        self._events = queue.Queue()
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._pending = []
+        self._stop = threading.Event()
+        self._threads = []
+
+        self.nb_samples = 0
+        self.nb_sent = 0
+        self.nb_dropped = 0
+        self.nb_send_errors = 0
+
+    def start(self):
+        self._threads = [
+            threading.Thread(target=self._sample_loop, name="AdcSampler-sample", daemon=True),
+            threading.Thread(target=self._send_loop, name="AdcSampler-send", daemon=True),
+        ]
+        if self.detector is not None:
+            self._threads.append(threading.Thread(target=self._event_loop, name="AdcSampler-events", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._events.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.flush()
+
+    def _sample_loop(self):
+        next_sample = time.perf_counter()
+        while not self._stop.is_set():
+            timestamp = time.time()
+            voltage = VOLTAGE_SCALE * self.read_voltage()
+            self.nb_samples += 1
+
+            if self.detector is None:
+                self._buffer.append((timestamp, voltage))
+            else:
+                filtered, event = self.detector.update(voltage)
+                if event is not None:
+                    self._events.put({'event': event, 'timestamp': timestamp, 'voltage': filtered})
+                if self.nb_samples % self.decimation == 0:
+                    self._buffer.append((timestamp, filtered))
+
+            # Cadence fixe calee sur le debit de conversion de l'ADC
+            next_sample += self.sample_period
+            delay = next_sample - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_sample = time.perf_counter()
+
+    def _event_loop(self):
+        # Thread dedie pour que l'envoi d'un evenement n'attende ni le prochain lot ni un envoi en cours
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            try:
+                self.client.post("/crash_event", json=event, retries=2)
+                print(f"Crash event: {event}")
+            except Exception as e:
+                print(f"Error sending crash event: {e}")
+
+    def _send_loop(self):
+        while not self._stop.wait(self.send_period):
+            self.flush()
+
+    def flush(self):
+        """Envoie tous les echantillons disponibles. Retourne False si le serveur n'a pas pu etre joint"""
+        while self._buffer:
+            self._pending.append(self._buffer.popleft())
 
-server_ip = "http://127.0.0.1:5000/sensor_data"
+        if len(self._pending) > self.max_pending:
+            nb_dropped = len(self._pending) - self.max_pending
+            del self._pending[:nb_dropped]
+            self.nb_dropped += nb_dropped
 
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            try:
+                response = self.client.post("/sensor_data", json={
+                    'samples': batch,
+                    'crash_detection': self.detector is not None,
+                })
+                response.raise_for_status()
+            except Exception as e:
+                self.nb_send_errors += 1
+                print(f"Error sending data: {e} ({len(self._pending)} samples pending)")
+                return False
+            del self._pending[:len(batch)]
+            self.nb_sent += len(batch)
+        return True
 
-#Config du ADS1115
-i2c = busio.I2C(board.SCL, board.SDA)
-ads = ADS.ADS1115(i2c)
-channel = AnalogIn(ads, ADS.P0)
 
+def follow_duty_cycle(detector):
+    """Le seuil de crash depend du rapport cyclique: on suit les commandes moteur diffusees par le serveur"""
+    sio = socketio.Client(reconnection=True)
+    on_duty_cycle = lambda data: detector.set_duty_cycle(data.get('duty_cycle', 0.0))
+    sio.on('motor_control', on_duty_cycle, namespace='/control')
+    # Commandes envoyees par le canal UDP (command_channel.py), relayees par le serveur
+    sio.on('duty_cycle_update', on_duty_cycle, namespace='/control')
+    # duty_cycle_update n'est envoye qu'aux clients qui le demandent (pas aux controleurs moteur)
+    sio.connect(server_ip, namespaces=['/control'], auth={'duty_cycle': True})
+    return sio
 
-def send_data():
-    while True:
-        # Données a envoyer
-        voltage = channel.voltage 
-        timestamp = time.time()
-        data_to_send = {"value": 5*voltage, 'timestamp':timestamp}
+def send_data(read_voltage, sample_rate=860, send_rate=20, crash_detection=True, decimation=8):
+    detector = CrashDetector() if crash_detection else None
+    if detector is not None:
+        follow_duty_cycle(detector)
+    else:
+        decimation = 1
 
-        try:
-            #Envoyer données au serveur
-            response = requests.post(server_ip, json=data_to_send)
-            print("Sent:" ,data_to_send)
-        except Exception as e:
-            print(f"Error sending data: {e}")
-        time.sleep(0.05)
+    sampler = AdcSampler(read_voltage, get_client(server_ip, timeout=0.5), sample_rate=sample_rate,
+                         send_rate=send_rate, detector=detector, decimation=decimation)
+    sampler.start()
+    try:
+        while True:
+            time.sleep(1)
+            print(f"Sampled: {sampler.nb_samples}, sent: {sampler.nb_sent}, dropped: {sampler.nb_dropped}")
+    except KeyboardInterrupt:
+        sampler.stop()
 
 if __name__ == "__main__":
-    send_data()
+    parser = argparse.ArgumentParser(description="Echantillonnage de la tension et envoi au serveur")
+    parser.add_argument('--sample-rate', type=float, default=860, help="Frequence d'echantillonnage de l'ADC (Hz)")
+    parser.add_argument('--send-rate', type=float, default=20, help="Nombre d'envois de lots par seconde")
+    parser.add_argument('--fake', action='store_true', help="Utiliser un ADC simule")
+    parser.add_argument('--no-crash-detection', action='store_true',
+                        help="Envoyer les echantillons bruts sans filtrage ni detection de crash")
+    parser.add_argument('--decimation', type=int, default=8,
+                        help="Avec la detection de crash, n'envoyer qu'un echantillon filtre sur N")
+    args = parser.parse_args()
 
+    read_voltage = FakeAdc() if args.fake else make_ads_channel()
+    send_data(read_voltage, args.sample_rate, args.send_rate, not args.no_crash_detection, args.decimation)
@@ -0,0 +1,75 @@
+import os
+import sys
+
+# Lancement de server.py en production: serveur WSGI asynchrone (gevent, a defaut eventlet), sans debug
+# ni reloader ni log par requete. Chaque connexion est une greenlet au lieu d'un thread Werkzeug, et les
+# emissions Socket.IO ne bloquent plus les handlers HTTP.
+#   pip install gevent        (ou eventlet)
+#   python serve.py [--port 5000] [--command-port 5005]
+#
+# Le monkey-patching doit preceder tout autre import (sockets, threading, time.sleep), d'ou ce module
+# separe: server.py lit RAILCAR_ASYNC_MODE au moment ou il cree le serveur Socket.IO.
+
+
+def make_listener(host, port, backlog=128):
+    """
+    Socket d'ecoute avec TCP_NODELAY (herite par les connexions acceptees): les serveurs gevent/eventlet
+    ecrivent en-tetes et corps de la reponse separement, et sans cette option l'algorithme de Nagle
+    combine a l'ACK retarde du client ajoute ~40 ms a chaque requete keep-alive.
+    """
+    import socket
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    return listener
+
+
+def serve_forever(app, async_mode, host, port):
+    listener = make_listener(host, port)
+    if async_mode == 'gevent':
+        from gevent import pywsgi
+        # Sans gevent-websocket, engineio gere les websockets avec simple-websocket
+        pywsgi.WSGIServer(listener, app, log=None).serve_forever()
+    else:
+        import eventlet.wsgi
+        eventlet.wsgi.server(listener, app, log_output=False)
+
+
+def patch_async_mode(preferred=None):
+    """Monkey-patche la bibliotheque asynchrone disponible et retourne son nom"""
+    candidates = [preferred] if preferred else ['gevent', 'eventlet']
+    for mode in candidates:
+        try:
+            if mode == 'gevent':
+                from gevent import monkey
+                monkey.patch_all()
+            elif mode == 'eventlet':
+                import eventlet
+                eventlet.monkey_patch()
+            else:
+                raise ValueError(f"Mode asynchrone inconnu: {mode}")
+            return mode
+        except ImportError:
+            continue
+    sys.exit(f"[serve] Aucun serveur asynchrone disponible parmi {candidates}: pip install gevent")
+
+
+if __name__ == '__main__':
+    # --async-mode est lu avant argparse, qui n'est importe qu'apres le monkey-patching
+    preferred = None
+    if '--async-mode' in sys.argv:
+        preferred = sys.argv[sys.argv.index('--async-mode') + 1]
+    os.environ['RAILCAR_ASYNC_MODE'] = patch_async_mode(preferred)
+
+    import server
+
+    parser = server.make_parser("Serveur de telemetrie et de commande (production)")
+    parser.add_argument('--async-mode', type=str, choices=['gevent', 'eventlet'], default=None)
+    args = parser.parse_args()
+
+    server.start_services(args)
+
+    print(f"Starting server ({server.ASYNC_MODE}) on {args.host}:{args.port}...")
+    serve_forever(server.app, server.ASYNC_MODE, args.host, args.port)
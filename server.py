@@ -1,13 +1,103 @@
-from flask import Flask, render_template, jsonify, request
-from flask_socketio import SocketIO
+from flask import Flask, render_template, jsonify, request, Response, url_for
+from flask_socketio import SocketIO, join_room
 import time 
 import pyray as raylib
 import os
+import numpy as np
 from circuit import SectionType as ST
 from circuit import Circuit
+from broadcast import BroadcastScheduler
+from command_channel import CommandRelay, DEFAULT_PORT as COMMAND_PORT
+from telemetry_store import TelemetryStore
+from wire_format import BINARY_ENCODING, JSON_ENCODING, make_encoder
+from episode_stats import EpisodeAggregator
+import argparse
 
 app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*")  
+# Modele d'execution de Socket.IO: 'threading' avec le serveur de dev Werkzeug (python server.py),
+# 'gevent' ou 'eventlet' en production (python serve.py, qui fixe RAILCAR_ASYNC_MODE avant l'import)
+ASYNC_MODE = os.environ.get('RAILCAR_ASYNC_MODE', 'threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE)
+
+# Le trafic est separe en namespaces, chaque client ne se connecte qu'a ceux dont il a besoin:
+#   /control   : motor_control, crash_event (controleurs sur le Pi),
+#                duty_cycle_update = commandes UDP, seulement pour les clients qui le demandent (capteur)
+#   /telemetry : sensor_update, car_position_update, update_plot, to_controller, crash_event, car_crashed
+#                (dashboard, RailCarRealEnv en mode push)
+#   /training  : training_progress, episode_summary (dashboard),
+#                training_update = chaque pas brut, seulement pour les clients qui le demandent (debug)
+CONTROL_NAMESPACE = '/control'
+TELEMETRY_NAMESPACE = '/telemetry'
+TRAINING_NAMESPACE = '/training'
+NAMESPACES = [CONTROL_NAMESPACE, TELEMETRY_NAMESPACE, TRAINING_NAMESPACE]
+
+# Frequence max d'emission (Hz) par evenement et par classe de clients. Les handlers HTTP publient
+# la derniere valeur, seule la plus recente part a chaque echeance (voir broadcast.py).
+# motor_control, crash_event et car_crashed restent emis immediatement.
+#
+# Les evenements frequents existent en JSON et en binaire compact (wire_format.py): chaque client choisit
+# a la connexion (auth={'encoding': 'binary-v1'}) et rejoint la room de son encodage. Les classes *_json et
+# *_binary ne visent que leur room, les autres classes visent tout leur namespace.
+BROADCAST_RATES = {
+    'update_plot': {'telemetry': 20},
+    'to_controller': {'telemetry': 20},
+    'sensor_update': {'telemetry_json': 20, 'telemetry_binary': 20},
+    'car_position_update': {'telemetry_json': 30, 'telemetry_binary': 30},
+    # Resume de l'episode en cours + moyennes glissantes (voir episode_stats.py)
+    'training_progress': {'training': 10},
+    # Pas bruts: uniquement les clients connectes avec auth={'raw_steps': True}
+    'training_update': {'training_raw_json': 10, 'training_raw_binary': 10},
+    # Commandes passees par le canal UDP (command_channel.py), pour le suivi du rapport cyclique: uniquement
+    # les clients connectes avec auth={'duty_cycle': True}, les controleurs moteur n'en ont pas l'usage
+    'duty_cycle_update': {'control_duty_cycle': 20},
+}
+broadcaster = BroadcastScheduler(socketio, BROADCAST_RATES, namespaces={
+    'control_duty_cycle': CONTROL_NAMESPACE,
+    'telemetry': TELEMETRY_NAMESPACE,
+    'telemetry_json': TELEMETRY_NAMESPACE,
+    'telemetry_binary': TELEMETRY_NAMESPACE,
+    'training': TRAINING_NAMESPACE,
+    'training_raw_json': TRAINING_NAMESPACE,
+    'training_raw_binary': TRAINING_NAMESPACE,
+}, rooms={
+    'control_duty_cycle': 'duty_cycle',
+    'telemetry_json': JSON_ENCODING,
+    'telemetry_binary': BINARY_ENCODING,
+    'training_raw_json': 'raw_steps_' + JSON_ENCODING,
+    'training_raw_binary': 'raw_steps_' + BINARY_ENCODING,
+}, encoders={
+    'telemetry_binary': make_encoder(BINARY_ENCODING),
+    'training_raw_binary': make_encoder(BINARY_ENCODING),
+})
+
+# Nombre de clients connectes par namespace
+connected_clients = {namespace: 0 for namespace in NAMESPACES}
+
+def _register_namespace(namespace):
+    # Un namespace n'accepte de connexions que s'il a des handlers
+    @socketio.on('connect', namespace=namespace)
+    def on_connect(auth=None):
+        connected_clients[namespace] += 1
+        # Encodage demande par le client, JSON si absent ou inconnu
+        encoding = (auth or {}).get('encoding')
+        encoding = BINARY_ENCODING if encoding == BINARY_ENCODING else JSON_ENCODING
+        join_room(encoding)
+        if namespace == TRAINING_NAMESPACE and (auth or {}).get('raw_steps'):
+            join_room('raw_steps_' + encoding)
+        if namespace == CONTROL_NAMESPACE and (auth or {}).get('duty_cycle'):
+            join_room('duty_cycle')
+
+    @socketio.on('disconnect', namespace=namespace)
+    def on_disconnect(*args):
+        connected_clients[namespace] -= 1
+
+for namespace in NAMESPACES:
+    _register_namespace(namespace)
+
+# Tout ce qui ne depend que de la geometrie du circuit est calcule une fois puis relu depuis le disque,
+# cle = Circuit.get_section_hash(): table de positions (circuit.py), bornes + polylignes des rails, image
+CACHE_DIR = "cache"
+GEOMETRY_VERSION = 1
 
 real_circuit = Circuit([
     ST.SHORT, ST.SHORT, ST.TURN_RIGHT, ST.SHORT, ST.SHORT, ST.SHORT,
@@ -16,11 +106,35 @@ real_circuit = Circuit([
     ST.LONG, ST.LONG, ST.LONG, ST.LONG, ST.LONG, ST.LONG,
     ST.TURN_LEFT, ST.SHORT, ST.SHORT, ST.SHORT, ST.TURN_LEFT,
     ST.LONG, ST.SHORT, ST.TURN_RIGHT, ST.TURN_LEFT, ST.TURN_LEFT,
-])
+], cache_dir=CACHE_DIR)
+CIRCUIT_IMAGE = f"circuit_{real_circuit.get_section_hash()}.png"
 
 latest_voltage = 0.0
 latest_timestamp = 0.0
 
+# Historique borne par signal (voir telemetry_store.py), consultable par /telemetry: un dashboard ou un
+# entraineur qui se reconnecte recupere l'historique sans campagne de collecte separee.
+# Tension: tous les echantillons recus (~110 Hz avec la decimation par defaut du capteur, ~2h30)
+TELEMETRY_CAPACITY = {
+    'voltage': 2**20,
+    'rail_distance': 2**18,
+    'duty_cycle': 2**18,
+    'reward': 2**18,
+}
+telemetry = TelemetryStore(TELEMETRY_CAPACITY)
+
+# Agregats par episode mis a jour a chaque pas recu sur /training_data (actions de qlearn entre 0 et 1)
+episode_stats = EpisodeAggregator(window=20, action_bins=10, action_range=(0.0, 1.0))
+
+# Crash detecte cote capteur (voir sensor.CrashDetector). enabled passe a True des que le capteur
+# annonce qu'il fait la detection, sinon les clients gardent leur propre critere sur la tension
+crash_state = {
+    'enabled': False,
+    'crashed': False,
+    'timestamp': 0.0,
+    'voltage': 0.0,
+}
+
 # Car state for visualization
 car_state = {
     'position': {'x': 0, 'y': 0},
@@ -61,31 +175,75 @@ def generate_circuit_image(circuit, output_path, width=800, height=600):
     
     print(f"Circuit image generated: {output_path}")
 
-def get_circuit_bounds():
-    """Calculate circuit bounds for coordinate mapping"""
-    # Sample points along the circuit to find bounds
-    positions = []
-    rail_length = real_circuit._outside_rail_length
-    
-    for i in range(0, int(rail_length), 10):
-        pos = real_circuit.get_position_at_rail(i, False)
-        positions.append((pos.x, pos.y))
-    
-    x_coords = [p[0] for p in positions]
-    y_coords = [p[1] for p in positions]
-    
+def compute_circuit_geometry(circuit, step=2.0):
+    """
+    Bornes et polylignes des deux rails en un seul tableau float32:
+    [version, min_x, max_x, min_y, max_y, nb points interieur, nb points exterieur,
+     x0, y0, x1, y1, ... (rail interieur puis rail exterieur)]
+    Les bornes sont celles du rail exterieur, qui englobe l'interieur.
+    """
+    rails = []
+    for is_inside_rail in (True, False):
+        rail_length = circuit._inside_rail_length if is_inside_rail else circuit._outside_rail_length
+        points = [circuit.get_position_at_rail(d, is_inside_rail) for d in np.arange(0.0, rail_length, step)]
+        rails.append(np.array([(p.x, p.y) for p in points], dtype=np.float32))
+    inside, outside = rails
+
+    header = np.array([GEOMETRY_VERSION,
+                       outside[:, 0].min(), outside[:, 0].max(), outside[:, 1].min(), outside[:, 1].max(),
+                       len(inside), len(outside)], dtype=np.float32)
+    return np.concatenate([header, inside.ravel(), outside.ravel()])
+
+def load_circuit_geometry(circuit):
+    path = os.path.join(CACHE_DIR, f"circuit_geometry_v{GEOMETRY_VERSION}_{circuit.get_section_hash()}.f32")
+    if os.path.exists(path):
+        geometry = np.fromfile(path, dtype='<f4')
+    else:
+        geometry = compute_circuit_geometry(circuit).astype('<f4')
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        geometry.tofile(path)
+
+    min_x, max_x, min_y, max_y = (float(v) for v in geometry[1:5])
     return {
-        'min_x': min(x_coords), 'max_x': max(x_coords),
-        'min_y': min(y_coords), 'max_y': max(y_coords)
+        'bounds': {'min_x': min_x, 'max_x': max_x, 'min_y': min_y, 'max_y': max_y},
+        'payload': geometry.tobytes(),
+        'etag': f"{circuit.get_section_hash()}-v{GEOMETRY_VERSION}",
     }
 
+circuit_geometry = load_circuit_geometry(real_circuit)
+
+def get_circuit_bounds():
+    """Circuit bounds for coordinate mapping"""
+    return circuit_geometry['bounds']
+
+def _cached_response(response, etag):
+    # Le client garde sa copie et revalide: reponse 304 sans corps tant que le circuit ne change pas
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/')
 def index():
-    return render_template('dashboard.html')
+    return render_template('dashboard.html', circuit_image=url_for('static', filename=CIRCUIT_IMAGE))
 
 @app.route('/circuit_bounds')
 def circuit_bounds():
-    return jsonify(get_circuit_bounds())
+    return _cached_response(jsonify(get_circuit_bounds()), circuit_geometry['etag'])
+
+@app.route('/circuit_geometry')
+def get_circuit_geometry():
+    """Bornes + polylignes des rails en float32 little-endian (format: compute_circuit_geometry)"""
+    response = Response(circuit_geometry['payload'], mimetype='application/octet-stream')
+    return _cached_response(response, circuit_geometry['etag'])
+
+def clear_crash():
+    """Moteur arrete (arret ou reset d'episode): le crash en cours est leve et les clients prevenus"""
+    car_state['crashed'] = False
+    if crash_state['crashed']:
+        crash_state.update({'crashed': False, 'timestamp': time.time()})
+        socketio.emit('crash_event', crash_state, namespace=CONTROL_NAMESPACE)
+        socketio.emit('crash_event', crash_state, namespace=TELEMETRY_NAMESPACE)
 
 @app.route('/control', methods=['POST'])
 def control_motor():
@@ -93,7 +251,10 @@ def control_motor():
     duty_cycle = data.get('duty_cycle', 0.0)
     
     # Forward to controller via Socket.IO
-    socketio.emit('motor_control', {'duty_cycle': duty_cycle})
+    socketio.emit('motor_control', {'duty_cycle': duty_cycle}, namespace=CONTROL_NAMESPACE)
+    telemetry.append('duty_cycle', time.time(), duty_cycle)
+    if duty_cycle <= 0:
+        clear_crash()
     
     return jsonify({'status': 'success', 'duty_cycle': duty_cycle})
 
@@ -104,22 +265,37 @@ def receive_data():
         data = request.get_json()
         if not data:
             return jsonify({'status': 'error', 'message': 'No JSON data received'}), 400
-            
-        value = data.get('value', None)
-        timestamp = data.get('timestamp', None)
+
+        # Deux formats: un echantillon {'value', 'timestamp'} ou un lot {'samples': [[timestamp, value], ...]}
+        samples = data.get('samples')
+        if samples:
+            timestamp, value = samples[-1]
+            samples = np.asarray(samples, dtype=np.float64)
+            telemetry.extend('voltage', samples[:, 0], samples[:, 1])
+        else:
+            value = data.get('value', None)
+            timestamp = data.get('timestamp', None)
+            if value is not None and timestamp is not None:
+                telemetry.append('voltage', timestamp, value)
         latest_voltage = value
         latest_timestamp = timestamp
+        if data.get('crash_detection'):
+            crash_state['enabled'] = True
 
         if value is not None and timestamp is not None: 
+            # Un lot ne donne lieu qu'a une emission, avec l'echantillon le plus recent
             # Send to controller
-            socketio.emit('update_plot', {'value': value})
-            socketio.emit('to_controller', {'value': value, 'timestamp': timestamp})
+            broadcaster.publish('update_plot', {'value': value})
+            broadcaster.publish('to_controller', {'value': value, 'timestamp': timestamp})
             
-            # Send sensor data to dashboard at 1Hz
-            socketio.emit('sensor_update', {
+            # Send sensor data to dashboard (cadence: BROADCAST_RATES)
+            sensor_update = {
                 'voltage': value,
                 'timestamp': timestamp
-            })
+            }
+            if crash_state['enabled']:
+                sensor_update['crashed'] = crash_state['crashed']
+            broadcaster.publish('sensor_update', sensor_update)
             
             return jsonify({'status': 'success'})
         else:
@@ -127,6 +303,28 @@ def receive_data():
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/crash_event', methods=['POST'])
+def receive_crash_event():
+    """Evenement de crash ('crash' ou 'recovered') detecte par le capteur, relaye immediatement"""
+    try:
+        data = request.get_json()
+        crash_state.update({
+            'enabled': True,
+            'crashed': data.get('event') == 'crash',
+            'timestamp': data.get('timestamp', time.time()),
+            'voltage': data.get('voltage', latest_voltage),
+        })
+        socketio.emit('crash_event', crash_state, namespace=CONTROL_NAMESPACE)
+        socketio.emit('crash_event', crash_state, namespace=TELEMETRY_NAMESPACE)
+
+        if crash_state['crashed']:
+            car_state['crashed'] = True
+            socketio.emit('car_crashed', car_state, namespace=TELEMETRY_NAMESPACE)
+
+        return jsonify({'status': 'success'})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @app.route('/car_position', methods=['POST'])
 def receive_car_position():
     """Receive car position from vision system"""
@@ -143,11 +341,14 @@ def receive_car_position():
             'position': {'x': position.x, 'y': position.y},
             'rail_distance': rail_distance,
             'tangent': {'x': tangent.x, 'y': tangent.y},
-            'timestamp': time.time()
+            # Heure de capture de l'image par la vision si elle la fournit (filtre de RailCarRealEnv), sinon de reception
+            'timestamp': data.get('timestamp') or time.time(),
+            'capture_time': data.get('timestamp'),
         })
+        telemetry.append('rail_distance', car_state['timestamp'], rail_distance)
         
         # Emit car position at high frequency (10-20Hz)
-        socketio.emit('car_position_update', car_state)
+        broadcaster.publish('car_position_update', dict(car_state))
         
         return jsonify({'status': 'success'})
     except Exception as e:
@@ -158,37 +359,154 @@ def receive_training_data():
     """Receive Q-learning training data"""
     try:
         data = request.get_json()
-        
-        # Emit training data at 1Hz
-        socketio.emit('training_update', {
+        now = time.time()
+        if data.get('reward') is not None:
+            telemetry.append('reward', now, data['reward'])
+
+        step = {
             'state': data.get('state'),
             'action': data.get('action'), 
             'reward': data.get('reward'),
             'crashed': data.get('crashed', False),
             'episode': data.get('episode', 0),
-            'timestamp': time.time()
-        })
+            'distance': data.get('distance'),  # deroulee depuis le depart de l'episode
+            'rail_distance': data.get('rail_distance'),
+            'nb_turns': data.get('nb_turns'),
+            'timestamp': now
+        }
+        finished = episode_stats.update(step)
+        if finished is not None:
+            # Un message par episode, emis immediatement pour qu'aucun ne soit perdu par le regroupement
+            socketio.emit('episode_summary', finished, namespace=TRAINING_NAMESPACE)
+
+        # Emit training data (cadence: BROADCAST_RATES)
+        progress = episode_stats.progress()
+        progress['timestamp'] = now
+        broadcaster.publish('training_progress', progress)
+        broadcaster.publish('training_update', step)
         
         # Update car crash state
         if data.get('crashed'):
             car_state['crashed'] = True
-            socketio.emit('car_crashed', car_state)
+            socketio.emit('car_crashed', car_state, namespace=TELEMETRY_NAMESPACE)
         
         return jsonify({'status': 'success'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/episodes', methods=['GET'])
+def get_episodes():
+    """Episodes termines: /episodes?since=<index>&limit=<n>, plus l'episode en cours et les moyennes glissantes"""
+    since = request.args.get('since', type=int)
+    limit = request.args.get('limit', type=int)
+    return jsonify({
+        'episodes': episode_stats.episodes(since, limit),
+        'progress': episode_stats.progress(),
+    })
+
 @app.route('/sensors', methods=['GET'])  
 def get_sensors():
-    return jsonify({
+    sensors = {
         'voltage': latest_voltage,
         'timestamp': latest_timestamp
+    }
+    if crash_state['enabled']:
+        sensors['crashed'] = crash_state['crashed']
+    return jsonify(sensors)
+
+@app.route('/telemetry', methods=['GET'])
+def get_telemetry():
+    """
+    Historique d'un signal: /telemetry?signal=voltage&since=<t>&until=<t>&max_points=<n>&format=json|binary
+    Sans signal, retourne la liste des signaux avec leur remplissage.
+    format=binary: n timestamps float64 puis n valeurs float32 (little-endian), n dans l'en-tete X-Points
+    """
+    signal = request.args.get('signal')
+    if signal is None:
+        return jsonify(telemetry.info())
+    if signal not in telemetry.signals:
+        return jsonify({'status': 'error', 'message': f"Unknown signal: {signal}"}), 404
+    since = request.args.get('since', type=float)
+    until = request.args.get('until', type=float)
+    max_points = request.args.get('max_points', type=int)
+
+    timestamps, values = telemetry.query(signal, since, until, max_points)
+
+    if request.args.get('format') == 'binary':
+        body = timestamps.astype('<f8').tobytes() + values.astype('<f4').tobytes()
+        return Response(body, mimetype='application/octet-stream',
+                        headers={'X-Points': str(len(timestamps)), 'X-Signal': signal})
+    return jsonify({
+        'signal': signal,
+        'timestamps': timestamps.tolist(),
+        'values': values.tolist(),
     })
 
+def on_channel_command(seq, duty_cycle):
+    # Le controleur a deja recu la commande par UDP: on ne diffuse que l'information (pas de motor_control)
+    telemetry.append('duty_cycle', time.time(), duty_cycle)
+    broadcaster.publish('duty_cycle_update', {'duty_cycle': duty_cycle, 'seq': seq})
+    if duty_cycle <= 0:
+        clear_crash()
+
+def make_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--host', type=str, default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--command-port', type=int, default=COMMAND_PORT,
+                        help="Port UDP du relais de commandes moteur (0 pour le desactiver)")
+    parser.add_argument('--no-circuit-image', action='store_true',
+                        help="Ne pas generer l'image du circuit si elle n'est pas deja en cache")
+    return parser
+
+def start_services(args, start_relay=True):
+    """Tout ce qui doit tourner a cote des routes: relais de commandes UDP, image du circuit"""
+    if args.command_port and start_relay:
+        CommandRelay(port=args.command_port, on_command=on_channel_command).start()
+        print(f"Command relay listening on UDP port {args.command_port}")
+
+    # L'image n'est rendue (fenetre raylib) qu'au premier lancement pour ce circuit
+    image_path = os.path.join("static", CIRCUIT_IMAGE)
+    if not args.no_circuit_image and not os.path.exists(image_path):
+        print("Generating circuit visualization...")
+        generate_circuit_image(real_circuit, image_path, 800, 600)
+
+def check_control_namespace():
+    """
+    Verifie avec des clients de test Socket.IO (sans reseau) que les commandes UDP relayees (duty_cycle_update)
+    n'atteignent sur /control que les clients qui les demandent, et que motor_control atteint tout le monde.
+    Leve AssertionError sinon.
+    """
+    controller = socketio.test_client(app, namespace=CONTROL_NAMESPACE)
+    sensor = socketio.test_client(app, namespace=CONTROL_NAMESPACE, auth={'duty_cycle': True})
+    try:
+        on_channel_command(1, 42.0)
+        broadcaster.flush(time.monotonic() + 1.0)
+        app.test_client().post('/control', json={'duty_cycle': 0.0})
+
+        def events(client):
+            return [message['name'] for message in client.get_received(CONTROL_NAMESPACE)]
+        controller_events, sensor_events = events(controller), events(sensor)
+        assert 'duty_cycle_update' not in controller_events, f"controleur: {controller_events}"
+        assert 'motor_control' in controller_events, f"controleur: {controller_events}"
+        assert 'duty_cycle_update' in sensor_events, f"capteur: {sensor_events}"
+        print(f"[Server] /control: controleur {controller_events}, capteur {sensor_events}")
+    finally:
+        controller.disconnect(namespace=CONTROL_NAMESPACE)
+        sensor.disconnect(namespace=CONTROL_NAMESPACE)
+
 if __name__ == '__main__':
-    # Generate circuit image at startup
-    print("Generating circuit visualization...")
-    generate_circuit_image(real_circuit, "static/circuit.png", 800, 600)
+    # Mode developpement: serveur Werkzeug avec debug et reloader (voir serve.py pour la production)
+    parser = make_parser("Serveur de telemetrie et de commande (developpement)")
+    parser.add_argument('--check', action='store_true',
+                        help="Verifie la repartition des evenements sur /control (clients de test) et quitte")
+    args = parser.parse_args()
+    if args.check:
+        check_control_namespace()
+        raise SystemExit(0)
+
+    # En debug le reloader relance le script dans un processus fils: seul celui-ci ouvre le port UDP
+    start_services(args, start_relay=os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
     
     print("Starting server...")
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
+    socketio.run(app, host=args.host, port=args.port, debug=True, allow_unsafe_werkzeug=True)
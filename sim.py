@@ -1,4 +1,5 @@
 import pyray as raylib
+import numpy as np
 from circuit import SectionType as ST
 from circuit import *
 
@@ -90,3 +91,86 @@ class RailCarSim:
     def reset(self):
         self.rail_distance = 0.0
         self.speed = 0.0
+
+
+
+class RailCarSimBatch:
+    """
+    Version vectorisee de RailCarSim: simule en parallele un lot de voitures (une par jeu de parametres)
+    et/ou d'experiences. Les parametres et les entrees peuvent etre des tableaux numpy qui se broadcastent
+    entre eux, par exemple params de forme (P, 1) et force de forme (E,) donnent un etat de forme (P, E).
+    """
+
+    def __init__(self, circuit, is_inside_rail,
+                 acceleration_factor=8200.0,
+                 rolling_resistance=245.52,
+                 max_grip_force=3000.00,
+                 turn_friction_coef=3783.64,
+                 curvature_resolution=0.05):
+        self.circuit = circuit
+        self.is_inside_rail = is_inside_rail
+
+        self.acceleration_factor = np.asarray(acceleration_factor, dtype=np.float64)
+        self.rolling_resistance = np.asarray(rolling_resistance, dtype=np.float64)
+        self.max_grip_force = np.asarray(max_grip_force, dtype=np.float64)
+        self.turn_friction_coef = np.asarray(turn_friction_coef, dtype=np.float64)
+
+        # La courbure ne depend que de la position sur le rail: on la tabule une seule fois au lieu
+        # d'appeler get_tangent_at_rail deux fois par pas et par voiture
+        self.curvature_resolution = curvature_resolution
+        self._curvature_table = self._precompute_curvature(curvature_resolution)
+
+        self.rail_distance = np.zeros(1)
+        self.speed = np.zeros(1)
+
+    def _precompute_curvature(self, resolution):
+        # Meme calcul que RailCarSim.step (tangentes prises sur le rail exterieur, a 1cm d'ecart)
+        rail_length = self.circuit._outside_rail_length
+        samples = np.arange(0.0, rail_length, resolution)
+        table = np.empty(len(samples))
+        for i, distance in enumerate(samples):
+            tan_at_car = self.circuit.get_tangent_at_rail(distance, False)
+            tan_at_1cm = self.circuit.get_tangent_at_rail(distance + 1, False)
+            table[i] = abs(raylib.vector2_angle(tan_at_car, tan_at_1cm))
+        return table
+
+    def curvature_at(self, rail_distance):
+        rail_length = self.circuit._outside_rail_length
+        idx = ((np.asarray(rail_distance) % rail_length) / self.curvature_resolution).astype(np.int64)
+        return self._curvature_table[np.minimum(idx, len(self._curvature_table) - 1)]
+
+    def step(self, force, dt=1/20):
+        acceleration = np.asarray(force) * self.acceleration_factor
+        speed = self.speed + acceleration * dt
+
+        curvature = self.curvature_at(self.rail_distance)
+
+        turn_friction = curvature * self.turn_friction_coef
+        slowed = np.maximum(0, speed - (self.rolling_resistance + turn_friction) * dt)
+        self.speed = np.where(speed > 0, slowed, speed)
+
+        self.rail_distance = self.rail_distance + self.speed * dt
+
+        # Verification de crash (voir RailCarSim.step)
+        centrifugal_force = self.centrifugal_force(curvature)
+        crash = centrifugal_force > self.max_grip_force
+
+        return crash, self.get_state()
+
+    def centrifugal_force(self, curvature):
+        # Force centrifuge par unite de masse, nulle dans les cas triviaux (comme dans RailCarSim.step)
+        trivial = (self.speed < 50.0) | (curvature < 0.05)
+        return np.where(trivial, 0.0, (self.speed ** 2) * curvature)
+
+    def get_state(self):
+        return {
+            'speed': self.speed,
+            'rail_distance': self.rail_distance,
+        }
+
+    def reset(self, rail_distance=0.0):
+        shape = np.broadcast_shapes(self.acceleration_factor.shape, self.rolling_resistance.shape,
+                                    self.max_grip_force.shape, self.turn_friction_coef.shape,
+                                    np.shape(rail_distance))
+        self.rail_distance = np.broadcast_to(np.asarray(rail_distance, dtype=np.float64), shape).copy()
+        self.speed = np.zeros(shape)
@@ -1,10 +1,17 @@
 import json
 import os
+import sys
 import glob
+import argparse
+import inspect
+import numpy as np
 from skopt import gp_minimize
 from skopt.space import Real
 import circuit
-from sim import RailCarSim
+from sim import RailCarSim, RailCarSimBatch
+import datalog
+from experiment_store import ExperimentStore, run_to_experiment
+from functools import partial
 from circuit import SectionType as ST
 from circuit import Circuit
 
@@ -14,17 +21,43 @@ round_circuit = Circuit([
     ST.TURN_LEFT, ST.LONG, ST.TURN_LEFT, ST.SHORT,
 ])
 
+PARAM_NAMES = ['acceleration_factor', 'rolling_resistance', 'max_grip_force', 'turn_friction_coef']
+
+# Espace de recherche (partage entre l'optimisation bayesienne et les moindres carres)
+PARAM_BOUNDS = [
+    (2000, 12000),
+    (100, 5000),
+    (3000, 15000),
+    (1000, 6000),
+]
+
+# Parametres par defaut du simulateur: point de depart des moindres carres
+SIM_DEFAULTS = [inspect.signature(RailCarSim).parameters[name].default for name in PARAM_NAMES]
+
 def load_all_experiments():
-    json_files = glob.glob("output/*.json")
     experiments = []
-    
+
+    # Logs binaires ecrits par CarDataCollector (ou convertis depuis le JSON par datalog.py)
+    for filepath in glob.glob("output/*.bin"):
+        _, records = datalog.open_log(filepath)
+        if len(records) > 0:
+            experiments.append(datalog.log_to_experiment(records))
+
+    # Anciens fichiers JSON, sauf ceux deja convertis
+    json_files = glob.glob("output/*.json")
     for filepath in json_files:
+        if os.path.exists(os.path.splitext(filepath)[0] + '.bin'):
+            continue
         with open(filepath, 'r') as f:
             data = json.load(f)
             experiments.append(data)
     
     return experiments
 
+def load_store_experiments(store, **filters):
+    """Charge seulement les runs du store qui correspondent aux filtres (voir ExperimentStore.query)"""
+    return [run_to_experiment(run) for _, run in store.select(circuit=round_circuit, is_inside_rail=True, **filters)]
+
 def simulate_experiment(params, experiment_data):
     acceleration_factor, rolling_resistance, max_grip_force, turn_friction_coef = params
 
@@ -89,9 +122,10 @@ def simulate_experiment(params, experiment_data):
 
 
 
-def objective_function(params):
+def objective_function(params, experiments=None):
     """Fonction objectif pour l'optimisation bayésienne"""
-    experiments = load_all_experiments()
+    if experiments is None:
+        experiments = load_all_experiments()
     
     total_loss = 0
     for experiment in experiments:
@@ -104,19 +138,14 @@ def objective_function(params):
     
 
 
-def optimize_simulator():
+def optimize_simulator(experiments=None):
     
     # Espace de recherche
-    space = [
-        Real(2000, 12000, name='acceleration_factor'),
-        Real(100, 5000, name='rolling_resistance'),
-        Real(3000, 15000, name='max_grip_force'),
-        Real(1000, 6000, name='turn_friction_coef')
-    ]
+    space = [Real(low, high, name=name) for name, (low, high) in zip(PARAM_NAMES, PARAM_BOUNDS)]
     
     # Optimisation
     result = gp_minimize(
-        func=objective_function,
+        func=partial(objective_function, experiments=experiments),
         dimensions=space,
         n_calls=50,
         n_initial_points=10,
@@ -126,12 +155,224 @@ def optimize_simulator():
     # Résultats
     print("Best loss:", result.fun)
     print("Best parameters:")
-    param_names = ['acceleration_factor', 'rolling_resistance', 'max_grip_force', 'turn_friction_coef']
-    for name, value in zip(param_names, result.x):
+    for name, value in zip(PARAM_NAMES, result.x):
         print(f"  {name}: {value:.2f}")
     
     return result
 
 
+# =================== Moindres carres (Levenberg-Marquardt) ===================
+# max_grip_force n'a aucun effet sur la trajectoire (il ne sert qu'a decider du crash), donc le probleme
+# aux moindres carres porte sur les trois parametres de dynamique, et la force d'adherence est encadree
+# a partir des crashs observes une fois la trajectoire ajustee.
+DYNAMICS_PARAMS = [0, 1, 3]  # indices dans PARAM_NAMES
+
+def experiments_to_arrays(experiments):
+    """
+    Convertit les experiences (dicts indexes par timestamp) en tableaux alignes de forme (E, T),
+    completes par des pas de dt=0 (qui laissent la simulation inchangee) et un masque de validite.
+    """
+    rail_length = round_circuit._get_rail_length(True)
+    series = []
+    for experiment_data in experiments:
+        timestamps = sorted([float(t) for t in experiment_data.keys()])
+        samples = [experiment_data[str(t)] for t in timestamps]
+        series.append({
+            'timestamps': np.array(timestamps),
+            'input': np.array([s['input'] for s in samples], dtype=np.float64),
+            'rail_distance': np.array([s['nb_turns'] * rail_length + s['rail_distance'] for s in samples]),
+            'crashed': np.array([bool(s['crashed']) for s in samples]),
+        })
+
+    nb_steps = max(len(s['timestamps']) for s in series) - 1
+    shape = (len(series), nb_steps)
+    arrays = {
+        'dt': np.zeros(shape),
+        'input': np.zeros(shape),
+        'target': np.zeros(shape),
+        'next_crashed': np.zeros(shape, dtype=bool),
+        'mask': np.zeros(shape, dtype=bool),
+        'start': np.array([s['rail_distance'][0] for s in series]),
+    }
+    for e, s in enumerate(series):
+        n = len(s['timestamps']) - 1
+        arrays['dt'][e, :n] = np.diff(s['timestamps'])
+        arrays['input'][e, :n] = s['input'][:-1]
+        arrays['target'][e, :n] = s['rail_distance'][1:]
+        arrays['next_crashed'][e, :n] = s['crashed'][1:]
+        arrays['mask'][e, :n] = True
+    return arrays
+
+def simulate_batch(param_sets, arrays):
+    """
+    Simule toutes les experiences pour tous les jeux de parametres en une seule passe vectorisee.
+    param_sets: (P, 4). Retourne les distances simulees (P, E, T) et les forces centrifuges (P, E, T).
+    """
+    param_sets = np.atleast_2d(param_sets)[:, :, None]  # (P, 4, 1) pour broadcaster sur les experiences
+    sim = RailCarSimBatch(round_circuit, is_inside_rail=True,
+                          acceleration_factor=param_sets[:, 0],
+                          rolling_resistance=param_sets[:, 1],
+                          max_grip_force=param_sets[:, 2],
+                          turn_friction_coef=param_sets[:, 3])
+    sim.reset(arrays['start'])
+
+    nb_steps = arrays['dt'].shape[1]
+    shape = sim.rail_distance.shape + (nb_steps,)
+    rail_distances = np.empty(shape)
+    forces = np.empty(shape)
+    for i in range(nb_steps):
+        curvature = sim.curvature_at(sim.rail_distance)
+        sim.step(arrays['input'][:, i], dt=arrays['dt'][:, i])
+        rail_distances[..., i] = sim.rail_distance
+        forces[..., i] = sim.centrifugal_force(curvature)
+    return rail_distances, forces
+
+def compute_residuals(param_sets, arrays):
+    """Vecteurs de residus (P, M): distance mesuree - distance simulee, pour chaque echantillon valide"""
+    rail_distances, _ = simulate_batch(param_sets, arrays)
+    return (arrays['target'] - rail_distances)[:, arrays['mask']]
+
+def estimate_grip_force(params, arrays):
+    """
+    Encadre max_grip_force avec la trajectoire ajustee: la simulation ne doit pas crasher avant les donnees
+    (borne basse) et doit crasher au pas ou les donnees crashent (borne haute).
+    """
+    _, forces = simulate_batch(params, arrays)
+    forces = forces[0]
+    safe = arrays['mask'] & ~arrays['next_crashed']
+    lower = forces[safe].max() if safe.any() else 0.0
+    crash_forces = forces[arrays['mask'] & arrays['next_crashed']]
+    upper = crash_forces.min() if len(crash_forces) > 0 else np.inf
+    return lower, upper
+
+def least_squares_fit(experiments=None, x0=None, max_iterations=20, tolerance=1e-6, fd_step=1e-4):
+    """
+    Ajuste le simulateur par Levenberg-Marquardt. Chaque iteration evalue le point courant et les
+    differences finies de la jacobienne en un seul appel a simulate_batch.
+    Retourne les parametres, leur ecart-type estime et la perte (meme definition qu'objective_function).
+    Demarre par defaut des parametres du simulateur: au milieu des bornes, la voiture reste quasi immobile
+    avec de faibles commandes et la jacobienne y est nulle.
+    """
+    if experiments is None:
+        experiments = load_all_experiments()
+    arrays = experiments_to_arrays(experiments)
+
+    if x0 is None:
+        x0 = SIM_DEFAULTS
+    x = np.array(x0, dtype=np.float64)
+    low = np.array([b[0] for b in PARAM_BOUNDS], dtype=np.float64)
+    high = np.array([b[1] for b in PARAM_BOUNDS], dtype=np.float64)
+
+    # On travaille en coordonnees normalisees (theta = x / scale) pour que la jacobienne soit bien conditionnee
+    free = np.array(DYNAMICS_PARAMS)
+    scale = np.abs(x[free])
+    damping = 1e-3
+    nb_evaluations = 0
+
+    def batch_residuals(theta_sets):
+        param_sets = np.repeat(x[None, :], len(theta_sets), axis=0)
+        param_sets[:, free] = theta_sets * scale
+        return compute_residuals(param_sets, arrays)
+
+    theta = x[free] / scale
+    converged = False
+    for iteration in range(max_iterations):
+        # Point courant + un pas de difference finie par parametre, evalues ensemble
+        theta_sets = np.vstack([theta, theta + fd_step * np.eye(len(free))])
+        residuals = batch_residuals(theta_sets)
+        nb_evaluations += 1
+        r = residuals[0]
+        jacobian = (residuals[1:] - r).T / fd_step  # dr/dtheta, (M, n)
+        cost = r @ r
+
+        jtj = jacobian.T @ jacobian
+        gradient = jacobian.T @ r
+
+        # On essaie plusieurs amortissements en un seul lot et on garde le meilleur
+        dampings = damping * np.array([0.1, 1.0, 10.0, 100.0])
+        candidates = []
+        for mu in dampings:
+            delta = np.linalg.solve(jtj + mu * np.diag(np.diag(jtj) + 1e-12), -gradient)
+            candidate = np.clip(theta + delta, low[free] / scale, high[free] / scale)
+            candidates.append(candidate)
+        candidates = np.array(candidates)
+        candidate_residuals = batch_residuals(candidates)
+        nb_evaluations += 1
+        candidate_costs = np.einsum('pm,pm->p', candidate_residuals, candidate_residuals)
+
+        best = np.argmin(candidate_costs)
+        if candidate_costs[best] < cost:
+            step_size = np.max(np.abs(candidates[best] - theta))
+            theta = candidates[best]
+            damping = max(dampings[best] / 10.0, 1e-9)
+            print(f"[LM] iteration {iteration}: cost={candidate_costs[best]:.2f} damping={damping:.1e}")
+            if (cost - candidate_costs[best]) < tolerance * cost or step_size < tolerance:
+                converged = True
+                break
+        else:
+            damping = dampings[-1] * 10.0
+            print(f"[LM] iteration {iteration}: pas rejete, damping={damping:.1e}")
+            if damping > 1e10:
+                break
+
+    if not converged:
+        print(f"[LM] Attention: pas de convergence apres {iteration + 1} iterations "
+              f"(max_iterations={max_iterations}), resultat a verifier")
+
+    x[free] = theta * scale
+
+    # Incertitude: cov = s^2 (J^T J)^-1 evaluee a la solution
+    residuals = batch_residuals(np.vstack([theta, theta + fd_step * np.eye(len(free))]))
+    nb_evaluations += 1
+    r = residuals[0]
+    jacobian = (residuals[1:] - r).T / fd_step
+    dof = max(len(r) - len(free), 1)
+    sigma2 = (r @ r) / dof
+    std = np.full(len(x), np.nan)
+    try:
+        covariance = sigma2 * np.linalg.inv(jacobian.T @ jacobian)
+        std[free] = np.sqrt(np.diag(covariance)) * scale
+    except np.linalg.LinAlgError:
+        print("[LM] Jacobienne singuliere, pas d'estimation d'incertitude")
+
+    # La force d'adherence est prise au milieu de l'intervalle compatible avec les crashs observes
+    lower, upper = estimate_grip_force(x, arrays)
+    if np.isfinite(upper) and upper > lower:
+        x[2] = np.clip((lower + upper) / 2, low[2], high[2])
+        std[2] = (upper - lower) / 2
+    else:
+        x[2] = np.clip(lower, low[2], high[2])
+
+    loss = np.mean([simulate_experiment(x, experiment) for experiment in experiments])
+
+    print("Loss:", loss, f"({nb_evaluations} evaluations par lot)")
+    print("Parameters:")
+    for name, value, sd in zip(PARAM_NAMES, x, std):
+        print(f"  {name}: {value:.2f} +/- {sd:.2f}")
+    print(f"  (max_grip_force compatible avec les crashs: [{lower:.2f}, {upper:.2f}])")
+
+    return x, std, loss
+
+
 if __name__ == "__main__":
-    result = optimize_simulator()
+    parser = argparse.ArgumentParser(description="Ajustement des parametres du simulateur sur les donnees reelles")
+    parser.add_argument('--method', choices=['bayes', 'lsq'], default='bayes',
+                        help="bayes: optimisation bayesienne (gp_minimize), lsq: moindres carres Levenberg-Marquardt")
+    parser.add_argument('--pattern', type=str, default=None,
+                        help="N'utiliser que les runs du store dont le motif correspond (jokers SQL, ex: 'constant_%%')")
+    args = parser.parse_args()
+
+    # Charge une seule fois: l'optimisation bayesienne evalue l'objectif 50 fois
+    if args.pattern:
+        experiments = load_store_experiments(ExperimentStore(), pattern=args.pattern)
+        print(f"{len(experiments)} runs selectionnes pour le motif {args.pattern}")
+    else:
+        experiments = load_all_experiments()
+        print(f"{len(experiments)} runs charges depuis output/")
+    if not experiments:
+        sys.exit("Aucun run a ajuster" + (f" pour le motif {args.pattern}" if args.pattern else " dans output/"))
+
+    if args.method == 'lsq':
+        result = least_squares_fit(experiments)
+    else:
+        result = optimize_simulator(experiments)
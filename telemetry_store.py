@@ -0,0 +1,140 @@
+import threading
+import numpy as np
+
+# Historique de telemetrie cote serveur: un buffer circulaire NumPy de taille fixe par signal
+# (timestamps float64 croissants + valeurs float32). La memoire est bornee quel que soit le temps
+# de fonctionnement, et une requete sur un intervalle ne coute qu'une recherche dichotomique
+# plus la copie (ou le sous-echantillonnage) des points de l'intervalle.
+
+
+class SignalRing:
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._timestamps = np.empty(capacity, dtype=np.float64)
+        self._values = np.empty(capacity, dtype=np.float32)
+        self._lock = threading.Lock()
+        self.nb_appended = 0  # total depuis le demarrage, l'indice d'ecriture est nb_appended % capacity
+        self.nb_out_of_order = 0
+
+    def __len__(self):
+        return min(self.nb_appended, self.capacity)
+
+    def _last_timestamp(self):
+        return self._timestamps[(self.nb_appended - 1) % self.capacity] if self.nb_appended else -np.inf
+
+    def append(self, timestamp, value):
+        self.extend([timestamp], [value])
+
+    def extend(self, timestamps, values):
+        """Ajoute un lot. Les points plus vieux que le dernier point stocke sont ignores (lot en retard)"""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float32)
+        with self._lock:
+            # Garde les timestamps croissants: necessaire pour la recherche dichotomique
+            keep = timestamps >= np.maximum.accumulate(np.concatenate(([self._last_timestamp()], timestamps)))[:-1]
+            if not keep.all():
+                self.nb_out_of_order += int((~keep).sum())
+                timestamps, values = timestamps[keep], values[keep]
+            if len(timestamps) > self.capacity:
+                timestamps, values = timestamps[-self.capacity:], values[-self.capacity:]
+
+            start = self.nb_appended % self.capacity
+            first = min(len(timestamps), self.capacity - start)
+            self._timestamps[start:start + first] = timestamps[:first]
+            self._values[start:start + first] = values[:first]
+            self._timestamps[:len(timestamps) - first] = timestamps[first:]
+            self._values[:len(timestamps) - first] = values[first:]
+            self.nb_appended += len(timestamps)
+
+    def _segments(self):
+        """Les deux zones contigues du buffer, dans l'ordre chronologique"""
+        size = len(self)
+        start = (self.nb_appended - size) % self.capacity
+        if start + size <= self.capacity:
+            return [(start, start + size)]
+        return [(start, self.capacity), (0, self.nb_appended % self.capacity)]
+
+    def slice(self, since=None, until=None):
+        """Copie des points avec since <= timestamp <= until, retourne (timestamps, values)"""
+        with self._lock:
+            timestamps, values = [], []
+            for begin, end in self._segments():
+                segment = self._timestamps[begin:end]
+                lo = 0 if since is None else np.searchsorted(segment, since, side='left')
+                hi = len(segment) if until is None else np.searchsorted(segment, until, side='right')
+                if hi > lo:
+                    timestamps.append(segment[lo:hi])
+                    values.append(self._values[begin + lo:begin + hi])
+            if not timestamps:
+                return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float32)
+            return np.concatenate(timestamps), np.concatenate(values)
+
+    def info(self):
+        with self._lock:
+            size = len(self)
+            info = {'capacity': self.capacity, 'size': size, 'appended': self.nb_appended,
+                    'out_of_order': self.nb_out_of_order}
+            if size:
+                begin, _ = self._segments()[0]
+                info['first_timestamp'] = float(self._timestamps[begin])
+                info['last_timestamp'] = float(self._last_timestamp())
+            return info
+
+
+def lttb(timestamps, values, max_points):
+    """
+    Largest-Triangle-Three-Buckets: garde max_points points (dont le premier et le dernier) qui
+    preservent la forme de la courbe, contrairement a une decimation reguliere qui rate les pics.
+    """
+    n = len(timestamps)
+    if max_points >= n or max_points < 3:
+        return timestamps, values
+
+    x = timestamps - timestamps[0]  # evite la perte de precision des timestamps absolus dans les aires
+    y = values.astype(np.float64)
+    # Bornes des max_points - 2 seaux entre le premier et le dernier point
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        begin, end = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        # Point moyen du seau suivant (le dernier point pour le dernier seau)
+        if bucket + 2 < len(edges):
+            next_begin, next_end = edges[bucket + 1], max(edges[bucket + 2], edges[bucket + 1] + 1)
+            average_x, average_y = x[next_begin:next_end].mean(), y[next_begin:next_end].mean()
+        else:
+            average_x, average_y = x[-1], y[-1]
+        # Aire (x2) du triangle (point retenu precedent, candidat, moyenne du seau suivant)
+        areas = np.abs((x[previous] - average_x) * (y[begin:end] - y[previous])
+                       - (x[previous] - x[begin:end]) * (average_y - y[previous]))
+        previous = begin + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return timestamps[selected], values[selected]
+
+
+class TelemetryStore:
+    """Ensemble de SignalRing nommes, ex: TelemetryStore({'voltage': 2**20, 'reward': 2**16})"""
+
+    def __init__(self, capacities):
+        self.signals = {name: SignalRing(capacity) for name, capacity in capacities.items()}
+
+    def append(self, signal, timestamp, value):
+        self.signals[signal].append(timestamp, value)
+
+    def extend(self, signal, timestamps, values):
+        self.signals[signal].extend(timestamps, values)
+
+    def query(self, signal, since=None, until=None, max_points=None):
+        """Retourne (timestamps, values) sur l'intervalle, sous-echantillonne par LTTB a max_points si demande"""
+        timestamps, values = self.signals[signal].slice(since, until)
+        if max_points is not None:
+            timestamps, values = lttb(timestamps, values, max_points)
+        return timestamps, values
+
+    def info(self):
+        return {name: ring.info() for name, ring in self.signals.items()}
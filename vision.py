@@ -2,113 +2,313 @@ import cv2
 import numpy as np
 from circuit import SectionType as ST
 from circuit import *
+import os
+import sys
+import math
 import time
+import json
+import argparse
+import collections
+from frame_sources import CameraSource, RecordingSource, FrameRecorder
+
+
+class PerspectiveWarp:
+    """
+    Redressement de l'image camera vers une vue de dessus du circuit, a l'echelle des coordonnees de reference.
+    Tout est calcule une fois a la calibration: bornes des points de reference, echelle, matrice, et les
+    tables de correspondance pixel -> pixel de cv2.remap en virgule fixe (cv2.convertMaps). Par image,
+    il ne reste qu'un remap.
+    """
+
+    def __init__(self, projection_points, reference_points, padding=10, target_size=(800, 600), maps=None):
+        """maps: tables (map1, map2) deja calculees pour ces points (calibration sauvegardee)"""
+        self.padding = padding
+
+        # Calculate the bounding box of reference points
+        x_coords = [p[0] for p in reference_points]
+        y_coords = [p[1] for p in reference_points]
+        self.min_x, self.min_y = min(x_coords), min(y_coords)
+        circuit_width = max(x_coords) - self.min_x
+        circuit_height = max(y_coords) - self.min_y
+
+        # Calculate scale to fit in a reasonable size while maintaining quality
+        target_width, target_height = target_size  # TODO: make this in function of circuit size or other parameters
+        self.scale = min(target_width / (circuit_width + 2 * padding),
+                         target_height / (circuit_height + 2 * padding))
+
+        # Create destination points with offset, padding, and scaling
+        src_points = np.float32(projection_points)
+        dst_points = np.float32([self.reference_to_transformed(px, py, rounded=False) for px, py in reference_points])
+        self.matrix = cv2.getPerspectiveTransform(src_points, dst_points)
+
+        self.size = (int((circuit_width + 2 * padding) * self.scale), int((circuit_height + 2 * padding) * self.scale))
+        if maps is not None and maps[0].shape[:2] == (self.size[1], self.size[0]):
+            self.map1, self.map2 = maps
+        else:
+            self.map1, self.map2 = self._build_maps()
+
+    def _build_maps(self):
+        # Pour chaque pixel de sortie, sa position dans l'image camera (homographie inverse)
+        width, height = self.size
+        xs, ys = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+        inverse = np.linalg.inv(self.matrix)
+        denominator = inverse[2, 0] * xs + inverse[2, 1] * ys + inverse[2, 2]
+        map_x = ((inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]) / denominator).astype(np.float32)
+        map_y = ((inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]) / denominator).astype(np.float32)
+        # Format virgule fixe (CV_16SC2 + table d'interpolation): remap plus rapide qu'avec des flottants
+        return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+    def apply(self, frame, region=None):
+        """region=(x0, y0, x1, y1): ne redresse que cette zone de l'image de sortie"""
+        if region is None:
+            return cv2.remap(frame, self.map1, self.map2, cv2.INTER_LINEAR)
+        x0, y0, x1, y1 = region
+        return cv2.remap(frame, self.map1[y0:y1, x0:x1], self.map2[y0:y1, x0:x1], cv2.INTER_LINEAR)
+
+    def apply_exact(self, frame):
+        """Meme resultat via warpPerspective (reference pour les tests et le benchmark)"""
+        return cv2.warpPerspective(frame, self.matrix, self.size)
+
+    def reference_to_transformed(self, ref_x, ref_y, rounded=True):
+        transformed_x = (ref_x - self.min_x + self.padding) * self.scale
+        transformed_y = (ref_y - self.min_y + self.padding) * self.scale
+        if rounded:
+            return int(transformed_x), int(transformed_y)
+        return transformed_x, transformed_y
+
+    def transformed_to_reference(self, trans_x, trans_y):
+        ref_x = (trans_x / self.scale) + self.min_x - self.padding
+        ref_y = (trans_y / self.scale) + self.min_y - self.padding
+        return ref_x, ref_y
+
+
+def rasterize_track(circuit, warp, image, color, margin=0):
+    """Dessine la piste (les deux rails, largeur CIRCUIT_WIDTH) dans l'image redressee, elargie de margin pixels"""
+    thickness = max(int(CIRCUIT_WIDTH / 2 * warp.scale) + 2 * margin, 1)
+    for is_inside_rail in (True, False):
+        rail_length = circuit._inside_rail_length if is_inside_rail else circuit._outside_rail_length
+        rail = [warp.reference_to_transformed(p.x, p.y) for p in
+                (circuit.get_position_at_rail(d, is_inside_rail) for d in np.arange(0.0, rail_length, 1.0))]
+        cv2.polylines(image, [np.int32(rail)], True, color, thickness)
+    return image
+
+
+def save_calibration(path, circuit, calibration):
+    """
+    Sauvegarde une calibration {'projection_points', 'reference_points', 'background_model', 'circuit_mask',
+    'track_mask', 'warp'}. track_mask est le mode qui a produit circuit_mask (voir CarDetector)
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    warp = calibration['warp']
+    np.savez_compressed(path, section_hash=circuit.get_section_hash(),
+                        projection_points=np.float32(calibration['projection_points']),
+                        reference_points=np.float32(calibration['reference_points']),
+                        background_model=calibration['background_model'], circuit_mask=calibration['circuit_mask'],
+                        track_mask=calibration['track_mask'],
+                        padding=warp.padding, map1=warp.map1, map2=warp.map2)
+    print(f"[Vision] Calibration sauvegardee dans {path}")
+
+
+def load_calibration(path, circuit, reference_points):
+    """
+    Relit une calibration sauvegardee par save_calibration, au format attendu par CarDetector(calibration=...).
+    Retourne None si le fichier n'existe pas ou a ete fait pour un autre circuit / d'autres points de reference.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as cached:
+        if (str(cached['section_hash']) != circuit.get_section_hash()
+                or not np.allclose(cached['reference_points'], np.float32(reference_points))):
+            print(f"[Vision] Calibration {path} faite pour un autre circuit, ignoree")
+            return None
+        projection_points = [(int(x), int(y)) for x, y in cached['projection_points']]
+        calibration = {
+            'projection_points': projection_points,
+            'background_model': cached['background_model'],
+            'circuit_mask': cached['circuit_mask'],
+            'track_mask': str(cached['track_mask']) if 'track_mask' in cached else None,
+            'warp': PerspectiveWarp(projection_points, reference_points, padding=int(cached['padding']),
+                                    maps=(cached['map1'], cached['map2'])),
+        }
+    print(f"[Vision] Calibration chargee depuis {path}")
+    return calibration
+
+
+def benchmark_warp(projection_points, reference_points, frame_size=(640, 480), nb_frames=300):
+    """Cout par image: ancien chemin (parametres + matrice recalcules, warpPerspective) contre remap precalcule"""
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, size=(frame_size[1], frame_size[0], 3), dtype=np.uint8)
+
+    def recompute_and_warp(frame):
+        # Ce que faisait _apply_perspective_transform a chaque image
+        x_coords = [p[0] for p in reference_points]
+        y_coords = [p[1] for p in reference_points]
+        min_x, min_y = min(x_coords), min(y_coords)
+        width, height = max(x_coords) - min_x, max(y_coords) - min_y
+        scale = min(800 / (width + 20), 600 / (height + 20))
+        dst_points = np.float32([[(px - min_x + 10) * scale, (py - min_y + 10) * scale] for px, py in reference_points])
+        matrix = cv2.getPerspectiveTransform(np.float32(projection_points), dst_points)
+        return cv2.warpPerspective(frame, matrix, (int((width + 20) * scale), int((height + 20) * scale)))
+
+    start = time.perf_counter()
+    warp = PerspectiveWarp(projection_points, reference_points)
+    setup_ms = (time.perf_counter() - start) * 1000.0
+
+    results = {}
+    for name, function in [('recalcul + warpPerspective', recompute_and_warp),
+                           ('warpPerspective precalcule', warp.apply_exact),
+                           ('remap virgule fixe', warp.apply)]:
+        function(frame)
+        start = time.perf_counter()
+        for _ in range(nb_frames):
+            function(frame)
+        results[name] = (time.perf_counter() - start) / nb_frames * 1000.0
+        print(f"[Vision] {name:28s} {results[name]:.3f} ms/image")
+
+    difference = np.abs(warp.apply(frame).astype(np.int16) - warp.apply_exact(frame).astype(np.int16))
+    print(f"[Vision] Calcul des tables: {setup_ms:.1f} ms (une fois), sortie {warp.size[0]}x{warp.size[1]}, "
+          f"ecart remap/warpPerspective: moyen {difference.mean():.2f}, max {difference.max()}")
+    return results
+
+
+class StageTimes:
+    """
+    Temps par etape de la detection, cumules par image (une etape peut tourner deux fois si la voiture est perdue
+    dans la fenetre de suivi). Inactif par defaut: start/lap/finish ne font rien.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.totals = collections.defaultdict(float)  # secondes, toutes images confondues
+        self.frame_totals = []  # temps total de chaque image
+        self._current = None
+        self._last = None
+
+    def start(self):
+        if self.enabled:
+            self._current = collections.defaultdict(float)
+            self._last = time.perf_counter()
+
+    def lap(self, stage):
+        if not self.enabled or self._current is None:
+            return
+        now = time.perf_counter()
+        self._current[stage] += now - self._last
+        self._last = now
+
+    def finish(self):
+        if not self.enabled or self._current is None:
+            return
+        for stage, duration in self._current.items():
+            self.totals[stage] += duration
+        self.frame_totals.append(sum(self._current.values()))
+        self._current = None
 
 
 class CarDetector:
-    def __init__(self, circuit, reference_points, camera_id=0, debug=False):
+    """
+    source: source d'images (frame_sources.py). Par defaut la camera camera_id.
+    camera_id=None et pas de source: les images sont passees a detect() (benchmark, traitement hors ligne).
+    calibration: {'projection_points', 'background_model', 'circuit_mask', 'warp'} (voir load_calibration)
+                 pour eviter la calibration interactive. Seuls les points de projection sont obligatoires: le fond
+                 est alors capture par la camera et le masque recalcule.
+    track_mask: 'background' (parties sombres du fond) ou 'geometry' (trace du circuit, sans dependre de l'eclairage)
+    background_rate: taux d'apprentissage du fond (0 = fond fige a la calibration), mis a jour a chaque detection
+    tracking: ne traite qu'une fenetre de roi_size pixels (image redressee) autour de la position predite
+              a partir de la derniere detection; recherche sur l'image entiere si la voiture n'y est pas.
+    """
+
+    def __init__(self, circuit, reference_points, camera_id=0, debug=False, calibration=None,
+                 tracking=True, roi_size=120, track_mask='background', background_rate=0.05, background_refresh=30,
+                 source=None):
         self.debug = debug
         self.circuit = circuit
         self.camera_id = camera_id
-        self.cap = cv2.VideoCapture(camera_id)
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.source = source
+        if source is None and camera_id is not None:
+            # Seul le thread de capture lit la camera
+            self.source = CameraSource(camera_id).start()
+        self.stage_times = StageTimes()
+        self.last_frame_id = 0
         self.projection_points = []  # Coordonnées sur l'image. A definir via calibration
         self.reference_points = reference_points # Coordonnées sur le circuit
         self.last_position = None
         self.background_model = None
         self.circuit_mask = None
+        self.track_mask = track_mask
+        self.background_rate = background_rate
+        self.background_margin = 10  # pixels autour de la voiture exclus de la mise a jour du fond
+        # Le fond entier est aussi rafraichi par bandes, une bande par image a tour de role (0: desactive)
+        self.background_refresh = background_refresh
+        self._background_accumulator = None  # fond en float32, cree a la premiere mise a jour
+        self._refresh_index = 0
+        self._car_box = None  # derniere boite englobante de la voiture (elargie), exclue des mises a jour
 
 
-        # Store transformation parameters for consistent coordinate mapping
-        self.transform_offset_x = 0
-        self.transform_offset_y = 0
-        self.transform_scale = 1.0
+        # Redressement de perspective, construit a la calibration (voir PerspectiveWarp)
         self.transform_padding = 10
+        self.warp = None
+
+        # Suivi: derniere detection (image redressee) et vitesse le long du rail pour predire la suivante
+        self.tracking = tracking
+        self.roi_size = roi_size
+        self.min_car_area = 30  # en pixels, les blobs plus petits sont du bruit
+        self._last_center = None
+        self._last_time = None
+        self._last_rail_distance = None
+        self.rail_velocity = 0.0  # unites du circuit par seconde
+        self.stats = {'roi': 0, 'full': 0, 'lost': 0}
 
 
-        self._calibrate()
+        if calibration is not None:
+            self._load_calibration(calibration)
+        else:
+            self._calibrate()
 
 
     def _apply_perspective_transform(self, frame):
-        if len(self.projection_points) == 4:
-            src_points = np.float32(self.projection_points)
-            
-            # Calculate the bounding box of reference points
-            x_coords = [p[0] for p in self.reference_points]
-            y_coords = [p[1] for p in self.reference_points]
-            
-            min_x, min_y = min(x_coords), min(y_coords)
-            max_x, max_y = max(x_coords), max(y_coords)
-            
-            # Calculate dimensions
-            circuit_width = max_x - min_x
-            circuit_height = max_y - min_y
-            
-            # Add padding for better quality
-            padding = self.transform_padding
-            
-            # Calculate scale to fit in a reasonable size while maintaining quality
-            target_width = 800  # TODO: make this in function of circuit size or other parameters
-            target_height = 600
-            scale = min(target_width / (circuit_width + 2 * padding), 
-                       target_height / (circuit_height + 2 * padding))
-            
-            # Store transformation parameters
-            self.transform_scale = scale
-            self.transform_offset_x = max(0, -min_x) + padding
-            self.transform_offset_y = max(0, -min_y) + padding
-            
-            # Create destination points with offset, padding, and scaling
-            dst_points = []
-            for px, py in self.reference_points:
-                # Apply offset (handle negative coords), padding, and scaling
-                dst_x = (px - min_x + padding) * scale
-                dst_y = (py - min_y + padding) * scale
-                dst_points.append([dst_x, dst_y])
-            
-            dst_points = np.float32(dst_points)
-            
-            # Get perspective transformation matrix
-            matrix = cv2.getPerspectiveTransform(src_points, dst_points)
-            
-            # Calculate output size
-            output_width = int((circuit_width + 2 * padding) * scale)
-            output_height = int((circuit_height + 2 * padding) * scale)
-            
-            # Apply transformation
-            transformed = cv2.warpPerspective(frame, matrix, (output_width, output_height))
-            
-            return transformed, matrix
-        
-        return None, None 
+        if self.warp is None:
+            return None, None
+        return self.warp.apply(frame), self.warp.matrix
 
     def _reference_to_transformed_coords(self, ref_x, ref_y):
-
-        # Get reference bounds for offset calculation
-        x_coords = [p[0] for p in self.reference_points]
-        y_coords = [p[1] for p in self.reference_points]
-        min_x, min_y = min(x_coords), min(y_coords)
-        
-        # Apply the same transformation as in _apply_perspective_transform
-        transformed_x = (ref_x - min_x + self.transform_padding) * self.transform_scale
-        transformed_y = (ref_y - min_y + self.transform_padding) * self.transform_scale
-        
-        return int(transformed_x), int(transformed_y)
+        return self.warp.reference_to_transformed(ref_x, ref_y)
 
     def _transformed_to_reference_coords(self, trans_x, trans_y):
-
-        # Get reference bounds for offset calculation
-        x_coords = [p[0] for p in self.reference_points]
-        y_coords = [p[1] for p in self.reference_points]
-        min_x, min_y = min(x_coords), min(y_coords)
-        
-        # Reverse the transformation
-        ref_x = (trans_x / self.transform_scale) + min_x - self.transform_padding
-        ref_y = (trans_y / self.transform_scale) + min_y - self.transform_padding
-        
-        return ref_x, ref_y
+        return self.warp.transformed_to_reference(trans_x, trans_y)
+
+    def _load_calibration(self, calibration):
+        self.projection_points = [tuple(point) for point in calibration['projection_points']]
+        self.warp = calibration.get('warp') or PerspectiveWarp(self.projection_points, self.reference_points,
+                                                               padding=self.transform_padding)
+        self.background_model = calibration.get('background_model')
+        if self.background_model is not None:
+            self.background_model = self.background_model.copy()  # mis a jour sur place
+        elif self.source is not None:
+            self._capture_background()
+        # Masque sauvegarde dans un autre mode que celui demande (ou de mode inconnu): recalcule
+        self.circuit_mask = calibration.get('circuit_mask')
+        if calibration.get('track_mask') != self.track_mask:
+            self.circuit_mask = None
+        if self.circuit_mask is None and (self.background_model is not None or self.track_mask == 'geometry'):
+            self._generate_circuit_mask()
+
+    def get_calibration(self):
+        return {'projection_points': self.projection_points, 'reference_points': self.reference_points,
+                'background_model': self.background_model, 'circuit_mask': self.circuit_mask,
+                'track_mask': self.track_mask, 'warp': self.warp}
+
+    def _capture_background(self):
+        # Fond capture sur une image posterieure a l'appel (apres la validation des points)
+        _, _, frame_id = self.source.read()
+        frame, _, _ = self.source.read(newer_than=frame_id)
+        transformed, matrix = self._apply_perspective_transform(frame)
+        if transformed is not None:
+            gray = cv2.cvtColor(transformed, cv2.COLOR_BGR2GRAY)
+            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+            self.background_model = blurred
+            self._background_accumulator = None
+            self._car_box = None
 
 
     def _calibrate(self):
@@ -124,8 +324,8 @@ class CarDetector:
         
         # Phase 1: Calibration perspective
         while True:
-            ret, frame = self.cap.read()
-            if not ret:
+            frame, _, _ = self.source.read()
+            if frame is None:
                 continue  # Skip bad frames, don't break
                 
             display_frame = frame.copy()
@@ -143,7 +343,7 @@ class CarDetector:
             cv2.imshow("Calibration", display_frame)
             
             key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
+            if key == ord('q') and len(self.projection_points) == 4:
                 break
             elif key == ord('r'):
                 self.projection_points = []
@@ -151,18 +351,22 @@ class CarDetector:
 
 
 
-        ret, frame = self.cap.read()
-        transformed, matrix = self._apply_perspective_transform(frame)
-        if transformed is not None:
-            gray = cv2.cvtColor(transformed, cv2.COLOR_BGR2GRAY)
-            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-            self.background_model = blurred
+        self.warp = PerspectiveWarp(self.projection_points, self.reference_points, padding=self.transform_padding)
+
+        self._capture_background()
         
         cv2.destroyWindow("Calibration")
         self._generate_circuit_mask()
         
 
     def _generate_circuit_mask(self):
+        if self.track_mask == 'geometry':
+            # Trace du circuit elargi comme la dilatation 40x40 ci-dessous, sans seuillage ni morphologie
+            width, height = self.warp.size
+            self.circuit_mask = rasterize_track(self.circuit, self.warp, np.zeros((height, width), dtype=np.uint8),
+                                                255, margin=20)
+            return
+
         # self.background_model is already grayscale, so we don't need to convert it
         if len(self.background_model.shape) == 3:
             # If somehow it's still BGR, convert it
@@ -195,84 +399,464 @@ class CarDetector:
                 self.projection_points.append((x, y))
                 print(f"Point {len(self.projection_points)}: ({x}, {y})")
 
-    def get_car_position(self):
-        ret, frame = self.cap.read()
-            
-        center = self._detect_car_in_frame(frame)
+    def get_car_position(self, timeout=0.5):
+        """
+        Detecte la voiture sur la prochaine image (attend au plus timeout une image pas encore traitee).
+        Retourne (x, y, rail_distance, heure de capture de l'image) ou None
+        """
+        frame, capture_time, frame_id = self.source.read(newer_than=self.last_frame_id, timeout=timeout)
+        if frame is None:
+            return None
+        self.last_frame_id = frame_id
+        return self.detect(frame, capture_time)
+
+    def detect(self, frame, capture_time):
+        """Detection sur une image camera, retourne (x, y, rail_distance, capture_time) ou None"""
+        self.stage_times.start()
+        center = self._detect_car_in_frame(frame, capture_time)
         if center is None:
+            self.stage_times.finish()
             return None
             
         # Convert to reference coordinates for circuit calculations
         ref_x, ref_y = self._transformed_to_reference_coords(center[0], center[1])
         
         rail_distance = self.circuit.position_to_rail_distance(ref_x, ref_y, False)
+        self._update_track(center, rail_distance, capture_time)
+        self.stage_times.lap('rail')
+        self.stage_times.finish()
         
-        self.last_position = (ref_x, ref_y, rail_distance)
+        self.last_position = (ref_x, ref_y, rail_distance, capture_time)
         return self.last_position
 
-    def _detect_car_in_frame(self, frame):
-        transformed, matrix = self._apply_perspective_transform(frame)
-
-        if transformed is not None:
-            # Recuperer les parties sombres
-            gray = cv2.cvtColor(transformed, cv2.COLOR_BGR2GRAY)
-            blurred = cv2.GaussianBlur(gray, (7, 7), 0)
-            
-            diff = cv2.absdiff(self.background_model, blurred)
-
-            _, car_mask = cv2.threshold(diff, 40, 255, cv2.THRESH_BINARY)
+    def close(self):
+        if self.source is not None:
+            self.source.stop()
+
+    def _update_track(self, center, rail_distance, capture_time):
+        if rail_distance is not None and self._last_rail_distance is not None and capture_time > self._last_time:
+            # Distance parcourue ramenee a [-tour/2, tour/2] pour traverser la ligne d'arrivee
+            lap_length = self.circuit._outside_rail_length
+            delta = (rail_distance - self._last_rail_distance + lap_length / 2) % lap_length - lap_length / 2
+            self.rail_velocity = delta / (capture_time - self._last_time)
+        self._last_center = center
+        self._last_time = capture_time
+        if rail_distance is not None:
+            self._last_rail_distance = rail_distance
+
+    def _predict_center(self, capture_time):
+        """Position attendue de la voiture (image redressee) a capture_time, None sans detection precedente"""
+        if self._last_center is None:
+            return None
+        if self._last_rail_distance is None or capture_time is None:
+            return self._last_center
+        distance = self._last_rail_distance + self.rail_velocity * (capture_time - self._last_time)
+        position = self.circuit.get_position_at_rail(distance % self.circuit._outside_rail_length, False)
+        return self._reference_to_transformed_coords(position.x, position.y)
+
+    def _roi_around(self, center):
+        width, height = self.warp.size
+        size_x, size_y = min(self.roi_size, width), min(self.roi_size, height)
+        x0 = min(max(int(center[0]) - size_x // 2, 0), width - size_x)
+        y0 = min(max(int(center[1]) - size_y // 2, 0), height - size_y)
+        return x0, y0, x0 + size_x, y0 + size_y
+
+    def _find_car(self, frame, region):
+        """
+        Cherche la voiture dans une zone (x0, y0, x1, y1) de l'image redressee: seule cette zone est redressee et
+        comparee au fond. Centroide du plus grand blob, un pixel isole ne deplace pas la position.
+        Retourne (centre dans l'image redressee ou None, zone redressee, masque de la voiture)
+        """
+        x0, y0, x1, y1 = region
+        transformed = self.warp.apply(frame, region)
+        self.stage_times.lap('remap')
+
+        # Recuperer les parties sombres
+        gray = cv2.cvtColor(transformed, cv2.COLOR_BGR2GRAY)
+        blurred = cv2.GaussianBlur(gray, (7, 7), 0)
+        diff = cv2.absdiff(self.background_model[y0:y1, x0:x1], blurred)
+        _, car_mask = cv2.threshold(diff, 40, 255, cv2.THRESH_BINARY)
+        if self.circuit_mask is not None:
+            car_mask = cv2.bitwise_and(car_mask, self.circuit_mask[y0:y1, x0:x1])
+        self.stage_times.lap('difference')
+
+        nb_labels, _, stats, centroids = cv2.connectedComponentsWithStats(car_mask, connectivity=8)
+        self.stage_times.lap('blobs')
+        if nb_labels < 2:
+            return None, transformed, car_mask
+        largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))  # Skip background (0)
+        if stats[largest, cv2.CC_STAT_AREA] < self.min_car_area:
+            return None, transformed, car_mask
+
+        # Boite englobante de la voiture (image redressee), elargie de background_margin pixels
+        left, top = x0 + stats[largest, cv2.CC_STAT_LEFT], y0 + stats[largest, cv2.CC_STAT_TOP]
+        right, bottom = left + stats[largest, cv2.CC_STAT_WIDTH], top + stats[largest, cv2.CC_STAT_HEIGHT]
+        margin = self.background_margin
+        self._car_box = (left - margin, top - margin, right + margin, bottom + margin)
+        self._update_background(blurred, region, self.background_rate)
+        self.stage_times.lap('background')
+        return (x0 + float(centroids[largest][0]), y0 + float(centroids[largest][1])), transformed, car_mask
+
+    def _update_background(self, blurred, region, rate):
+        """
+        Moyenne glissante du fond (cv2.accumulateWeighted) sur une zone deja floutee, sauf la derniere boite de la
+        voiture: O(zone traitee). Une voiture perdue mais toujours la (crash, arret) n'est pas absorbee dans le fond.
+        """
+        if rate <= 0:
+            return
+        x0, y0, x1, y1 = region
+        if self._background_accumulator is None:
+            self._background_accumulator = self.background_model.astype(np.float32)
+
+        update_mask = None
+        if self._car_box is not None:
+            left, top, right, bottom = self._car_box
+            if left < x1 and right > x0 and top < y1 and bottom > y0:
+                update_mask = np.full(blurred.shape, 255, dtype=np.uint8)
+                update_mask[max(top - y0, 0):max(bottom - y0, 0), max(left - x0, 0):max(right - x0, 0)] = 0
+
+        accumulator = self._background_accumulator[y0:y1, x0:x1]
+        cv2.accumulateWeighted(blurred, accumulator, rate, mask=update_mask)
+        self.background_model[y0:y1, x0:x1] = cv2.convertScaleAbs(accumulator)
+
+    def _refresh_background(self, frame):
+        """
+        Rafraichit une bande horizontale du fond (1/background_refresh de l'image redressee) par image, a tour de
+        role: tout le fond suit l'eclairage, y compris loin de la voiture et quand elle est perdue, pour un cout
+        fixe par image. Chaque bande cumule en une fois les background_refresh mises a jour qu'elle a manquees.
+        """
+        if self.background_rate <= 0 or not self.background_refresh:
+            return
+        width, height = self.warp.size
+        band = self._refresh_index % self.background_refresh
+        self._refresh_index += 1
+        y0 = height * band // self.background_refresh
+        y1 = height * (band + 1) // self.background_refresh
+        # 3 lignes de plus de chaque cote pour que le flou 7x7 de la bande soit celui de l'image entiere
+        pad_y0, pad_y1 = max(y0 - 3, 0), min(y1 + 3, height)
+        gray = cv2.cvtColor(self.warp.apply(frame, (0, pad_y0, width, pad_y1)), cv2.COLOR_BGR2GRAY)
+        blurred = cv2.GaussianBlur(gray, (7, 7), 0)[y0 - pad_y0:y1 - pad_y0]
+        rate = 1.0 - (1.0 - self.background_rate) ** self.background_refresh
+        self._update_background(blurred, (0, y0, width, y1), rate)
+
+    def _detect_car_in_frame(self, frame, capture_time=None):
+        if self.warp is None:
+            return None
+        full_frame = (0, 0) + self.warp.size
+
+        center = None
+        predicted = self._predict_center(capture_time) if self.tracking else None
+        self.stage_times.lap('prediction')
+        if predicted is not None:
+            region = self._roi_around(predicted)
+            center, transformed, car_mask = self._find_car(frame, region)
+            if center is not None:
+                self.stats['roi'] += 1
+        if center is None:
+            # Pas de suivi en cours ou voiture perdue: recherche sur toute l'image
+            region = full_frame
+            center, transformed, car_mask = self._find_car(frame, region)
+            if center is not None:
+                self.stats['full'] += 1
+            else:
+                self.stats['lost'] += 1
+                # Pas de vitesse calculee a travers le trou: le suivi repart de la prochaine detection
+                self._last_center = None
+                self._last_rail_distance = None
+
+        self._refresh_background(frame)
+        self.stage_times.lap('refresh')
+
+        if self.debug:
+            self._show_debug(frame, transformed, car_mask, region, center)
+        return center  # Return in transformed coordinates
+
+    def _show_debug(self, frame, transformed, car_mask, region, center):
+        cv2.imshow("initial_frame", frame)
+        cv2.imshow("transformed", transformed)
+        cv2.imshow("car_mask", car_mask)
+        cv2.imshow("circuit_mask", self.circuit_mask)
+        cv2.waitKey(1)
+        if center is None:
+            return
 
-            if self.circuit_mask is not None:
-                car_mask = cv2.bitwise_and(car_mask, self.circuit_mask)
-            # On recupere la position de tous les pixels de voiture qu'on a trouvé et on fait la moyenne pour estimer la position
-            y_coords, x_coords = np.where(car_mask >= 128)
+        # Coordonnees dans la zone traitee
+        x0, y0 = region[0], region[1]
+        center_x, center_y = int(center[0]), int(center[1])
 
+        # Draw red circle at detected position (transformed coordinates)
+        cv2.circle(transformed, (center_x - x0, center_y - y0), 30, (0, 0, 255), 5)
 
-            if self.debug:
-                cv2.imshow("initial_frame", frame)
-                cv2.imshow("transformed", transformed)
-                cv2.imshow("car_mask", car_mask)
-                cv2.imshow("circuit_mask", self.circuit_mask)
-                cv2.waitKey(1)
+        # Convert to reference coordinates for circuit calculation
+        ref_x, ref_y = self._transformed_to_reference_coords(center[0], center[1])
+        rail_distance = self.circuit.position_to_rail_distance(ref_x, ref_y, False)
+        if rail_distance is not None:
+            expected_pos = self.circuit.get_position_at_rail(rail_distance, False)
+
+            print("detected (transformed):", (center_x, center_y))
+            print("detected (reference):", (ref_x, ref_y))
+            print("expected (reference):", (expected_pos.x, expected_pos.y))
+
+            # Convert expected position to transformed coordinates for drawing
+            expected_trans_x, expected_trans_y = self._reference_to_transformed_coords(
+                expected_pos.x, expected_pos.y)
+
+            print("expected (transformed):", (expected_trans_x, expected_trans_y))
+
+            # Draw blue circle at expected position (in transformed coordinates)
+            cv2.circle(transformed, (expected_trans_x - x0, expected_trans_y - y0), 30, (255, 0, 0), 5)
+
+        # Add legend
+        cv2.putText(transformed, "Red: Detected", (10, 30), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        cv2.putText(transformed, "Blue: Expected", (10, 60), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
+
+        cv2.imshow("detection", transformed)
+
+
+CALIBRATION_DIR = "cache"
+
+
+def default_calibration_path(circuit, camera_id):
+    return os.path.join(CALIBRATION_DIR, f"calibration_{circuit.get_section_hash()}_camera{camera_id}.npz")
+
+
+def open_detector(circuit, reference_points, camera_id, calibration_path=None, recalibrate=False,
+                  projection_points=None, **detector_args):
+    """
+    Demarrage sans interface si possible: calibration relue depuis calibration_path, sinon points de projection
+    donnes (fond capture et masque recalcule), sinon calibration interactive. La calibration est sauvegardee
+    pour le demarrage suivant.
+    """
+    calibration_path = calibration_path or default_calibration_path(circuit, camera_id)
+    calibration = None if recalibrate else load_calibration(calibration_path, circuit, reference_points)
+    if calibration is None and projection_points is not None:
+        calibration = {'projection_points': projection_points}
+    loaded = calibration is not None and 'background_model' in calibration
+
+    detector = CarDetector(circuit, reference_points, camera_id=camera_id, calibration=calibration, **detector_args)
+    if not loaded:
+        save_calibration(calibration_path, circuit, detector.get_calibration())
+    return detector
+
+
+def open_source(camera_id, replay=None, record=None, realtime=True):
+    """Camera camera_id (enregistree dans record si donne), ou relecture de l'enregistrement replay"""
+    if replay is not None:
+        return RecordingSource(replay, realtime=realtime).start()
+    return CameraSource(camera_id, recorder=FrameRecorder(record) if record else None).start()
+
+
+def run_pipeline(detector, source, max_frames=None):
+    """
+    Detection sur chaque image de la source (enregistrement relu au plus vite): affiche le debit, le temps par
+    etape et les resultats de detection, retourne la liste des detections image par image
+    """
+    detector.stage_times = StageTimes(enabled=True)
+    results = []
+    read_time = 0.0
+    start = time.perf_counter()
+    while max_frames is None or len(results) < max_frames:
+        read_start = time.perf_counter()
+        frame, capture_time, frame_id = source.read()
+        read_time += time.perf_counter() - read_start
+        if frame is None:
+            if getattr(source, 'finished', False):
+                break
+            continue
+        position = detector.detect(frame, capture_time)
+        x, y, rail_distance = (None, None, None) if position is None else \
+            (float(v) if v is not None else None for v in position[:3])
+        results.append({'frame': frame_id, 'timestamp': capture_time, 'x': x, 'y': y, 'rail_distance': rail_distance})
+    elapsed = time.perf_counter() - start
+
+    nb_frames = max(len(results), 1)
+    stage_times = detector.stage_times
+    frame_ms = np.array(stage_times.frame_totals) * 1000.0 if stage_times.frame_totals else np.zeros(1)
+    print(f"[Vision] {len(results)} images en {elapsed:.2f} s ({len(results) / elapsed:.0f} images/s)")
+    print(f"[Vision]   {'lecture':12s} {read_time / nb_frames * 1000.0:7.3f} ms/image")
+    for stage, total in stage_times.totals.items():
+        print(f"[Vision]   {stage:12s} {total / nb_frames * 1000.0:7.3f} ms/image")
+    print(f"[Vision]   {'detection':12s} {frame_ms.mean():7.3f} ms/image (p95 {np.percentile(frame_ms, 95):.3f}, "
+          f"max {frame_ms.max():.3f})")
+    detected = sum(result['x'] is not None for result in results)
+    print(f"[Vision] Detectee sur {detected}/{len(results)} images: fenetre de suivi {detector.stats['roi']}, "
+          f"image entiere {detector.stats['full']}, perdue {detector.stats['lost']}")
+    return results
+
+
+def parse_projection_points(text):
+    """'x1,y1;x2,y2;x3,y3;x4,y4' -> [(x1, y1), ...]"""
+    points = [tuple(int(v) for v in point.split(',')) for point in text.split(';')]
+    if len(points) != 4 or any(len(point) != 2 for point in points):
+        raise argparse.ArgumentTypeError("4 points attendus: x1,y1;x2,y2;x3,y3;x4,y4")
+    return points
+
+
+def add_detector_arguments(parser):
+    parser.add_argument('--camera-id', type=int, default=2)
+    parser.add_argument('--calibration', type=str, default=None,
+                        help=f"Fichier de calibration (defaut: {CALIBRATION_DIR}/calibration_<circuit>_camera<id>.npz)")
+    parser.add_argument('--recalibrate', action='store_true', help="Ignore la calibration sauvegardee")
+    parser.add_argument('--projection-points', type=parse_projection_points, default=None,
+                        help="Points de projection 'x1,y1;x2,y2;x3,y3;x4,y4': calibration sans interface")
+    parser.add_argument('--track-mask', choices=['background', 'geometry'], default='background',
+                        help="Masque de la piste: seuillage du fond ou trace du circuit")
+    parser.add_argument('--background-rate', type=float, default=0.05,
+                        help="Taux d'apprentissage du fond a chaque detection (0: fond fige a la calibration)")
+    parser.add_argument('--background-refresh', type=int, default=30,
+                        help="Fond entier rafraichi en N bandes, une par image (0: seulement autour de la voiture)")
+    parser.add_argument('--replay', type=str, default=None,
+                        help="Relit un enregistrement (.npz ou video + .timestamps.txt) au lieu de la camera")
+    parser.add_argument('--record', type=str, default=None,
+                        help="Enregistre les images de la camera (.npz sans perte, sinon video MJPG)")
+
+
+def synthetic_projection_points(reference_points, frame_size=(640, 480)):
+    """Points de projection d'une camera fictive qui voit le circuit en biais (trapeze), pour les benchmarks"""
+    x_coords = [p[0] for p in reference_points]
+    y_coords = [p[1] for p in reference_points]
+    min_x, min_y = min(x_coords), min(y_coords)
+    width, height = max(x_coords) - min_x, max(y_coords) - min_y
+    frame_width, frame_height = frame_size
+    projection_points = []
+    for px, py in reference_points:
+        v = (py - min_y) / height
+        u = 0.5 + ((px - min_x) / width - 0.5) * (0.6 + 0.3 * v)
+        projection_points.append((int(u * frame_width * 0.875 + frame_width / 16), int(v * frame_height * 0.75 + frame_height / 6)))
+    return projection_points
+
+
+def render_synthetic_frame(circuit, warp, rail_distance=None, frame_size=(640, 480), nb_specks=0, rng=None,
+                           brightness=0):
+    """
+    Image camera fictive: piste sombre sur fond clair vue a travers warp, voiture claire a rail_distance
+    (rail exterieur) si donnee, nb_specks petites taches parasites sur la piste, bruit gaussien,
+    eclairage decale de brightness niveaux.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    width, height = warp.size
+    scene = rasterize_track(circuit, warp, np.full((height, width, 3), 170, dtype=np.uint8), (50, 50, 50))
+
+    if rail_distance is not None:
+        position = circuit.get_position_at_rail(rail_distance % circuit._outside_rail_length, False)
+        cv2.circle(scene, warp.reference_to_transformed(position.x, position.y), int(2 * warp.scale), (210, 210, 210), -1)
+    rail = np.arange(0.0, circuit._outside_rail_length, 1.0)
+    for d in rng.choice(rail, nb_specks):
+        position = circuit.get_position_at_rail(d, True)
+        cv2.circle(scene, warp.reference_to_transformed(position.x, position.y), 3, (210, 210, 210), -1)
+
+    frame = cv2.warpPerspective(scene, warp.matrix, frame_size, flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+    noise = rng.normal(brightness, 4, frame.shape)
+    return np.clip(frame + noise, 0, 255).astype(np.uint8)
+
+
+def benchmark_detection(circuit, reference_points, roi_sizes=(80, 120, 200), nb_frames=300, speed=90.0, fps=30.0):
+    """
+    Temps de detection et erreur de position sur une voiture fictive qui roule a speed unites/s, avec des taches
+    parasites sur la piste. Compare l'ancienne methode (moyenne de tous les pixels sur l'image entiere),
+    le plus grand blob sur l'image entiere, et le suivi par fenetre de chaque taille de roi_sizes.
+    """
+    rng = np.random.default_rng(1)
+    projection_points = synthetic_projection_points(reference_points)
+    warp = PerspectiveWarp(projection_points, reference_points)
+    empty = render_synthetic_frame(circuit, warp, rng=rng)
+    background_model = cv2.GaussianBlur(cv2.cvtColor(warp.apply(empty), cv2.COLOR_BGR2GRAY), (5, 5), 0)
+    calibration = {'projection_points': projection_points, 'background_model': background_model}
+
+    distances = [(i * speed / fps) % circuit._outside_rail_length for i in range(nb_frames)]
+    frames = [render_synthetic_frame(circuit, warp, d, nb_specks=2, rng=rng) for d in distances]
+    print(f"[Vision] Detection sur {nb_frames} images synthetiques ({warp.size[0]}x{warp.size[1]} redressees)")
+
+    def legacy_detect(detector, frame):
+        # Ancien _detect_car_in_frame: moyenne des pixels de l'image entiere
+        gray = cv2.cvtColor(detector.warp.apply(frame), cv2.COLOR_BGR2GRAY)
+        diff = cv2.absdiff(detector.background_model, cv2.GaussianBlur(gray, (7, 7), 0))
+        _, car_mask = cv2.threshold(diff, 40, 255, cv2.THRESH_BINARY)
+        car_mask = cv2.bitwise_and(car_mask, detector.circuit_mask)
+        y_coords, x_coords = np.where(car_mask >= 128)
+        if len(x_coords) == 0:
+            return None
+        ref_x, ref_y = detector.warp.transformed_to_reference(np.mean(x_coords), np.mean(y_coords))
+        return ref_x, ref_y
 
-            if len(x_coords) > 0:
-                # Detected center in transformed coordinates
-                center_x = int(np.mean(x_coords))
-                center_y = int(np.mean(y_coords))
-                
-                if self.debug:
-                    # Draw red circle at detected position (transformed coordinates)
-                    cv2.circle(transformed, (center_x, center_y), 30, (0, 0, 255), 5)
-                    
-                    # Convert to reference coordinates for circuit calculation
-                    ref_x, ref_y = self._transformed_to_reference_coords(center_x, center_y)
-                    rail_distance = self.circuit.position_to_rail_distance(ref_x, ref_y, False)
-                    expected_pos = round_circuit.get_position_at_rail(rail_distance, False)
-                    
-                    print("detected (transformed):", (center_x, center_y))
-                    print("detected (reference):", (ref_x, ref_y))
-                    print("expected (reference):", (expected_pos.x, expected_pos.y))
-
-                    # Convert expected position to transformed coordinates for drawing
-                    expected_trans_x, expected_trans_y = self._reference_to_transformed_coords(
-                        expected_pos.x, expected_pos.y)
-                    
-                    print("expected (transformed):", (expected_trans_x, expected_trans_y))
-                    
-                    # Draw blue circle at expected position (in transformed coordinates)
-                    cv2.circle(transformed, (expected_trans_x, expected_trans_y), 30, (255, 0, 0), 5)
-
-                    # Add legend
-                    cv2.putText(transformed, "Red: Detected", (10, 30), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                    cv2.putText(transformed, "Blue: Expected", (10, 60), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
-
-                    cv2.imshow("detection", transformed)
-                    
-                return (center_x, center_y)  # Return in transformed coordinates
+    methods = [('moyenne image entiere', None, None), ('blob image entiere', False, None)]
+    methods += [(f'suivi fenetre {size}px', True, size) for size in roi_sizes]
+    results = {}
+    for name, tracking, roi_size in methods:
+        detector = CarDetector(circuit, reference_points, camera_id=None, calibration=calibration,
+                               tracking=bool(tracking), roi_size=roi_size or 120)
+        times, errors = [], []
+        for i, (frame, distance) in enumerate(zip(frames, distances)):
+            start = time.perf_counter()
+            if tracking is None:
+                position = legacy_detect(detector, frame)
             else:
-                return None 
+                position = detector.detect(frame, i / fps)
+            times.append((time.perf_counter() - start) * 1000.0)
+            if position is not None:
+                expected = circuit.get_position_at_rail(distance, False)
+                errors.append(math.hypot(position[0] - expected.x, position[1] - expected.y))
+
+        errors = np.array(errors) if errors else np.array([np.nan])
+        results[name] = {'mean_ms': float(np.mean(times)), 'p95_ms': float(np.percentile(times, 95)),
+                         'detected': len(errors) / nb_frames, 'mean_error': float(np.mean(errors)),
+                         'p95_error': float(np.percentile(errors, 95))}
+        line = (f"[Vision] {name:22s} {results[name]['mean_ms']:6.3f} ms (p95 {results[name]['p95_ms']:6.3f}), "
+                f"detectee {100 * results[name]['detected']:5.1f} %, erreur moyenne {results[name]['mean_error']:.2f} "
+                f"/ p95 {results[name]['p95_error']:.2f} unites")
+        if tracking:
+            line += f", fenetre {detector.stats['roi']} / image entiere {detector.stats['full']}"
+        print(line)
+    return results
+
+
+def benchmark_background_drift(circuit, reference_points, nb_frames=600, drift=60,
+                               variants=((0.0, 0), (0.05, 0), (0.05, 30)), speed=90.0, fps=30.0, absent=(0.5, 0.7)):
+    """
+    Eclairage qui augmente de drift niveaux sur la duree: fond fige a la calibration contre fond adaptatif, pour
+    chaque (background_rate, background_refresh) de variants (refresh 0: mise a jour autour de la voiture seulement).
+    La voiture sort du circuit pendant la fraction absent de la sequence (crash): le fond doit suivre
+    l'eclairage sans elle pour la retrouver ensuite.
+    """
+    rng = np.random.default_rng(2)
+    projection_points = synthetic_projection_points(reference_points)
+    warp = PerspectiveWarp(projection_points, reference_points)
+    empty = render_synthetic_frame(circuit, warp, rng=rng)
+    background_model = cv2.GaussianBlur(cv2.cvtColor(warp.apply(empty), cv2.COLOR_BGR2GRAY), (5, 5), 0)
+    calibration = {'projection_points': projection_points, 'background_model': background_model}
+
+    distances = [None if absent[0] <= i / nb_frames < absent[1] else (i * speed / fps) % circuit._outside_rail_length
+                 for i in range(nb_frames)]
+    frames = [render_synthetic_frame(circuit, warp, d, rng=rng, brightness=drift * i / nb_frames)
+              for i, d in enumerate(distances)]
+    print(f"[Vision] Derive d'eclairage de {drift} niveaux sur {nb_frames} images, "
+          f"voiture absente de {100 * absent[0]:.0f} a {100 * absent[1]:.0f} %")
+
+    results = {}
+    for rate, refresh in variants:
+        detector = CarDetector(circuit, reference_points, camera_id=None, calibration=calibration,
+                               background_rate=rate, background_refresh=refresh)
+        times, errors = [], []
+        for i, (frame, distance) in enumerate(zip(frames, distances)):
+            start = time.perf_counter()
+            position = detector.detect(frame, i / fps)
+            times.append((time.perf_counter() - start) * 1000.0)
+            if distance is None:
+                continue
+            expected = circuit.get_position_at_rail(distance, False)
+            errors.append(math.inf if position is None else math.hypot(position[0] - expected.x, position[1] - expected.y))
+
+        # Erreur sur le dernier quart, quand l'eclairage a le plus change
+        late_errors = np.array(errors[-nb_frames // 4:])
+        result = results[(rate, refresh)] = {'mean_ms': float(np.mean(times)),
+                                             'late_detected': float(np.isfinite(late_errors).mean()),
+                                             'late_error': float(np.median(late_errors))}
+        print(f"[Vision] taux {rate:.2f}, bandes {refresh:2d}: {result['mean_ms']:6.3f} ms/image, dernier quart: "
+              f"detectee {100 * result['late_detected']:5.1f} %, erreur mediane {result['late_error']:.2f} "
+              f"unites, recherches image entiere {detector.stats['full']}")
+    return results
 
 
 if __name__ == "__main__":
@@ -323,12 +907,44 @@ if __name__ == "__main__":
         
         return points
     reference_points = get_reference_points()  
-    detector = CarDetector(round_circuit, reference_points, camera_id=2, debug=True)
 
-    while True:
-        
-        detector.get_car_position()
+    parser = argparse.ArgumentParser(description="Detection de la voiture par camera")
+    add_detector_arguments(parser)
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Mesure le cout du redressement par image sur des images synthetiques (sans camera)")
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--realtime', action='store_true',
+                        help="Avec --replay: relit au rythme de l'enregistrement au lieu du plus vite possible")
+    parser.add_argument('--results', type=str, default=None, help="Avec --replay: detections image par image (JSON)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        projection_points = synthetic_projection_points(reference_points)
+        benchmark_warp(projection_points, reference_points, nb_frames=args.frames)
+        benchmark_detection(round_circuit, reference_points, nb_frames=args.frames)
+        benchmark_background_drift(round_circuit, reference_points, nb_frames=2 * args.frames)
+        sys.exit(0)
+
+    # Relecture hors ligne: calibration sauvegardee (ou --projection-points) de la camera enregistree
+    source = open_source(args.camera_id, args.replay, args.record, realtime=args.realtime)
+    detector = open_detector(round_circuit, reference_points, args.camera_id, args.calibration, args.recalibrate,
+                             args.projection_points, debug=args.replay is None, track_mask=args.track_mask,
+                             background_rate=args.background_rate, background_refresh=args.background_refresh,
+                             source=source)
+
+    if args.replay:
+        results = run_pipeline(detector, source)
+        if args.results:
+            with open(args.results, 'w') as f:
+                json.dump(results, f, indent=1)
+        detector.close()
+        sys.exit(0)
+
+    try:
+        while True:
 
-        time.sleep(1/20)
-        
+            detector.get_car_position()
 
+            time.sleep(1/20)
+    finally:
+        detector.close()  # termine l'enregistrement (--record)
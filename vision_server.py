@@ -1,9 +1,12 @@
 from flask import Flask, jsonify
-from vision import CarDetector
+from vision import open_detector, open_source, add_detector_arguments
 from circuit import SectionType as ST
 from circuit import *
 import time
-import requests
+import threading
+import argparse
+from http_client import get_client
+from scheduler import FixedRateScheduler
 
 app = Flask(__name__)
 
@@ -11,7 +14,7 @@ round_circuit = Circuit([
     ST.SHORT, ST.SHORT, ST.TURN_LEFT,
     ST.LONG, ST.TURN_LEFT, ST.LONG, 
     ST.TURN_LEFT, ST.LONG, ST.TURN_LEFT, ST.SHORT,
-])
+], cache_dir="cache")
 
 def get_reference_points():
     # TODO: faire mieux avec des aruco
@@ -55,31 +58,57 @@ def get_reference_points():
     return points
 
 reference_points = get_reference_points()  
-detector = CarDetector(round_circuit, reference_points, camera_id=2, debug=False)
+detector = None  # ouvert au demarrage (voir __main__)
+# Le detecteur (camera + modele de fond) est partage entre les requetes HTTP et la boucle de publication
+detector_lock = threading.Lock()
+
+SERVER_URL = "http://10.135.180.56:5000"
+
+
+def detect_and_publish():
+    """Detecte la voiture et pousse sa position au serveur principal (dashboard, RailCarRealEnv en mode push)"""
+    with detector_lock:
+        position = detector.get_car_position()
+
+    if not position:
+        return None
+
+    x, y, _, capture_time = position
+    rail_distance = round_circuit.position_to_rail_distance(x, y, True)
+
+    response_data = {
+        'x': x, 'y': y, 
+        'rail_distance': rail_distance,
+        # Heure de capture de l'image (pas de la reponse), pour compenser la latence camera + reseau
+        'timestamp': capture_time,
+        'latency': time.time() - capture_time,
+    }
+
+    # Send to main server for dashboard
+    try:
+        get_client(SERVER_URL).post("/car_position", json=response_data, timeout=0.1)
+    except:
+        pass
+
+    return response_data
+
+
+def publish_positions(rate):
+    """Boucle de detection continue: la position est poussee au serveur sans attendre de requete"""
+    scheduler = FixedRateScheduler(rate)
+    for _ in scheduler.ticks():
+        try:
+            detect_and_publish()
+        except Exception as e:
+            print(f"[VisionServer] Detection failed: {e}")
 
  
 @app.route('/car_position', methods=['GET'])
 def get_car_position():
     try:
-        position = detector.get_car_position()
+        response_data = detect_and_publish()
         
-        if position:
-            x, y = position[0], position[1]
-            rail_distance = round_circuit.position_to_rail_distance(x, y, True)
-            
-            response_data = {
-                'x': x, 'y': y, 
-                'rail_distance': rail_distance,
-                'timestamp': time.time()
-            }
-            
-            # Send to main server for dashboard
-            try:
-                requests.post("http://10.135.180.56:5000/car_position", 
-                            json=response_data, timeout=0.1)
-            except:
-                pass
-            
+        if response_data:
             return jsonify(response_data)
         else:
             return jsonify({'error': 'no position detected'}), 404
@@ -90,4 +119,23 @@ def get_car_position():
         return jsonify({'error': 'detector failed'}), 500
 
 if __name__ == '__main__':
-    app.run(host='localhost', port=5001, debug=False)
+    parser = argparse.ArgumentParser(description="Serveur de vision")
+    parser.add_argument('--push-rate', type=float, default=0,
+                        help="Si > 0, detecte en continu a cette frequence (Hz) et pousse la position au serveur")
+    add_detector_arguments(parser)
+    args = parser.parse_args()
+
+    # --replay: relu au rythme de l'enregistrement, comme une camera
+    source = open_source(args.camera_id, args.replay, args.record, realtime=True)
+    detector = open_detector(round_circuit, reference_points, args.camera_id, args.calibration, args.recalibrate,
+                             args.projection_points, track_mask=args.track_mask,
+                             background_rate=args.background_rate, background_refresh=args.background_refresh,
+                             source=source)
+
+    if args.push_rate > 0:
+        threading.Thread(target=publish_positions, args=(args.push_rate,), daemon=True).start()
+
+    try:
+        app.run(host='localhost', port=5001, debug=False)
+    finally:
+        detector.close()  # termine l'enregistrement (--record)
@@ -0,0 +1,141 @@
+import json
+import time
+import struct
+import argparse
+import math
+
+# Encodage binaire compact des evenements Socket.IO frequents (car_position_update, sensor_update,
+# training_update), negocie par client a la connexion: auth={'encoding': BINARY_ENCODING}.
+# Les clients qui ne le demandent pas continuent de recevoir du JSON.
+#
+# Format (little-endian), aligne pour etre lu directement en Float64Array / Float32Array:
+#   octet 0     version (ENCODING_VERSION)
+#   octet 1     identifiant de l'evenement (EVENT_IDS)
+#   octet 2     drapeaux (FLAG_*)
+#   octet 3     reserve
+#   octets 4-7  nombre de valeurs n (uint32)
+#   octets 8-15 timestamp (float64)
+#   puis n valeurs float32, dans l'ordre de FIELDS[evenement] (NaN pour une valeur absente)
+
+ENCODING_VERSION = 1
+BINARY_ENCODING = f"binary-v{ENCODING_VERSION}"
+JSON_ENCODING = "json"
+
+HEADER = struct.Struct('<BBBxId')
+
+EVENT_IDS = {
+    'car_position_update': 1,
+    'sensor_update': 2,
+    'training_update': 3,
+}
+EVENT_NAMES = {event_id: name for name, event_id in EVENT_IDS.items()}
+
+# Champs fixes de chaque evenement; training_update ajoute l'etat (longueur variable) a la fin
+FIELDS = {
+    'car_position_update': ['x', 'y', 'rail_distance', 'tangent_x', 'tangent_y'],
+    'sensor_update': ['voltage'],
+    'training_update': ['action', 'reward', 'episode'],
+}
+
+FLAG_CRASHED = 1
+FLAG_HAS_CRASHED = 2  # sensor_update: le capteur fait la detection de crash ('crashed' present en JSON)
+
+
+def _value(value):
+    return float('nan') if value is None else float(value)
+
+
+def encode(event, data):
+    """Encode un evenement de EVENT_IDS en bytes. Leve KeyError pour un evenement sans format binaire"""
+    flags = FLAG_CRASHED if data.get('crashed') else 0
+
+    if event == 'car_position_update':
+        values = [data['position']['x'], data['position']['y'], data['rail_distance'],
+                  data['tangent']['x'], data['tangent']['y']]
+    elif event == 'sensor_update':
+        values = [data['voltage']]
+        if 'crashed' in data:
+            flags |= FLAG_HAS_CRASHED
+    elif event == 'training_update':
+        values = [_value(data.get('action')), _value(data.get('reward')), _value(data.get('episode'))]
+        # Etat de qlearn: un entier (etat discretise) ou une sequence plate
+        state = data.get('state')
+        if state is not None:
+            values.extend(float(v) for v in (state if isinstance(state, (list, tuple)) else [state]))
+    else:
+        raise KeyError(event)
+
+    return HEADER.pack(ENCODING_VERSION, EVENT_IDS[event], flags, len(values),
+                       data.get('timestamp') or 0.0) + struct.pack(f'<{len(values)}f', *values)
+
+
+def decode(payload):
+    """Retourne (evenement, dict au meme format que le JSON d'origine)"""
+    version, event_id, flags, nb_values, timestamp = HEADER.unpack_from(payload)
+    if version != ENCODING_VERSION:
+        raise ValueError(f"Version d'encodage non supportee: {version}")
+    event = EVENT_NAMES[event_id]
+    values = struct.unpack_from(f'<{nb_values}f', payload, HEADER.size)
+    crashed = bool(flags & FLAG_CRASHED)
+
+    if event == 'car_position_update':
+        x, y, rail_distance, tangent_x, tangent_y = values
+        data = {'position': {'x': x, 'y': y}, 'rail_distance': rail_distance,
+                'tangent': {'x': tangent_x, 'y': tangent_y}, 'crashed': crashed}
+    elif event == 'sensor_update':
+        data = {'voltage': values[0]}
+        if flags & FLAG_HAS_CRASHED:
+            data['crashed'] = crashed
+    else:
+        action, reward, episode = (None if math.isnan(v) else v for v in values[:3])
+        data = {'action': action, 'reward': reward, 'episode': None if episode is None else int(episode),
+                'state': list(values[3:]), 'crashed': crashed}
+    data['timestamp'] = timestamp
+    return event, data
+
+
+def make_encoder(encoding):
+    """Fonction (evenement, data) -> payload pour un client qui a negocie cet encodage"""
+    if encoding == BINARY_ENCODING:
+        return lambda event, data: encode(event, data) if event in EVENT_IDS else data
+    return lambda event, data: data
+
+
+def benchmark(nb_events=20000):
+    """Taille et cout CPU par evenement: JSON (comme Socket.IO le serialise) vs binaire"""
+    samples = {
+        'car_position_update': {'position': {'x': 412.37, 'y': 288.91}, 'rail_distance': 318.4, 'speed': 0,
+                                'tangent': {'x': 0.7071, 'y': -0.7071}, 'crashed': False,
+                                'timestamp': time.time()},
+        'sensor_update': {'voltage': 12.4137, 'timestamp': time.time(), 'crashed': False},
+        'training_update': {'state': [3, 1, 0, 2], 'action': 2, 'reward': 1.0, 'crashed': False,
+                            'episode': 42, 'timestamp': time.time()},
+    }
+    for event, data in samples.items():
+        json_payload = json.dumps(data, separators=(',', ':'))
+        binary_payload = encode(event, data)
+
+        start = time.perf_counter()
+        for _ in range(nb_events):
+            json.dumps(data, separators=(',', ':'))
+        json_us = (time.perf_counter() - start) / nb_events * 1e6
+
+        start = time.perf_counter()
+        for _ in range(nb_events):
+            encode(event, data)
+        binary_us = (time.perf_counter() - start) / nb_events * 1e6
+
+        start = time.perf_counter()
+        for _ in range(nb_events):
+            decode(binary_payload)
+        decode_us = (time.perf_counter() - start) / nb_events * 1e6
+
+        print(f"[WireFormat] {event:20s} JSON {len(json_payload):4d} o, {json_us:5.2f} us | "
+              f"binaire {len(binary_payload):3d} o, encodage {binary_us:5.2f} us, decodage {decode_us:5.2f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark des encodages d'evenements")
+    parser.add_argument('--events', type=int, default=20000)
+    args = parser.parse_args()
+    benchmark(args.events)